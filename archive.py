@@ -0,0 +1,307 @@
+"""
+Packed single-record sample storage.
+
+Each capture is one record appended to a segment file: a JSON header, the audio as
+24-bit FLAC and the dB mel matrix as float16. Stage transitions, labels and deletes
+are lines appended to a metadata journal, so nothing is ever moved or rewritten
+until ``compact()``. This replaces the png/wav/npy triplet per capture and the three
+renames per labeler action.
+
+Migrate the existing data/ layout with:
+
+    python archive.py migrate --data data --archive data/archive
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+from loguru import logger
+
+from sample_index import SortedIndex
+
+ARCHIVE_DIR = os.path.join("data", "archive")
+SEGMENT_SIZE = 64 * 1024 * 1024  # Bytes before a new segment file is started
+MAGIC = b"DSR1"
+RECORD_HEADER = struct.Struct("<4sI")  # magic, header length
+
+# Stages a capture moves through, matching the data/ directories
+INPUT = "input"
+UNCLASSIFIED = "unclassified"
+SAMPLES = "samples"
+STAGES = (INPUT, UNCLASSIFIED, SAMPLES)
+
+
+def sample_name(sample_id, meta):
+    """Base name the labeler shows, classified samples carry their status and tags like the file names did"""
+    if meta["stage"] == SAMPLES and meta.get("status"):
+        return "_".join([meta["status"], *meta.get("tags", []), sample_id])
+    return sample_id
+
+
+def parse_name(base):
+    """Split a classified file base name back into (status, tags, sample ID)"""
+    parts = base.split("_")
+    if len(parts) < 2:
+        return None, [], base
+    return parts[0], parts[1:-1], parts[-1]
+
+
+class SampleArchive:
+    def __init__(self, root=ARCHIVE_DIR, segment_size=SEGMENT_SIZE):
+        self.root = root
+        self.segment_size = segment_size
+        self.journal_path = os.path.join(root, "meta.jsonl")
+        self._lock = threading.Lock()
+
+        self._records = {}  # sample ID -> (segment path, offset of the payload, header)
+        self.meta = {}  # sample ID -> {"stage", "status", "tags", "created"}
+        self.stages = {stage: SortedIndex() for stage in STAGES}  # stage -> names
+        self._names = {stage: {} for stage in STAGES}  # stage -> name -> sample ID
+
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def __contains__(self, sample_id):
+        return sample_id in self.meta
+
+    def __len__(self):
+        return len(self.meta)
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.root, "segment-*.dat")))
+
+    def _load(self):
+        """Scan the segment headers, then replay the journal over the metadata they carry"""
+        meta = {}
+        for segment in self._segments():
+            with open(segment, "rb") as f:
+                while True:
+                    offset = f.tell()
+                    prefix = f.read(RECORD_HEADER.size)
+                    if len(prefix) < RECORD_HEADER.size:
+                        break
+                    magic, header_len = RECORD_HEADER.unpack(prefix)
+                    if magic != MAGIC:
+                        logger.warning(f"Corrupt record in {segment} at {offset}, ignoring the rest of the segment")
+                        break
+                    header = json.loads(f.read(header_len))
+                    self._records[header["id"]] = (segment, f.tell(), header)
+                    meta[header["id"]] = header["meta"]
+                    f.seek(header["audio_bytes"] + header["mel_bytes"], os.SEEK_CUR)
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry.get("deleted"):
+                        meta.pop(entry["id"], None)
+                    elif entry["id"] in self._records:
+                        meta[entry["id"]] = entry["meta"]
+
+        for sample_id, sample_meta in meta.items():
+            self._index(sample_id, sample_meta)
+        logger.info(f"Sample archive {self.root}: {len(self.meta)} samples in {len(self._segments())} segments")
+
+    def _index(self, sample_id, meta):
+        self.meta[sample_id] = meta
+        name = sample_name(sample_id, meta)
+        self.stages[meta["stage"]].add(name, meta["created"])
+        self._names[meta["stage"]][name] = sample_id
+
+    def _unindex(self, sample_id):
+        meta = self.meta.pop(sample_id)
+        name = sample_name(sample_id, meta)
+        self.stages[meta["stage"]].remove(name)
+        self._names[meta["stage"]].pop(name, None)
+        return meta
+
+    def _journal(self, entry):
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def _current_segment(self):
+        segments = self._segments()
+        if segments and os.path.getsize(segments[-1]) < self.segment_size:
+            return segments[-1]
+        return os.path.join(self.root, f"segment-{len(segments):06d}.dat")
+
+    def put(self, sample_id, audio, S_db, sr, stage=INPUT, status=None, tags=(), created=None):
+        """Append one capture as a single record, returns False if the ID is already stored"""
+        buffer = io.BytesIO()
+        sf.write(buffer, np.asarray(audio, dtype=np.float32), sr, format="FLAC", subtype="PCM_24")
+        audio_bytes = buffer.getvalue()
+        mel_bytes = np.ascontiguousarray(S_db, dtype=np.float16).tobytes()
+
+        meta = {"stage": stage, "status": status, "tags": list(tags), "created": created or time.time()}
+        header = json.dumps({
+            "id": sample_id,
+            "sr": sr,
+            "samples": len(audio),
+            "audio_bytes": len(audio_bytes),
+            "mel_shape": list(np.shape(S_db)),
+            "mel_bytes": len(mel_bytes),
+            "meta": meta,
+        }).encode()
+
+        with self._lock:
+            if sample_id in self.meta:
+                return False
+            segment = self._current_segment()
+            with open(segment, "ab") as f:
+                f.write(RECORD_HEADER.pack(MAGIC, len(header)))
+                f.write(header)
+                offset = f.tell()
+                f.write(audio_bytes)
+                f.write(mel_bytes)
+            self._records[sample_id] = (segment, offset, json.loads(header))
+            self._index(sample_id, meta)
+        return True
+
+    def _read(self, sample_id, skip, length):
+        segment, offset, _ = self._records[sample_id]
+        with open(segment, "rb") as f:
+            f.seek(offset + skip)
+            return f.read(length)
+
+    def read_audio(self, sample_id):
+        """Returns (float32 audio, sample rate)"""
+        header = self._records[sample_id][2]
+        audio, sr = sf.read(io.BytesIO(self._read(sample_id, 0, header["audio_bytes"])), dtype="float32")
+        return audio, sr
+
+    def read_mel(self, sample_id):
+        header = self._records[sample_id][2]
+        data = self._read(sample_id, header["audio_bytes"], header["mel_bytes"])
+        return np.frombuffer(data, dtype=np.float16).reshape(header["mel_shape"]).astype(np.float32)
+
+    def find(self, stage, name):
+        """Sample ID shown under a name in a stage, or None"""
+        return self._names[stage].get(name)
+
+    def name(self, sample_id):
+        return sample_name(sample_id, self.meta[sample_id])
+
+    def update(self, sample_id, **changes):
+        """Change stage, status or tags of a sample with one journal line"""
+        with self._lock:
+            meta = {**self._unindex(sample_id), **changes}
+            meta["tags"] = list(meta.get("tags") or [])
+            self._index(sample_id, meta)
+            self._journal({"id": sample_id, "meta": meta})
+        return meta
+
+    def delete(self, sample_id):
+        """Drop a sample, its record is reclaimed by compact()"""
+        with self._lock:
+            if sample_id not in self.meta:
+                return
+            self._unindex(sample_id)
+            self._journal({"id": sample_id, "deleted": True})
+
+    def restore(self, sample_id, meta):
+        """Bring back a deleted sample whose record has not been compacted away yet"""
+        with self._lock:
+            if sample_id in self.meta or sample_id not in self._records:
+                return False
+            self._index(sample_id, meta)
+            self._journal({"id": sample_id, "meta": meta})
+        return True
+
+    def compact(self):
+        """Rewrite the live records into fresh segments and reset the journal"""
+        with self._lock:
+            old_segments = self._segments()
+            live = [(sample_id, self._records[sample_id]) for sample_id in self.meta]
+            tmp_dir = os.path.join(self.root, "compact.tmp")
+            os.makedirs(tmp_dir, exist_ok=True)
+            records = {}
+            index, size, out = 0, 0, None
+            for sample_id, (segment, offset, header) in live:
+                if out is None or size >= self.segment_size:
+                    if out:
+                        out.close()
+                    out = open(os.path.join(tmp_dir, f"segment-{index:06d}.dat"), "wb")
+                    index, size = index + 1, 0
+                with open(segment, "rb") as f:
+                    f.seek(offset)
+                    payload = f.read(header["audio_bytes"] + header["mel_bytes"])
+                header = {**header, "meta": self.meta[sample_id]}
+                header_bytes = json.dumps(header).encode()
+                out.write(RECORD_HEADER.pack(MAGIC, len(header_bytes)))
+                out.write(header_bytes)
+                records[sample_id] = (os.path.basename(out.name), out.tell(), header)
+                out.write(payload)
+                size = out.tell()
+            if out:
+                out.close()
+
+            for segment in old_segments:
+                os.remove(segment)
+            for path in sorted(glob.glob(os.path.join(tmp_dir, "segment-*.dat"))):
+                os.replace(path, os.path.join(self.root, os.path.basename(path)))
+            os.rmdir(tmp_dir)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._records = {
+                sample_id: (os.path.join(self.root, name), offset, header)
+                for sample_id, (name, offset, header) in records.items()
+            }
+        logger.info(f"Compacted archive to {len(self._records)} samples")
+
+
+def migrate(data_dir, archive, sr, delete=False):
+    """Import the png/wav/npy triplets of data/{input,unclassified,samples} into the archive"""
+    import dedup
+    import features
+
+    imported = 0
+    for stage in STAGES:
+        for npy_path in sorted(glob.glob(os.path.join(data_dir, stage, "*.npy"))):
+            base, _ = os.path.splitext(os.path.basename(npy_path))
+            status, tags, _ = parse_name(base) if stage == SAMPLES else (None, [], base)
+            audio = np.load(npy_path)
+            # IDs are content hashes, older captures named otherwise are re-hashed
+            sample_id = dedup.content_id(audio)
+            created = os.path.getmtime(npy_path)
+            S_db = features.mel_db(audio, sr=sr)
+            if archive.put(sample_id, audio, S_db, sr, stage=stage, status=status, tags=tags, created=created):
+                imported += 1
+            if delete:
+                for ext in ("png", "wav", "npy"):
+                    path = os.path.join(data_dir, stage, f"{base}.{ext}")
+                    if os.path.exists(path):
+                        os.remove(path)
+    logger.info(f"Migrated {imported} samples into {archive.root}")
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="import the existing data/ directories")
+    migrate_parser.add_argument("--data", default="data")
+    migrate_parser.add_argument("--archive", default=ARCHIVE_DIR)
+    migrate_parser.add_argument("--sample-rate", type=int, default=48000)
+    migrate_parser.add_argument("--delete", action="store_true", help="remove the triplets once imported")
+    compact_parser = commands.add_parser("compact", help="reclaim space of deleted samples")
+    compact_parser.add_argument("--archive", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    archive = SampleArchive(args.archive)
+    if args.command == "migrate":
+        migrate(args.data, archive, args.sample_rate, delete=args.delete)
+    else:
+        archive.compact()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Offline re-segmentation and spectrogram extraction over recorded sessions.
+
+Long WAV/NPY recordings are streamed in chunks (NPY files are memory-mapped), run
+through the same TriggerDetector, detection defaults and mel parameters the sampler
+uses, and every segment is handed to a process pool that computes the spectrogram
+and writes the usual png/wav/npy triplet. No sound card is needed.
+
+A capture still open when a recording ends is kept, cut at the end of the audio
+like the sampler cuts one at max_duration, and logged as truncated.
+
+    python batch.py sessions/*.wav --output data/batch --workers 1,2,4
+
+With several worker counts the whole run is repeated for each and the throughput
+in audio-seconds per wall-second is reported per count.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import soundfile as sf
+from loguru import logger
+
+import dedup
+import detector
+import features
+import render
+import sampler
+from calibration import OnlineCalibrator
+
+SAMPLE_RATE = 48000
+CHUNK_DURATION = 10  # Seconds read per chunk while segmenting
+# Stop reason of a capture still open when the recording ends, next to detector.SILENCE and MAX_DURATION
+END_OF_RECORDING = "end_of_recording"
+
+
+class Recording:
+    """Chunked, random-access reader over a mono WAV or NPY recording"""
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith(".npy"):
+            self._array = np.load(path, mmap_mode="r")
+            self.sample_rate = SAMPLE_RATE
+            self.frames = len(self._array)
+        else:
+            self._array = None
+            info = sf.info(path)
+            self.sample_rate = info.samplerate
+            self.frames = info.frames
+
+    def read(self, start, stop):
+        """Samples [start, stop) as float32, first channel only"""
+        if self._array is not None:
+            return np.asarray(self._array[start:stop], dtype=np.float32)
+        audio, _ = sf.read(self.path, start=start, stop=stop, dtype="float32", always_2d=True)
+        return audio[:, 0]
+
+    def chunks(self, size):
+        for start in range(0, self.frames, size):
+            yield start, self.read(start, min(start + size, self.frames))
+
+
+def segment(recording, args):
+    """
+    Run the detector over a recording, returns [(start, stop, reason), ...] sample ranges including
+    pre-trigger audio and the detector's stop reason, END_OF_RECORDING for a capture cut by the end of it
+    """
+    sr = recording.sample_rate
+    calibrator = OnlineCalibrator()
+    calibrator.update(recording.read(0, min(recording.frames, sr * sampler.CALIBRATION_TIME // 1000)))
+    noise = args.noise_threshold if args.noise_threshold is not None else calibrator.noise_threshold()
+    silence = args.silence_threshold if args.silence_threshold is not None else calibrator.silence_threshold()
+
+    trigger_detector = detector.TriggerDetector(
+        sr, noise, silence,
+        min_duration=args.min_duration,
+        max_duration=args.max_duration,
+        silence_duration=args.silence_duration,
+        rolling_window=sampler.ROLLING_WINDOW,
+        hop=sampler.ENVELOPE_HOP,
+        hysteresis=sampler.SILENCE_HYSTERESIS,
+    )
+
+    segments = []
+    start = None
+
+    def close(stop, reason):
+        # The sampler discards anything shorter than a second
+        if stop - start >= sr:
+            segments.append((start, stop, reason))
+
+    for chunk_start, chunk in recording.chunks(CHUNK_DURATION * sr):
+        for event in trigger_detector.process(chunk):
+            if event[0] == detector.START:
+                start = max(0, chunk_start + event[1] - sampler.BUFFER_DURATION * sr)
+                continue
+            close(chunk_start + event[1], event[2])
+            start = None
+
+    if start is not None:
+        logger.warning(f"{recording.path}: capture still open at the end of the recording, keeping it truncated")
+        close(recording.frames, END_OF_RECORDING)
+    return segments
+
+
+def extract(task):
+    """Process pool worker, computes and saves one segment. Returns its length in samples"""
+    path, start, stop, output_dir, mode = task
+    recording = Recording(path)
+    audio = recording.read(start, stop)
+    filename = dedup.content_id(audio)
+
+    S_db = features.mel_db(audio, sr=recording.sample_rate)
+    render.save_spectrogram(S_db, os.path.join(output_dir, f"{filename}.png"), sr=recording.sample_rate, mode=mode)
+    sf.write(os.path.join(output_dir, f"{filename}.wav"), audio, recording.sample_rate)
+    np.save(os.path.join(output_dir, f"{filename}.npy"), audio)
+    return len(audio)
+
+
+def run(paths, workers, args):
+    """Segment and extract every recording with the given pool size, returns (audio seconds, wall seconds, segments)"""
+    started = time.perf_counter()
+    audio_seconds = 0.0
+    tasks = []
+    for path in paths:
+        recording = Recording(path)
+        audio_seconds += recording.frames / recording.sample_rate
+        tasks.extend((path, start, stop, args.output, args.mode) for start, stop, _ in segment(recording, args))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(extract, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+            pass
+    return audio_seconds, time.perf_counter() - started, len(tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="WAV or NPY recordings")
+    parser.add_argument("--output", default=os.path.join("data", "batch"))
+    parser.add_argument("--workers", default=str(os.cpu_count() or 1), help="comma separated pool sizes to run with")
+    parser.add_argument("--mode", default=render.FAST, choices=[render.FAST, render.PRETTY])
+    parser.add_argument("--noise-threshold", type=float)
+    parser.add_argument("--silence-threshold", type=float)
+    parser.add_argument("--min-duration", type=float, default=sampler.MIN_RECORDING_TIME)
+    parser.add_argument("--max-duration", type=float, default=sampler.MAX_RECORDING_TIME)
+    parser.add_argument("--silence-duration", type=float, default=sampler.SILENCE_DURATION)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    for workers in (int(w) for w in args.workers.split(",")):
+        audio_seconds, wall_seconds, count = run(args.files, workers, args)
+        logger.info(
+            f"workers={workers}: {count} segments from {audio_seconds:.1f} s of audio in {wall_seconds:.1f} s, "
+            f"{audio_seconds / wall_seconds:.1f} audio-s/wall-s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Microbenchmark of the per-block buffering work done in AudioClassifierApp.audio_callback.
+
+Compares the old deque/list buffering against the preallocated RingBuffer/CaptureBuffer.
+
+    python benchmarks/bench_callback.py --blocks 2000 --blocksize 1024
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from buffers import CaptureBuffer, RingBuffer  # noqa: E402
+
+SAMPLE_RATE = 48000
+BUFFER_SIZE = SAMPLE_RATE * 2
+MAX_RECORDING_TIME = 2
+
+
+def legacy_block(state, block, trigger):
+    state["ring"].extend(block)
+    if trigger:
+        state["captured"] = list(state["ring"])
+    state["captured"].extend(block)
+
+
+def preallocated_block(state, block, trigger):
+    state["ring"].write(block)
+    if trigger:
+        state["capture"].start(state["ring"].view())
+    else:
+        state["capture"].write(block)
+
+
+def run(step, state, blocks, trigger_every):
+    timings = np.empty(len(blocks))
+    for i, block in enumerate(blocks):
+        start = time.perf_counter()
+        step(state, block, i % trigger_every == 0)
+        timings[i] = time.perf_counter() - start
+    return timings
+
+
+def report(name, timings, blocksize):
+    budget = blocksize / SAMPLE_RATE
+    print(
+        f"{name:>14}: mean {timings.mean() * 1e6:8.1f} us  p99 {np.percentile(timings, 99) * 1e6:8.1f} us  "
+        f"max {timings.max() * 1e6:8.1f} us  ({timings.mean() / budget * 100:.2f}% of {budget * 1e3:.1f} ms block)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--blocksize", type=int, default=1024)
+    parser.add_argument("--trigger-every", type=int, default=200, help="blocks between simulated triggers")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    blocks = [rng.standard_normal(args.blocksize).astype(np.float32) * 0.01 for _ in range(args.blocks)]
+
+    legacy = {"ring": collections.deque(maxlen=BUFFER_SIZE), "captured": []}
+    report("deque/list", run(legacy_block, legacy, blocks, args.trigger_every), args.blocksize)
+
+    capacity = BUFFER_SIZE + SAMPLE_RATE * (MAX_RECORDING_TIME + 1)
+    prealloc = {"ring": RingBuffer(BUFFER_SIZE), "capture": CaptureBuffer(capacity)}
+    report("preallocated", run(preallocated_block, prealloc, blocks, args.trigger_every), args.blocksize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+End-to-end throughput of the capture pipeline and the labeler, on synthetic detector
+audio (see synthetic.py), so no detector or sound card is needed.
+
+capture: the AudioClassifierApp listens to a SyntheticSignal at each --target-rates
+    rate. Reports the share of targets caught by a saved capture, the false triggers,
+    the sustained trigger rate, callback time against the block budget, input
+    overruns, writer drops and the latency from the end of a capture (and from its
+    trigger) to its saved files.
+labeler: the store is grown to each of --sizes captures through the sampler's own
+    saving path, part of them filtered and classified with the bulk endpoints, then
+    every read endpoint is timed.
+
+Each part runs in a temporary working directory. Results are written as JSON for
+regression comparison, --compare lists what got worse than a previous run by more
+than --tolerance and exits with status 1 if anything did.
+
+    python benchmarks/bench_end_to_end.py --duration 60 --target-rates 0.2,0.5,1 --sizes 100,500,2000
+    python benchmarks/bench_end_to_end.py --compare benchmarks/results/previous.json
+"""
+import argparse
+import bisect
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import synthetic  # noqa: E402
+from storage import INPUT, SAMPLES, UNCLASSIFIED  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+STAGES = ("input", "unclassified", "samples")
+SUSTAINED_RECALL = 0.95  # Share of targets that must become captures for a rate to count as sustained
+# Endings of the result keys compared between runs, the rest are counts that describe the run
+HIGHER_IS_BETTER = ("recall", "sustained_rate", "realtime_factor")
+LOWER_IS_BETTER = ("_ms", ".p50", ".p95", ".max", "false_triggers", "dropped", "failed", "overflows",
+                   "callback_budget_share", "grow_seconds")
+
+
+@contextlib.contextmanager
+def working_directory():
+    """A fresh temporary directory with empty data/ stages as the current directory"""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        for stage in STAGES:
+            os.makedirs(os.path.join(tmp, "data", stage))
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(previous)
+
+
+def percentiles(values, scale=1e3):
+    """p50/p95/max of seconds, in milliseconds"""
+    if not len(values):
+        return {"p50": None, "p95": None, "max": None}
+    values = np.asarray(values) * scale
+    return {"p50": float(np.median(values)), "p95": float(np.percentile(values, 95)), "max": float(values.max())}
+
+
+def match_targets(signal, triggers, blocksize):
+    """
+    (targets caught, false triggers) for [(channel, sample position), ...] triggers. A
+    target is caught by a trigger on its channel between the block before it and its end.
+    """
+    targets = [event for event in signal.events if event["kind"] == synthetic.TARGET]
+    matched = set()
+    caught = 0
+    for event in targets:
+        hits = [i for i, (channel, position) in enumerate(triggers) if channel == event["channel"]
+                and event["start"] - blocksize <= position < event["stop"] and i not in matched]
+        if hits:
+            matched.add(hits[0])
+            caught += 1
+    return caught, len(triggers) - len(matched)
+
+
+def run_capture(rate, args):
+    """Capture a synthetic session at one target rate, returns its results"""
+    from sampler import AudioClassifierApp
+
+    with working_directory():
+        app = AudioClassifierApp()
+        signal = synthetic.SyntheticSignal(app.SAMPLE_RATE, len(app.channels), seed=args.seed,
+                                           duration=args.quiet + args.duration, quiet=args.quiet,
+                                           target_rate=rate, burst_rate=args.burst_rate)
+        streams = []
+        # When each block was handed to the sampler and where it starts in the signal, to place triggers
+        delivered_at, delivered_from = [], []
+
+        def open_stream(callback=None, **kwargs):
+            def timed_callback(indata, frames, time_info, status):
+                delivered_at.append(time.monotonic())
+                delivered_from.append(signal.position - frames)
+                callback(indata, frames, time_info, status)
+
+            stream = synthetic.InputStream(callback=timed_callback, signal=signal, speed=args.speed,
+                                           blocksize=args.blocksize, **kwargs)
+            streams.append(stream)
+            return stream
+
+        # Time every capture as it is handed to the registry, after its files are written
+        latencies, trigger_latencies, triggers = [], [], []
+        register = app.handoff
+
+        def timed_handoff(sample_id, audio_sample, S_db, **meta):
+            register(sample_id, audio_sample, S_db, **meta)
+            done = time.monotonic()
+            latencies.append(done - meta["captured_at"])
+            trigger_latencies.append(done - meta["triggered_at"])
+            block = bisect.bisect_right(delivered_at, meta["triggered_at"]) - 1
+            triggers.append((meta["channel"], delivered_from[max(block, 0)]))
+
+        app.handoff = timed_handoff
+        app.INPUT_STREAM = open_stream
+        app.set_sampling(True)
+
+        started = time.perf_counter()
+        threading.Thread(target=app.run, daemon=True).start()
+        while not signal.exhausted:
+            time.sleep(0.1)
+        wall = time.perf_counter() - started
+        # End the captures cut off by the end of the signal, then let the writers finish the queue
+        app.set_sampling(False)
+        for channel in app.channels:
+            if channel.recording:
+                app.stop_recording(channel.index)
+            channel.writer.stop(timeout=30)
+
+        writers = [channel.writer.stats() for channel in app.channels]
+        block_seconds = args.blocksize / app.SAMPLE_RATE
+        callbacks = [duration for stream in streams for duration in stream.callback_durations]
+        targets = signal.count(synthetic.TARGET, until=signal.length)
+        caught, false_triggers = match_targets(signal, triggers, args.blocksize)
+        result = {
+            "target_rate": rate,
+            "targets": targets,
+            "bursts": signal.count(synthetic.BURST, until=signal.length),
+            "triggers": sum(writer["submitted"] for writer in writers),
+            "saved": len(latencies),
+            "caught": caught,
+            "false_triggers": false_triggers,
+            "dropped": sum(writer["dropped"] for writer in writers),
+            "failed": sum(writer["failed"] for writer in writers),
+            "recall": caught / targets if targets else None,
+            "captures_per_minute": len(latencies) / args.duration * 60,
+            "realtime_factor": (args.quiet + args.duration) / wall,
+            "overflows": sum(stream.overflows for stream in streams),
+            "callback_ms": percentiles(callbacks),
+            "callback_budget_share": float(np.percentile(callbacks, 95)) / block_seconds if callbacks else None,
+            "capture_to_file_ms": percentiles(latencies),
+            "trigger_to_file_ms": percentiles(trigger_latencies),
+        }
+    return result
+
+
+def timed_requests(client, path, count, method="get", **kwargs):
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = getattr(client, method)(path, **kwargs)
+        timings.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{path}: HTTP {response.status_code}")
+    return percentiles(timings)
+
+
+def grow_store(labeler, signal, size):
+    """Save synthetic captures through the sampler until the store holds ``size``"""
+    sampler = labeler.sampler
+    stored = sum(len(labeler.storage.pending(stage, size)) for stage in (INPUT, UNCLASSIFIED, SAMPLES))
+    for _ in range(size - stored):
+        sampler.process_audio(signal.read(2 * sampler.SAMPLE_RATE)[:, 0].copy())
+    # The directory indexes pick the new files up from the file system watcher
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and \
+            sum(len(labeler.storage.pending(stage, size)) for stage in (INPUT, UNCLASSIFIED, SAMPLES)) < size:
+        time.sleep(0.05)
+
+
+def label_share(labeler, client, share, tags):
+    """Filter a share of the input queue and classify a share of the classify queue, timing the bulk requests"""
+    timings = {}
+    pending = labeler.storage.pending(INPUT, labeler.MAX_BULK_ITEMS)
+    ids = pending[:max(1, int(len(pending) * share))]
+    if pending:
+        started = time.perf_counter()
+        client.post(f"{labeler.API_PREFIX}/filter/bulk", json={"ids": ids, "status": "accept"})
+        timings["filter_bulk_per_item_ms"] = (time.perf_counter() - started) / len(ids) * 1e3
+    pending = labeler.storage.pending(UNCLASSIFIED, labeler.MAX_BULK_ITEMS)
+    ids = pending[:max(1, int(len(pending) * share))]
+    if pending:
+        started = time.perf_counter()
+        client.post(f"{labeler.API_PREFIX}/classify/bulk", json={"ids": ids, "status": "good", "tags": tags})
+        timings["classify_bulk_per_item_ms"] = (time.perf_counter() - started) / len(ids) * 1e3
+    return timings
+
+
+def run_labeler(args):
+    """Endpoint latency of the labeler at every store size, returns {size: results}"""
+    results = {}
+    with working_directory():
+        import labeler
+
+        labeler.create_app(start_sampler=False)
+        client = labeler.app.test_client()
+        signal = synthetic.SyntheticSignal(labeler.sampler.SAMPLE_RATE, seed=args.seed, target_rate=1.0,
+                                           burst_rate=args.burst_rate, quiet=0.0, min_gap=1.0)
+        api = labeler.API_PREFIX
+        for size in sorted(args.sizes):
+            started = time.perf_counter()
+            grow_store(labeler, signal, size)
+            grown = time.perf_counter() - started
+            result = {"grow_seconds": grown, **label_share(labeler, client, args.label_share, ["coin"])}
+
+            latest = labeler.storage.latest(SAMPLES, labeler.LATEST_X_FILES)
+            sample_id = labeler.storage.sample_id(SAMPLES, os.path.splitext(latest[0])[0]) if latest else None
+            endpoints = {
+                "sampler_status": f"{api}/sampler/status",
+                "tags": f"{api}/tags",
+                "next_filter_file": f"{api}/next_filter_file",
+                "next_classify_file": f"{api}/next_classify_file",
+                "samples": f"{api}/samples",
+                "labels": f"{api}/labels?stage=samples&limit=50",
+                "thumbnails": f"{api}/thumbnails?stage=samples&" + "&".join(f"files={name}" for name in latest),
+                "metrics": f"{api}/metrics",
+            }
+            if sample_id:
+                endpoints["similar"] = f"{api}/similar/{sample_id}"
+            result["endpoints_ms"] = {name: timed_requests(client, path, args.requests)
+                                      for name, path in endpoints.items()}
+            results[str(size)] = result
+            print(f"  {size} captures: " + ", ".join(f"{name} {timing['p50']:.1f}"
+                                                     for name, timing in result["endpoints_ms"].items()) + " ms p50")
+    return results
+
+
+def flatten(results, prefix=""):
+    """{"a.b.c": number} of every numeric leaf"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(current, previous, tolerance):
+    """Keys that got worse by more than ``tolerance``, as (key, previous, current) tuples"""
+    now, before = flatten(current), flatten(previous)
+    regressions = []
+    for key in sorted(now.keys() & before.keys()):
+        if key.startswith("meta."):
+            continue
+        if key.endswith(HIGHER_IS_BETTER):
+            worse = before[key] - now[key]
+        elif key.endswith(LOWER_IS_BETTER):
+            worse = now[key] - before[key]
+        else:
+            continue
+        # Anything at all is worse than a clean zero, e.g. the first dropped capture
+        if worse > tolerance * abs(before[key]) if before[key] else worse > 0:
+            regressions.append((key, before[key], now[key]))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--parts", default="capture,labeler", help="comma separated parts to run")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of synthetic audio per target rate")
+    parser.add_argument("--quiet", type=float, default=5, help="seconds of ground noise first, for calibration")
+    parser.add_argument("--target-rates", default="0.2,0.5", help="comma separated targets per second and channel")
+    parser.add_argument("--burst-rate", type=float, default=0.05, help="interference bursts per second")
+    parser.add_argument("--blocksize", type=int, default=1024)
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, 0 for as fast as possible")
+    parser.add_argument("--sizes", default="100,500,2000", help="comma separated store sizes")
+    parser.add_argument("--label-share", type=float, default=0.5, help="share of each queue labelled per size")
+    parser.add_argument("--requests", type=int, default=20, help="timed requests per endpoint and size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help=f"results file, by default a new one in {os.path.relpath(RESULTS_DIR)}")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative change reported as a regression")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    parts = args.parts.split(",")
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    results = {"meta": {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+    }}
+
+    if "capture" in parts:
+        results["capture"] = {}
+        for rate in (float(rate) for rate in args.target_rates.split(",")):
+            result = run_capture(rate, args)
+            results["capture"][str(rate)] = result
+            print(f"capture at {rate}/s: {result['caught']} of {result['targets']} targets caught, "
+                  f"{result['false_triggers']} false triggers ({result['bursts']} bursts), "
+                  f"{result['dropped']} dropped, {result['overflows']} overruns, "
+                  f"callback p95 {result['callback_ms']['p95'] or 0:.2f} ms, "
+                  f"capture to file p95 {result['capture_to_file_ms']['p95'] or 0:.0f} ms")
+        sustained = [result["target_rate"] for result in results["capture"].values()
+                     if (result["recall"] or 0) >= SUSTAINED_RECALL
+                     and not result["dropped"] and not result["overflows"]]
+        results["capture"]["sustained_rate"] = max(sustained, default=0.0)
+        print(f"sustained trigger rate: {results['capture']['sustained_rate']}/s per channel")
+
+    if "labeler" in parts:
+        print("labeler endpoints:")
+        results["labeler"] = run_labeler(args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"end_to_end-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(results, previous, args.tolerance)
+        for key, before, now in regressions:
+            print(f"REGRESSION {key}: {before:.4g} -> {now:.4g}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions over {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
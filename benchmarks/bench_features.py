@@ -0,0 +1,66 @@
+"""
+Mel feature extraction: per-call librosa against the shared precomputed extractor,
+one capture at a time and as a vectorized batch of equal-length captures.
+
+    python benchmarks/bench_features.py --captures 64 --seconds 2
+"""
+import argparse
+import os
+import sys
+import time
+
+import librosa
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import features  # noqa: E402
+
+SAMPLE_RATE = 48000
+
+
+def librosa_mel_db(audio):
+    """What the sampler and trainer did before the shared extractor"""
+    S = librosa.feature.melspectrogram(y=audio, sr=SAMPLE_RATE, **features.MEL_PARAMS)
+    return librosa.power_to_db(S, ref=np.max)
+
+
+def time_it(fn, repeats):
+    fn()  # warm up, also builds the cached filterbank
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.array(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--captures", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    batch = (0.1 * rng.standard_normal((args.captures, int(SAMPLE_RATE * args.seconds)))).astype(np.float32)
+
+    reference = np.stack([librosa_mel_db(audio) for audio in batch])
+    error = np.abs(features.mel_db_batch(batch, SAMPLE_RATE) - reference).max()
+
+    cases = {
+        "librosa per call": lambda: [librosa_mel_db(audio) for audio in batch],
+        "extractor per call": lambda: [features.mel_db(audio, SAMPLE_RATE) for audio in batch],
+        "extractor batch": lambda: features.mel_db_batch(batch, SAMPLE_RATE),
+    }
+    print(f"{args.captures} captures of {args.seconds:g} s, max difference to librosa {error:.2e} dB")
+    baseline = None
+    for name, fn in cases.items():
+        per_capture = time_it(fn, args.repeats) / args.captures
+        baseline = baseline or per_capture.mean()
+        print(f"{name:>20}: {per_capture.mean() * 1e3:7.2f} ms/capture  min {per_capture.min() * 1e3:7.2f} ms  "
+              f"x{baseline / per_capture.mean():.1f}")
+
+
+if __name__ == "__main__":
+    main()
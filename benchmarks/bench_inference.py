@@ -0,0 +1,160 @@
+"""
+Load time, memory footprint and per-sample latency of the exported classifier runtimes:
+the numpy PortableModel (float32 and int8 weights), TorchScript and the eager torch model.
+
+Every runtime is measured in a fresh interpreter, so import time and resident memory are
+what the sampler would pay at startup. Without --model a randomly initialized TagCNN is
+exported to a temporary directory; without torch only the portable runtimes are run, on
+random weights.
+
+    python benchmarks/bench_inference.py --tags 12 --frames 376 --batches 1,8
+    python benchmarks/bench_inference.py --model models/classifier
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import inference  # noqa: E402
+
+
+def rss_mib():
+    """Peak resident set size of this process"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(runtime, path, batches, repeats):
+    """Runs in the fresh interpreter: import, load, then time predictions"""
+    baseline = rss_mib()  # Interpreter and numpy
+    started = time.perf_counter()
+    if runtime == "eager":
+        import torch
+        import train
+
+        metadata = inference.load_metadata(path)
+        model = train.TagCNN(len(metadata["tags"]))
+        model.load_state_dict(torch.load(path, map_location="cpu"))
+        model.eval()
+        torch.set_num_threads(1)
+
+        def predict(batch):
+            with torch.inference_mode():
+                return torch.sigmoid(model(torch.from_numpy(batch))).numpy()
+    else:
+        predict = inference.load_model(path).predict
+        metadata = inference.load_metadata(path)
+    load_time = time.perf_counter() - started
+    loaded = rss_mib()
+
+    rng = np.random.default_rng(0)
+    n_mels = metadata.get("n_mels", 64)
+    latencies = {}
+    for size in batches:
+        batch = rng.uniform(-80, 0, (size, 1, n_mels, metadata["frames"])).astype(np.float32)
+        predict(batch)  # Warm up
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            predict(batch)
+            timings.append(time.perf_counter() - start)
+        latencies[size] = float(np.median(timings)) / size
+    print(json.dumps({"load_time": load_time, "baseline_mib": baseline, "loaded_mib": loaded,
+                      "peak_mib": rss_mib(), "latencies": latencies}))
+
+
+def random_portable(path, n_tags, frames, int8):
+    """A portable model with random weights in TagCNN's layout, for machines without torch"""
+    rng = np.random.default_rng(0)
+    graph, weights = [{"op": "affine", "scale": 1 / 40.0, "offset": 1.0}], {}
+    in_channels = 1
+    for i, out_channels in enumerate((16, 32, 64)):
+        name = f"layers.{i}"
+        graph += [{"op": "conv2d", "name": name, "padding": 1}, {"op": "relu"}]
+        if i < 2:
+            graph.append({"op": "maxpool2d", "kernel": 2})
+        scale = (2 / (9 * in_channels)) ** 0.5
+        weights[f"{name}.weight"] = rng.standard_normal((out_channels, in_channels, 3, 3)) * scale
+        weights[f"{name}.bias"] = np.zeros(out_channels)
+        in_channels = out_channels
+    graph += [{"op": "global_avg_pool"}, {"op": "linear", "name": "head"}]
+    weights["head.weight"] = rng.standard_normal((n_tags, in_channels)) * in_channels ** -0.5
+    weights["head.bias"] = np.zeros(n_tags)
+    metadata = {"tags": [f"tag{i}" for i in range(n_tags)], "n_mels": 64, "frames": frames}
+    inference.save_portable(path, graph, weights, metadata, int8=int8)
+
+
+def export_models(tmp, n_tags, frames):
+    """{runtime: path} of the models to compare, exported to a temporary directory"""
+    try:
+        import torch
+        import train
+    except ImportError:
+        print("torch is not installed, comparing the portable runtimes only")
+        for int8, runtime in ((False, "numpy"), (True, "numpy-int8")):
+            random_portable(os.path.join(tmp, f"{runtime}.npz"), n_tags, frames, int8)
+        return {runtime: os.path.join(tmp, f"{runtime}.npz") for runtime in ("numpy", "numpy-int8")}
+
+    model = train.TagCNN(n_tags)
+    tags = [f"tag{i}" for i in range(n_tags)]
+    train.export(model, os.path.join(tmp, "float"), tags, frames)
+    train.export(model, os.path.join(tmp, "int8"), tags, frames, int8=True)
+    # The eager model is rebuilt from a state dict next to the same metadata
+    torch.save(model.state_dict(), os.path.join(tmp, "float.pth"))
+    return {
+        "numpy": os.path.join(tmp, "float.npz"),
+        "numpy-int8": os.path.join(tmp, "int8.npz"),
+        "torchscript": os.path.join(tmp, "float.pt"),
+        "eager": os.path.join(tmp, "float.pth"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="exported model path without extension, random weights if not given")
+    parser.add_argument("--tags", type=int, default=12)
+    parser.add_argument("--frames", type=int, default=376, help="input width, 376 frames is 2 s at 48 kHz")
+    parser.add_argument("--batches", default="1,8", help="comma separated batch sizes")
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--child", nargs=2, metavar=("RUNTIME", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    batches = [int(size) for size in args.batches.split(",")]
+
+    if args.child:
+        child(*args.child, batches, args.repeats)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.model:
+            models = {runtime: f"{args.model}{ext}" for runtime, ext in
+                      (("numpy", ".npz"), ("torchscript", ".pt"), ("eager", ".pth"))
+                      if os.path.exists(f"{args.model}{ext}")}
+        else:
+            models = export_models(tmp, args.tags, args.frames)
+
+        print(f"{'runtime':<12} {'file KiB':>9} {'load s':>8} {'RSS MiB':>8} {'+load MiB':>10} {'peak MiB':>9}  "
+              + "  ".join(f"{f'ms/sample @{size}':>14}" for size in batches))
+        for runtime, path in models.items():
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", runtime, path,
+                                  "--batches", args.batches, "--repeats", str(args.repeats)],
+                                 capture_output=True, text=True, cwd=ROOT)
+            if out.returncode:
+                print(f"{runtime:<12} failed: {out.stderr.strip().splitlines()[-1]}")
+                continue
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{runtime:<12} {os.path.getsize(path) / 1024:>9.0f} {result['load_time']:>8.3f} "
+                  f"{result['baseline_mib']:>8.1f} {result['loaded_mib'] - result['baseline_mib']:>10.1f} "
+                  f"{result['peak_mib']:>9.1f}  "
+                  + "  ".join(f"{result['latencies'][str(size)] * 1e3:>14.2f}" for size in batches))
+
+
+if __name__ == "__main__":
+    main()
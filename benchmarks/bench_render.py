@@ -0,0 +1,60 @@
+"""
+Per-capture cost of the fast LUT spectrogram renderer against the matplotlib "pretty" path.
+
+    python benchmarks/bench_render.py --repeats 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import librosa
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import render  # noqa: E402
+
+SAMPLE_RATE = 48000
+
+
+def capture(seconds=3.0):
+    """Synthetic two-tone capture with a little noise, roughly what a target sweep looks like"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    envelope = np.exp(-((t - seconds / 2) ** 2) / 0.1)
+    y = envelope * (0.4 * np.sin(2 * np.pi * 650 * t) + 0.2 * np.sin(2 * np.pi * 1300 * t))
+    return (y + 0.01 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def time_it(fn, repeats):
+    fn()  # warm up, this also covers first-use imports for the pretty path
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.array(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    S = librosa.feature.melspectrogram(y=capture(), sr=SAMPLE_RATE, n_fft=1024, hop_length=256, n_mels=64, fmax=12000)
+    S_db = librosa.power_to_db(S, ref=np.max)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "capture.png")
+        for mode in (render.FAST, render.PRETTY):
+            timings = time_it(lambda: render.save_spectrogram(S_db, path, sr=SAMPLE_RATE, mode=mode), args.repeats)
+            print(
+                f"{mode:>6}: mean {timings.mean() * 1e3:8.2f} ms  min {timings.min() * 1e3:8.2f} ms  "
+                f"png {os.path.getsize(path) / 1024:7.1f} KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Query latency of the similarity index at a given number of samples.
+
+    python benchmarks/bench_similarity.py --samples 100000 --queries 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import similarity  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--labelled", type=float, default=0.5, help="share of samples flagged as classified")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.samples, similarity.DIMENSIONS)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = similarity.SimilarityIndex(tmp)
+        start = time.perf_counter()
+        for i, vector in enumerate(vectors):
+            index.add(f"{i:040x}", vector, labelled=rng.random() < args.labelled)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        similarity.SimilarityIndex(tmp)
+        load_time = time.perf_counter() - start
+
+        timings = []
+        for row in rng.integers(0, args.samples, args.queries):
+            start = time.perf_counter()
+            index.search(vectors[row], k=args.k, exclude=[f"{row:040x}"])
+            timings.append(time.perf_counter() - start)
+        timings = np.array(timings)
+
+    print(f"{args.samples} samples x {similarity.DIMENSIONS} dims, "
+          f"{vectors.nbytes / 2 ** 20:.1f} MiB, added in {build_time:.2f} s, loaded in {load_time:.2f} s")
+    print(f"search k={args.k}: mean {timings.mean() * 1e3:.2f} ms  p95 {np.percentile(timings, 95) * 1e3:.2f} ms  "
+          f"max {timings.max() * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Cold start of the labeler web UI, each run in a fresh interpreter:
+
+- import: ``import labeler``, which should only define the routes
+- create_app: sampler, label store, indexes and websocket, with sampler_process set
+  and start_sampler off, which must neither spawn the sampler process nor open a stream
+- first request: GET /api/sampler/status through the Flask test client
+- audio: importing and configuring sounddevice, with --audio only
+
+Runs in a temporary directory with empty data/ stages unless --data points at a real
+one, e.g. the field device's working directory.
+
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --data /home/pi/detectonist --audio --importtime 15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should not be loaded by ``import labeler`` alone
+HEAVY_MODULES = ["sampler", "sounddevice", "librosa", "scipy.fft", "matplotlib", "torch"]
+
+CHILD = """
+import json, subprocess, sys, time
+spawned = []
+popen = subprocess.Popen.__init__
+subprocess.Popen.__init__ = lambda self, args, *rest, **kwargs: (spawned.append(args), popen(self, args, *rest, **kwargs))[1]
+started = time.perf_counter()
+import labeler
+imported = time.perf_counter()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+labeler.create_app(sampler_process=True, start_sampler=False)
+created = time.perf_counter()
+assert not spawned, f"create_app(start_sampler=False) spawned {{spawned}}"
+assert "sounddevice" not in sys.modules, "create_app(start_sampler=False) opened the audio device"
+response = labeler.app.test_client().get(labeler.API_PREFIX + "/sampler/status")
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+audio = None
+if {audio!r}:
+    import sampler
+    sampler.sounddevice()
+    audio = time.perf_counter() - served
+print(json.dumps({{"import": imported - started, "create_app": created - imported,
+                  "first_request": served - created, "audio": audio, "heavy": heavy}}))
+"""
+
+
+def cold_start(cwd, audio, importtime=False):
+    """(phases, wall-clock seconds from spawn to first response, import time log) of one run"""
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []),
+               "-c", CHILD.format(heavy=HEAVY_MODULES, audio=audio)]
+    path = os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))
+    started = time.perf_counter()
+    out = subprocess.run(command, cwd=cwd, capture_output=True, text=True, env={**os.environ, "PYTHONPATH": path})
+    wall = time.perf_counter() - started
+    if out.returncode:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1])
+    return json.loads(out.stdout.strip().splitlines()[-1]), wall, out.stderr
+
+
+def slowest_imports(log, count):
+    """The modules with the longest cumulative import time in a -X importtime log"""
+    rows = []
+    for line in log.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--data", help="working directory holding data/, a fresh temporary one if not given")
+    parser.add_argument("--audio", action="store_true", help="also time sounddevice import and device query")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="list the N slowest imports")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = args.data or tmp
+        for stage in ("input", "unclassified", "samples"):
+            os.makedirs(os.path.join(cwd, "data", stage), exist_ok=True)
+
+        runs = [cold_start(cwd, args.audio) for _ in range(args.runs)]
+        if args.importtime:
+            _, _, log = cold_start(cwd, args.audio, importtime=True)
+
+    phases = ["import", "create_app", "first_request", *(["audio"] if args.audio else [])]
+    print(f"{args.runs} cold starts in {cwd if args.data else 'a temporary directory'}")
+    for phase in phases:
+        values = np.array([result[phase] for result, _, _ in runs])
+        print(f"{phase:<14} median {np.median(values) * 1e3:8.1f} ms  max {values.max() * 1e3:8.1f} ms")
+    walls = np.array([wall for _, wall, _ in runs])
+    print(f"{'spawn to ready':<14} median {np.median(walls) * 1e3:8.1f} ms  max {walls.max() * 1e3:8.1f} ms")
+    heavy = runs[0][0]["heavy"]
+    print(f"heavy modules loaded by import labeler: {', '.join(heavy) if heavy else 'none'}")
+
+    if args.importtime:
+        print("\nslowest imports (cumulative):")
+        for cumulative, name in slowest_imports(log, args.importtime):
+            print(f"{cumulative / 1e3:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-size float32 ring buffer that takes whole callback blocks.
+
+    Every block is written twice, at ``pos`` and ``pos + size``, so the most
+    recent ``size`` samples are always one contiguous slice of the backing
+    array and ``view()`` never has to copy or concatenate. With ``channels``
+    set it holds (samples, channels) frames of a multi-channel stream.
+    """
+
+    def __init__(self, size, dtype=np.float32, channels=None):
+        self.size = int(size)
+        self._buffer = np.zeros((2 * self.size,) if channels is None else (2 * self.size, channels), dtype=dtype)
+        self._pos = 0
+        self._filled = 0
+
+    def __len__(self):
+        return self._filled
+
+    def clear(self):
+        self._pos = 0
+        self._filled = 0
+
+    def write(self, block):
+        """Append a block of samples, overwriting the oldest ones"""
+        n = len(block)
+        if n >= self.size:
+            # Block alone fills the ring, keep its tail
+            block = block[-self.size:]
+            self._buffer[:self.size] = block
+            self._buffer[self.size:] = block
+            self._pos = 0
+            self._filled = self.size
+            return
+
+        end = self._pos + n
+        if end <= self.size:
+            self._buffer[self._pos:end] = block
+            self._buffer[self._pos + self.size:end + self.size] = block
+        else:
+            split = self.size - self._pos
+            self._buffer[self._pos:self.size] = block[:split]
+            self._buffer[self._pos + self.size:] = block[:split]
+            self._buffer[:n - split] = block[split:]
+            self._buffer[self.size:self.size + n - split] = block[split:]
+        self._pos = end % self.size
+        self._filled = min(self._filled + n, self.size)
+
+    def view(self):
+        """Zero-copy view of the buffered samples, oldest first"""
+        end = self._pos + self.size
+        return self._buffer[end - self._filled:end]
+
+
+class CaptureBuffer:
+    """
+    Preallocated float32 buffer a single capture is recorded into.
+
+    ``view()`` returns a zero-copy slice that stays valid until the next
+    ``start()``; callers that keep the audio around longer must copy it.
+    """
+
+    def __init__(self, capacity, dtype=np.float32):
+        self.capacity = int(capacity)
+        self._buffer = np.zeros(self.capacity, dtype=dtype)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def start(self, pre_trigger=None):
+        """Reset the buffer, seeding it with the pre-trigger samples"""
+        self._length = 0
+        if pre_trigger is not None:
+            self.write(pre_trigger)
+
+    def write(self, block):
+        """Append a block, truncating once capacity is reached"""
+        n = min(len(block), self.capacity - self._length)
+        if n <= 0:
+            return 0
+        self._buffer[self._length:self._length + n] = block[:n]
+        self._length += n
+        return n
+
+    def full(self):
+        return self._length >= self.capacity
+
+    def view(self):
+        return self._buffer[:self._length]
@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class OnlineCalibrator:
+    """
+    Streaming estimator of the absolute amplitude distribution of the input.
+
+    Keeps running moments and a log-spaced histogram sketch of |x|, so memory and
+    per-block cost are constant no matter how long it runs. With ``decay_window`` set
+    (in samples) older blocks are exponentially forgotten, which lets the thresholds
+    follow slow changes such as ground mineralization while capture keeps running.
+
+    With ``channels`` set, blocks are (samples, channels) and every channel is tracked
+    separately in the same vectorized update; the estimates are then arrays with one
+    value per channel instead of floats.
+    """
+
+    def __init__(self, decay_window=None, bins=512, min_amplitude=1e-6, max_amplitude=1.0, channels=None):
+        self.decay_window = decay_window
+        self.channels = channels
+        rows = channels or 1
+        # Bin edges for |x|, anything below the first edge lands in bin 0, above the last in the top bin
+        self._edges = np.geomspace(min_amplitude, max_amplitude, bins + 1)
+        self._histogram = np.zeros((rows, bins), dtype=np.float64)
+        self._count = np.zeros(rows, dtype=np.float64)
+        self._sum = np.zeros(rows, dtype=np.float64)
+        self._sum_sq = np.zeros(rows, dtype=np.float64)
+
+    def _result(self, values):
+        return float(values[0]) if self.channels is None else values
+
+    @property
+    def count(self):
+        return self._result(self._count)
+
+    def reset(self, channel=None):
+        """Forget everything, or only what was seen on one channel"""
+        rows = slice(None) if channel is None else channel
+        self._count[rows] = 0.0
+        self._sum[rows] = 0.0
+        self._sum_sq[rows] = 0.0
+        self._histogram[rows] = 0.0
+
+    def update(self, block, mask=None):
+        """Fold one block of samples into the estimate, only into the channels selected by ``mask`` if given"""
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block[:, None]
+        if mask is None:
+            rows = np.arange(block.shape[1])
+            amplitude = np.abs(block)
+        else:
+            rows = np.flatnonzero(mask)
+            amplitude = np.abs(block[:, rows])
+        n = len(amplitude)
+        if n == 0 or len(rows) == 0:
+            return
+
+        if self.decay_window:
+            weight = np.exp(-n / self.decay_window)
+            self._count[rows] *= weight
+            self._sum[rows] *= weight
+            self._sum_sq[rows] *= weight
+            self._histogram[rows] *= weight
+
+        bins = self._histogram.shape[1]
+        self._count[rows] += n
+        self._sum[rows] += np.sum(amplitude, axis=0, dtype=np.float64)
+        self._sum_sq[rows] += np.einsum("ij,ij->j", amplitude, amplitude, dtype=np.float64)
+        index = np.searchsorted(self._edges, amplitude, side="right") - 1
+        np.clip(index, 0, bins - 1, out=index)
+        # One bincount for all channels, each channel offset into its own run of bins
+        index += np.arange(len(rows)) * bins
+        self._histogram[rows] += np.bincount(index.ravel(), minlength=len(rows) * bins).reshape(len(rows), bins)
+
+    def _mean(self):
+        return np.divide(self._sum, self._count, out=np.zeros_like(self._sum), where=self._count > 0)
+
+    def mean(self):
+        return self._result(self._mean())
+
+    def _std(self):
+        mean_sq = np.divide(self._sum_sq, self._count, out=np.zeros_like(self._sum_sq), where=self._count > 0)
+        return np.sqrt(np.maximum(mean_sq - self._mean() ** 2, 0.0))
+
+    def std(self):
+        return self._result(self._std())
+
+    def _percentile(self, q):
+        cumulative = np.cumsum(self._histogram, axis=1)
+        target = q / 100.0 * cumulative[:, -1]
+        rows = np.arange(len(cumulative))
+        i = np.minimum(np.sum(cumulative < target[:, None], axis=1), cumulative.shape[1] - 1)
+        below = np.where(i > 0, cumulative[rows, i - 1], 0.0)
+        in_bin = self._histogram[rows, i]
+        fraction = np.divide(target - below, in_bin, out=np.zeros_like(target), where=in_bin > 0)
+        low, high = self._edges[i], self._edges[i + 1]
+        return np.where(self._count > 0, low * (high / low) ** fraction, 0.0)
+
+    def percentile(self, q):
+        """Approximate q-th percentile of |x|, interpolated geometrically within a bin"""
+        return self._result(self._percentile(q))
+
+    def noise_threshold(self, percentile=95, factor=1.2):
+        return self._result(self._percentile(percentile) * factor)
+
+    def silence_threshold(self, std_factor=0.5):
+        return self._result(self._mean() + self._std() * std_factor)
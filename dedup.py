@@ -0,0 +1,90 @@
+import glob
+import hashlib
+import os
+import threading
+
+import numpy as np
+from loguru import logger
+
+INDEX_FILE = os.path.join("data", "dedup.idx")
+
+
+def content_id(audio_sample):
+    """
+    Sample ID computed from the raw float32 bytes of the capture.
+
+    blake2b with a 20 byte digest keeps the 40 hex character IDs the sha1 names had,
+    and hashes the buffer in place without formatting or copying it.
+    """
+    audio_array = np.ascontiguousarray(audio_sample, dtype=np.float32)
+    return hashlib.blake2b(memoryview(audio_array).cast("B"), digest_size=20).hexdigest()
+
+
+class DedupIndex:
+    """
+    Set of sample IDs already captured, persisted as an append-only file of one ID per line.
+
+    Lookups never touch the sample directories. If the index file does not exist yet it is
+    seeded once, from ``seed_ids()`` when stored captures are already keyed by their ID
+    (the archive), otherwise by hashing the .npy files found under the given directories.
+    """
+
+    def __init__(self, path=INDEX_FILE, seed_dirs=(), seed_ids=None):
+        self.path = path
+        self._ids = set()
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self._ids.update(line.strip() for line in f if line.strip())
+            logger.info(f"Loaded {len(self._ids)} sample ids from {self.path}")
+        elif seed_ids is not None:
+            self.rebuild(ids=seed_ids())
+        elif seed_dirs:
+            self.rebuild(seed_dirs)
+
+    def __contains__(self, sample_id):
+        return sample_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, sample_id):
+        """Record a sample ID, returns False if it was already known"""
+        with self._lock:
+            if sample_id in self._ids:
+                return False
+            self._ids.add(sample_id)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(f"{sample_id}\n")
+            return True
+
+    def discard(self, sample_id):
+        """Forget a sample ID, so the same audio can be captured again"""
+        with self._lock:
+            if sample_id not in self._ids:
+                return
+            self._ids.discard(sample_id)
+            self._write()
+
+    def rebuild(self, dirs=(), ids=()):
+        """Rewrite the index with the given IDs and those of every .npy under the given directories"""
+        ids = set(ids)
+        for directory in dirs:
+            for npy_path in glob.glob(os.path.join(directory, "*.npy")):
+                try:
+                    ids.add(content_id(np.load(npy_path)))
+                except Exception as e:
+                    logger.warning(f"Could not hash {npy_path}: {e}")
+        with self._lock:
+            self._ids = ids
+            self._write()
+        logger.info(f"Rebuilt dedup index with {len(ids)} sample ids")
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(f"{sample_id}\n" for sample_id in sorted(self._ids))
+        os.replace(tmp_path, self.path)
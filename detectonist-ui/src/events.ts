@@ -0,0 +1,22 @@
+// events.ts
+import { io } from "socket.io-client";
+
+// Single shared connection to the labeler's push channel. The library's default transports
+// start on long polling and upgrade to a websocket, and it reconnects with backoff by itself
+export const socket = io();
+
+// Event names, matching events.py
+export const NEW_CAPTURE = "new_capture";
+export const FILTERED = "filtered";
+export const CLASSIFIED = "classified";
+export const SAMPLES_CHANGED = "samples_changed";
+export const CALIBRATION_COMPLETE = "calibration_complete";
+export const SAMPLER_STATUS = "sampler_status";
+
+// Subscribe to several events with one handler, returns a function that unsubscribes.
+// "connect" is always included so views resync after a reconnect.
+export const subscribe = (names: string[], handler: (...args: any[]) => void) => {
+  const all = ["connect", ...names];
+  all.forEach((name) => socket.on(name, handler));
+  return () => all.forEach((name) => socket.off(name, handler));
+};
@@ -24,6 +24,10 @@ export default defineConfig({
         changeOrigin: true,
         rewrite: (path) => path.replace(/^\/api/, ""), // 🔥 Removes `/api` prefix
       },
+      "/socket.io": {
+        target: "http://127.0.0.1:8080", // Flask-SocketIO push channel
+        ws: true,
+      },
     },
   },
   build: {
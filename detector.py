@@ -0,0 +1,220 @@
+import numpy as np
+
+START = "start"
+STOP = "stop"
+
+# Reasons a capture stops
+MAX_DURATION = "max_duration"
+SILENCE = "silence"
+
+
+class MultiChannelDetector:
+    """
+    Trigger/silence state machine driven purely by sample counts, for every channel of a stream.
+
+    Incoming (samples, channels) blocks are cut into fixed ``hop`` sized envelope
+    frames aligned to the stream position, so decisions do not depend on the audio
+    block size or on wall-clock time. Per frame and channel the peak and mean absolute
+    amplitude are computed in one vectorized pass over the block, and each frame
+    advances the state of all channels with array operations, every channel keeping
+    its own thresholds and capture state.
+
+    A capture starts on the first frame whose peak exceeds ``noise_threshold``. Once
+    ``min_duration`` has passed it stops after ``silence_duration`` of the rolling level,
+    the mean over ``rolling_window`` frames of their mean |x|, staying below
+    ``silence_threshold``, or at ``max_duration`` from the trigger. Mean |x| is what the
+    calibrated silence threshold is measured in, frame RMS would sit a quarter higher on
+    the same noise. The silence timer is only cancelled once the rolling level climbs back above
+    ``silence_threshold * hysteresis``, so a signal hovering at the threshold does not
+    keep restarting it.
+
+    ``process()`` returns ``(channel, START, offset, peak)`` and ``(channel, STOP, offset,
+    reason)`` events carrying the sample index within the block at which the capture
+    starts or stops.
+    """
+
+    def __init__(self, sample_rate, channels, noise_threshold, silence_threshold, min_duration=1.0,
+                 max_duration=2.0, silence_duration=1.0, rolling_window=20, hop=256, hysteresis=1.25):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        # Scalars apply to every channel, set single entries for per-channel thresholds
+        self.noise_threshold = np.full(channels, noise_threshold, dtype=np.float64)
+        self.silence_threshold = np.full(channels, silence_threshold, dtype=np.float64)
+        self.hop = hop
+        self.hysteresis = hysteresis
+        self.min_samples = int(min_duration * sample_rate)
+        self.max_samples = int(max_duration * sample_rate)
+        self.silence_samples = int(silence_duration * sample_rate)
+        self.rolling_window = rolling_window
+
+        self._carry = np.zeros((hop, channels), dtype=np.float32)
+        self._level_window = np.zeros((rolling_window, channels), dtype=np.float64)
+        self.recording = np.zeros(channels, dtype=bool)
+        self.trigger_position = np.zeros(channels, dtype=np.int64)
+        self.silence_start = np.full(channels, -1, dtype=np.int64)  # -1 while not silent
+        self.trigger_peak = np.zeros(channels, dtype=np.float64)
+        self._level_count = np.zeros(channels, dtype=np.int64)
+        self._level_sum = np.zeros(channels, dtype=np.float64)
+        self.reset()
+
+    def reset(self, channel=None):
+        """Forget the capture in progress on one channel, or on all of them and the stream position"""
+        if channel is None:
+            self.position = 0  # Samples seen since the stream started
+            self._carry_len = 0
+            channel = slice(None)
+        self.recording[channel] = False
+        self.trigger_position[channel] = 0
+        self.silence_start[channel] = -1
+        self.trigger_peak[channel] = 0.0
+        self._level_count[channel] = 0
+        self._level_sum[channel] = 0.0
+
+    def envelopes(self, block):
+        """
+        Cut the carried-over samples plus the block into frames.
+
+        Returns per-frame and channel peak and mean |x|, shape (frames, channels), and
+        the offset within the block just past each frame.
+        """
+        n = len(block)
+        if self._carry_len + n < self.hop:
+            self._carry[self._carry_len:self._carry_len + n] = block
+            self._carry_len += n
+            empty = np.empty((0, self.channels))
+            return empty, empty, np.empty(0, dtype=np.int64)
+
+        # Samples needed to complete the frame carried over from the previous block
+        head = self.hop - self._carry_len if self._carry_len else 0
+        whole = (n - head) // self.hop
+        body = block[head:head + whole * self.hop].reshape(whole, self.hop, self.channels)
+        magnitude = np.abs(body)
+        peak = np.max(magnitude, axis=1) if whole else np.empty((0, self.channels))
+        level = np.mean(magnitude, axis=1, dtype=np.float64) if whole else np.empty((0, self.channels))
+        ends = head + self.hop * np.arange(1, whole + 1)
+
+        if head:
+            self._carry[self._carry_len:] = block[:head]
+            carried = np.abs(self._carry)
+            peak = np.concatenate([np.max(carried, axis=0)[None], peak])
+            level = np.concatenate([np.mean(carried, axis=0, dtype=np.float64)[None], level])
+            ends = np.concatenate([[head], ends])
+
+        tail = block[head + whole * self.hop:]
+        self._carry_len = len(tail)
+        self._carry[:self._carry_len] = tail
+        return peak, level, ends
+
+    def process(self, block, active=None):
+        """
+        Advance the state machine over one (samples, channels) block.
+
+        Channels where ``active`` is False do not start new captures. Returns events in
+        stream order.
+        """
+        block = np.asarray(block).reshape(len(block), self.channels)
+        block_start = self.position
+        peak, level, ends = self.envelopes(block)
+        self.position += len(block)
+        armed = self.noise_threshold if active is None else np.where(active, self.noise_threshold, np.inf)
+
+        events = []
+        i = 0
+        while i < len(ends):
+            recording = self.recording.copy()
+            if not recording.any():
+                # Vectorized scan for the next frame that triggers any channel
+                above = np.flatnonzero(np.any(peak[i:] > armed, axis=1))
+                if not len(above):
+                    break
+                i += int(above[0])
+
+            frame_end = block_start + int(ends[i])
+            if recording.any():
+                self._push_level(level[i], recording)
+                events.extend((int(channel), STOP, stop - block_start, reason)
+                              for channel, stop, reason in self._check_stop(frame_end, recording))
+
+            # Channels that were idle before this frame start on it, the frame is not part of their level window
+            for channel in np.flatnonzero(~recording & (peak[i] > armed)):
+                self._start(channel, frame_end, float(peak[i, channel]))
+                events.append((int(channel), START, int(ends[i]), float(self.trigger_peak[channel])))
+            i += 1
+
+        # The maximum length can also be reached in the samples after the last full frame
+        over = self.recording & (self.position - self.trigger_position >= self.max_samples)
+        for channel in np.flatnonzero(over):
+            stop = int(self.trigger_position[channel]) + self.max_samples
+            self._stop(channel)
+            events.append((int(channel), STOP, stop - block_start, MAX_DURATION))
+        events.sort(key=lambda event: event[2])
+        return events
+
+    def _start(self, channel, position, peak):
+        self.recording[channel] = True
+        self.trigger_position[channel] = position
+        self.trigger_peak[channel] = peak
+        self.silence_start[channel] = -1
+        self._level_count[channel] = 0
+        self._level_sum[channel] = 0.0
+
+    def _stop(self, channel):
+        self.recording[channel] = False
+        self.trigger_position[channel] = 0
+        self.silence_start[channel] = -1
+
+    def _push_level(self, values, mask):
+        channels = np.flatnonzero(mask)
+        slots = self._level_count[channels] % self.rolling_window
+        full = self._level_count[channels] >= self.rolling_window
+        self._level_sum[channels] -= np.where(full, self._level_window[slots, channels], 0.0)
+        self._level_window[slots, channels] = values[channels]
+        self._level_sum[channels] += values[channels]
+        self._level_count[channels] += 1
+
+    def rolling_level(self):
+        """Mean |x| over the last ``rolling_window`` frames of each channel's capture"""
+        filled = np.minimum(self._level_count, self.rolling_window)
+        return np.divide(self._level_sum, filled, out=np.zeros_like(self._level_sum), where=filled > 0)
+
+    def _check_stop(self, frame_end, mask):
+        """Returns (channel, stream position, reason) for the captures that stop at this frame"""
+        elapsed = frame_end - self.trigger_position
+        at_max = mask & (elapsed >= self.max_samples)
+        running = mask & ~at_max
+
+        level = self.rolling_level()
+        quiet = running & (level < self.silence_threshold)
+        self.silence_start[quiet & (self.silence_start < 0)] = frame_end
+        loud = running & ~quiet & (level > self.silence_threshold * self.hysteresis) \
+            & (self._level_count >= self.rolling_window)
+        self.silence_start[loud] = -1
+
+        # Silence may start during the minimum duration, but only ends the capture after it
+        silent = running & (self.silence_start >= 0) & (elapsed >= self.min_samples) \
+            & (frame_end - self.silence_start >= self.silence_samples)
+
+        stops = [(channel, int(self.trigger_position[channel]) + self.max_samples, MAX_DURATION)
+                 for channel in np.flatnonzero(at_max)]
+        stops.extend((channel, frame_end, SILENCE) for channel in np.flatnonzero(silent))
+        for channel, _, _ in stops:
+            self._stop(channel)
+        return stops
+
+
+class TriggerDetector(MultiChannelDetector):
+    """
+    Single-channel MultiChannelDetector for mono streams and offline recordings.
+
+    Takes 1-D blocks and returns ``(START, offset, peak)`` and ``(STOP, offset, reason)``
+    events.
+    """
+
+    def __init__(self, sample_rate, noise_threshold, silence_threshold, **kwargs):
+        super().__init__(sample_rate, 1, noise_threshold, silence_threshold, **kwargs)
+
+    def process(self, block, active=None):
+        return [event[1:] for event in super().process(np.asarray(block)[:, None], active)]
+
+    def rolling_level(self):
+        return float(super().rolling_level()[0])
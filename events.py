@@ -0,0 +1,51 @@
+import queue
+import threading
+
+from loguru import logger
+
+# Events pushed to the UI over the websocket
+NEW_CAPTURE = "new_capture"
+FILTERED = "filtered"
+CLASSIFIED = "classified"
+SAMPLES_CHANGED = "samples_changed"
+CALIBRATION_COMPLETE = "calibration_complete"
+SAMPLER_STATUS = "sampler_status"
+
+_queue = queue.Queue(maxsize=256)
+_dispatcher = None
+
+
+def publish(event, payload=None):
+    """
+    Queue an event for the UI. Never blocks, so it is safe to call from the audio callback.
+
+    Events published before ``init()`` or while the queue is full are dropped.
+    """
+    if _dispatcher is None:
+        return
+    try:
+        _queue.put_nowait((event, payload or {}))
+    except queue.Full:
+        logger.warning(f"Event queue full, dropping {event}")
+
+
+def init(socketio):
+    """Start forwarding published events to every connected client of a flask_socketio.SocketIO"""
+    forward(socketio.emit)
+
+
+def forward(emit):
+    """Start passing published events to ``emit(event, payload)``, e.g. to the labeler's process"""
+    global _dispatcher
+
+    def dispatch():
+        while True:
+            event, payload = _queue.get()
+            try:
+                emit(event, payload)
+            except Exception as e:
+                logger.warning(f"Could not emit {event}: {e}")
+
+    if _dispatcher is None:
+        _dispatcher = threading.Thread(target=dispatch, name="event-dispatcher", daemon=True)
+        _dispatcher.start()
@@ -0,0 +1,133 @@
+"""
+Persistent cache of precomputed mel features for training.
+
+All features live in one flat float32 file that is memory-mapped for reading, next to a
+JSON index mapping sample ID to (offset, n_mels, frames). The index also records the
+feature parameters; opening the cache with different parameters empties it.
+
+Prebuild it in parallel before training:
+
+    python feature_cache.py data/samples --workers 4
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from loguru import logger
+
+import features
+
+CACHE_DIR = os.path.join("data", "cache", "features")
+SAMPLE_RATE = 48000
+CHUNK_SIZE = 16  # Samples per worker task, equal-length ones are computed as one batch
+
+
+def sample_id_from_filename(filename):
+    """The capture ID is the part after the last underscore, as the labeler names samples"""
+    base, _ = os.path.splitext(os.path.basename(filename))
+    return base.split("_")[-1]
+
+
+def compute(task):
+    """Process pool worker, returns [(sample_id, mel dB matrix)] for a chunk of paths"""
+    paths, sr, params = task
+    by_length = {}
+    for path in paths:
+        audio = np.load(path)
+        by_length.setdefault(len(audio), []).append((sample_id_from_filename(path), audio))
+    results = []
+    # Captures of the same length share one vectorized call
+    for group in by_length.values():
+        S_db = features.mel_db_batch([audio for _, audio in group], sr=sr, **params)
+        results.extend((sample_id, S) for (sample_id, _), S in zip(group, S_db.astype(np.float32)))
+    return results
+
+
+class FeatureCache:
+    def __init__(self, cache_dir=CACHE_DIR, sr=SAMPLE_RATE, **params):
+        self.cache_dir = cache_dir
+        self.sr = sr
+        self.params = {**features.MEL_PARAMS, **params}
+        self.data_path = os.path.join(cache_dir, "features.f32")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self._lock = threading.Lock()
+        self._map = None
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                stored = json.load(f)
+            if stored.get("key") == self.key():
+                self.index = stored["entries"]
+            else:
+                logger.info("Feature parameters changed, invalidating feature cache")
+        if not self.index and os.path.exists(self.data_path):
+            os.remove(self.data_path)
+
+    def key(self):
+        return {"sr": self.sr, **self.params}
+
+    def __contains__(self, sample_id):
+        return sample_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, sample_id):
+        """Zero-copy (n_mels, frames) view into the memory-mapped feature file"""
+        offset, n_mels, frames = self.index[sample_id]
+        if self._map is None or len(self._map) < offset + n_mels * frames:
+            self._map = np.memmap(self.data_path, dtype=np.float32, mode="r")
+        return self._map[offset:offset + n_mels * frames].reshape(n_mels, frames)
+
+    def put(self, sample_id, S_db):
+        """Append features for a sample, call flush() to persist the index"""
+        S_db = np.ascontiguousarray(S_db, dtype=np.float32)
+        with self._lock:
+            offset = os.path.getsize(self.data_path) // 4 if os.path.exists(self.data_path) else 0
+            with open(self.data_path, "ab") as f:
+                f.write(S_db.tobytes())
+            self.index[sample_id] = [offset, S_db.shape[0], S_db.shape[1]]
+
+    def flush(self):
+        with self._lock:
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"key": self.key(), "entries": self.index}, f)
+            os.replace(tmp_path, self.index_path)
+
+    def build(self, paths, workers=None):
+        """Compute features for every .npy path not cached yet, in parallel"""
+        missing = [path for path in paths if sample_id_from_filename(path) not in self.index]
+        logger.info(f"Feature cache: {len(self.index)} cached, {len(missing)} to compute")
+        if not missing:
+            return 0
+        tasks = [(missing[i:i + CHUNK_SIZE], self.sr, self.params) for i in range(0, len(missing), CHUNK_SIZE)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for results in pool.map(compute, tasks):
+                for sample_id, S_db in results:
+                    self.put(sample_id, S_db)
+        self.flush()
+        return len(missing)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dirs", nargs="+", help="directories of .npy samples")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    paths = sorted(p for d in args.data_dirs for p in glob.glob(os.path.join(d, "*.npy")))
+    cache = FeatureCache(args.cache_dir)
+    added = cache.build(paths, workers=args.workers)
+    logger.info(f"Feature cache ready: {len(cache)} samples, {added} added")
+
+
+if __name__ == "__main__":
+    main()
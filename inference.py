@@ -0,0 +1,273 @@
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+
+MODEL_PATH = os.path.join("models", "classifier.npz")
+PREDICTIONS_LOG = os.path.join("data", "predictions.jsonl")
+
+
+def load_metadata(model_path):
+    """Tags, input shape and layer graph stored next to an exported model, e.g. models/classifier.json"""
+    with open(f"{os.path.splitext(model_path)[0]}.json") as f:
+        return json.load(f)
+
+
+def pad_batch(mels, frames=None, fill=-80.0):
+    """Stack (n_mels, t) matrices into (batch, 1, n_mels, frames), cropping or padding the time axis"""
+    frames = frames or max(m.shape[1] for m in mels)
+    batch = np.full((len(mels), 1, mels[0].shape[0], frames), fill, dtype=np.float32)
+    for i, m in enumerate(mels):
+        t = min(frames, m.shape[1])
+        batch[i, 0, :, :t] = m[:, :t]
+    return batch
+
+
+class TorchScriptModel:
+    """Exported TorchScript classifier, torch is only imported when one is loaded"""
+
+    def __init__(self, model_path):
+        import torch
+
+        self._torch = torch
+        torch.set_num_threads(1)
+        self.model = torch.jit.load(model_path, map_location="cpu")
+        self.model.eval()
+
+    def predict(self, batch):
+        """Per-tag probabilities for a (batch, 1, n_mels, frames) array"""
+        with self._torch.inference_mode():
+            logits = self.model(self._torch.from_numpy(batch))
+        return self._torch.sigmoid(logits).numpy()
+
+
+def quantize(weight):
+    """Symmetric int8 weights with one float32 scale per output channel (the first axis)"""
+    flat = weight.reshape(len(weight), -1)
+    scale = np.abs(flat).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.clip(np.rint(flat / scale[:, None]), -127, 127).astype(np.int8)
+    return q.reshape(weight.shape), scale.astype(np.float32)
+
+
+def save_portable(model_path, graph, weights, metadata, int8=False):
+    """
+    Write a model in the portable format read by PortableModel: the weights as an .npz
+    and the layer graph, in order, added to the metadata next to it. With ``int8`` the
+    conv and linear weights are stored quantized, a quarter of the size.
+    """
+    arrays = {}
+    for name, array in weights.items():
+        array = np.asarray(array, dtype=np.float32)
+        if int8 and name.endswith(".weight"):
+            arrays[name], arrays[f"{name}_scale"] = quantize(array)
+        else:
+            arrays[name] = array
+    np.savez(model_path, **arrays)
+    with open(f"{os.path.splitext(model_path)[0]}.json", "w") as f:
+        json.dump({**metadata, "graph": graph, "weights": "int8" if int8 else "float32"}, f, indent=2)
+
+
+def _conv2d(x, weight, bias, padding):
+    """(N, H, W, C) convolution, ``weight`` as (kh, kw, C, out), as one matmul over the patches"""
+    kh, kw = weight.shape[:2]
+    if padding:
+        x = np.pad(x, ((0, 0), (padding, padding), (padding, padding), (0, 0)))
+    patches = np.lib.stride_tricks.sliding_window_view(x, (kh, kw), axis=(1, 2))  # (N, H, W, C, kh, kw)
+    out = np.tensordot(patches, weight, axes=([4, 5, 3], [0, 1, 2]))
+    out += bias
+    return out
+
+
+def _maxpool2d(x, kernel):
+    n, h, w, c = x.shape
+    h, w = h // kernel * kernel, w // kernel * kernel
+    return x[:, :h, :w].reshape(n, h // kernel, kernel, w // kernel, kernel, c).max(axis=(2, 4))
+
+
+class PortableModel:
+    """
+    Exported classifier evaluated with numpy alone, no torch import at startup.
+
+    Reads the .npz weights and the layer graph of its metadata (see ``save_portable``
+    and train.py). Activations are kept channels-last so every convolution is a single
+    BLAS product over strided patches. int8 weights are dequantized once on load.
+    """
+
+    def __init__(self, model_path):
+        self.graph = load_metadata(model_path)["graph"]
+        with np.load(model_path) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+        self.layers = []
+        for layer in self.graph:
+            op = layer["op"]
+            if op in ("conv2d", "linear"):
+                weight = arrays[f"{layer['name']}.weight"].astype(np.float32)
+                scale = arrays.get(f"{layer['name']}.weight_scale")
+                if scale is not None:
+                    weight *= scale.reshape(-1, *[1] * (weight.ndim - 1))
+                bias = arrays[f"{layer['name']}.bias"]
+                if op == "conv2d":
+                    # (out, C, kh, kw) -> (kh, kw, C, out) to contract the patch axes directly
+                    self.layers.append((op, np.ascontiguousarray(weight.transpose(2, 3, 1, 0)), bias,
+                                        layer.get("padding", 0)))
+                else:
+                    self.layers.append((op, np.ascontiguousarray(weight.T), bias))
+            elif op == "affine":
+                self.layers.append((op, np.float32(layer["scale"]), np.float32(layer["offset"])))
+            elif op == "maxpool2d":
+                self.layers.append((op, layer["kernel"]))
+            elif op in ("relu", "global_avg_pool"):
+                self.layers.append((op,))
+            else:
+                raise ValueError(f"Unknown layer {op!r} in {model_path}")
+
+    def logits(self, batch):
+        # (batch, 1, n_mels, frames) -> channels last
+        x = np.ascontiguousarray(np.asarray(batch, dtype=np.float32).transpose(0, 2, 3, 1))
+        for op, *args in self.layers:
+            if op == "conv2d":
+                x = _conv2d(x, *args)
+            elif op == "relu":
+                np.maximum(x, 0, out=x)
+            elif op == "maxpool2d":
+                x = _maxpool2d(x, *args)
+            elif op == "affine":
+                x = x * args[0] + args[1]
+            elif op == "global_avg_pool":
+                x = x.mean(axis=(1, 2))
+            elif op == "linear":
+                x = x @ args[0] + args[1]
+        return x
+
+    def predict(self, batch):
+        """Per-tag probabilities for a (batch, 1, n_mels, frames) array"""
+        return 1.0 / (1.0 + np.exp(-self.logits(batch)))
+
+
+def load_model(model_path):
+    """PortableModel for .npz exports, TorchScriptModel otherwise"""
+    if model_path.endswith(".npz"):
+        return PortableModel(model_path)
+    return TorchScriptModel(model_path)
+
+
+class InferenceStage:
+    """
+    Runs the trained classifier on captures as the sampler saves them.
+
+    The model is loaded once. ``submit()`` takes the mel matrix the capture was
+    rendered from, so nothing is recomputed; the worker thread takes every capture
+    that is waiting, up to ``max_batch``, and scores them in a single call. Results
+    are kept in memory by sample ID and appended to a predictions log.
+    """
+
+    def __init__(self, model, tags, frames=None, threshold=0.5, max_batch=8, history=1000, log_path=PREDICTIONS_LOG):
+        self.model = model
+        self.tags = tags
+        self.frames = frames
+        self.threshold = threshold
+        self.max_batch = max_batch
+        self.log_path = log_path
+
+        self.predictions = collections.OrderedDict()
+        self.history = history
+        self.latencies = collections.deque(maxlen=history)  # Seconds from capture end to prediction
+        self.trigger_latencies = collections.deque(maxlen=history)  # Seconds from trigger to prediction
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._worker, name="inference", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def load(cls, model_path=MODEL_PATH, **kwargs):
+        """Load an exported model and its metadata, returns None if there is no usable model"""
+        if not os.path.exists(model_path):
+            logger.info(f"No model at {model_path}, live inference disabled")
+            return None
+        try:
+            metadata = load_metadata(model_path)
+            started = time.perf_counter()
+            model = load_model(model_path)
+            logger.info(f"Loaded model {model_path} in {time.perf_counter() - started:.2f} s")
+        except Exception as e:
+            logger.warning(f"Could not load model {model_path}, live inference disabled: {e}")
+            return None
+        return cls(model, metadata["tags"], frames=metadata.get("frames"),
+                   threshold=metadata.get("threshold", 0.5), **kwargs)
+
+    def submit(self, sample_id, S_db, triggered_at=None, captured_at=None):
+        self._queue.put((sample_id, S_db, triggered_at, captured_at))
+
+    def get(self, sample_id):
+        with self._lock:
+            return self.predictions.get(sample_id)
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self.latencies)
+            trigger_latencies = np.array(self.trigger_latencies)
+            return {
+                "predictions": len(self.latencies),
+                "batches": self.batches,
+                "queue_depth": self._queue.qsize(),
+                "latency_mean": float(latencies.mean()) if len(latencies) else None,
+                "latency_p95": float(np.percentile(latencies, 95)) if len(latencies) else None,
+                "latency_max": float(latencies.max()) if len(latencies) else None,
+                "trigger_latency_mean": float(trigger_latencies.mean()) if len(trigger_latencies) else None,
+                "trigger_latency_p95": float(np.percentile(trigger_latencies, 95)) if len(trigger_latencies) else None,
+            }
+
+    def _next_batch(self):
+        """Block for one capture, then take whatever else is already waiting"""
+        items = [self._queue.get()]
+        while len(items) < self.max_batch:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _worker(self):
+        while True:
+            items = self._next_batch()
+            try:
+                probabilities = self.model.predict(pad_batch([item[1] for item in items], self.frames))
+            except Exception as e:
+                logger.warning(f"Inference error: {e}")
+                continue
+            done = time.monotonic()
+            for (sample_id, _, triggered_at, captured_at), probs in zip(items, probabilities):
+                self._record(sample_id, probs, done, triggered_at, captured_at)
+            with self._lock:
+                self.batches += 1
+
+    def _record(self, sample_id, probs, done, triggered_at, captured_at):
+        confidences = {tag: round(float(p), 4) for tag, p in zip(self.tags, probs)}
+        prediction = {
+            "id": sample_id,
+            "tags": [tag for tag, p in confidences.items() if p >= self.threshold],
+            "confidences": confidences,
+            "latency": done - captured_at if captured_at is not None else None,
+            "trigger_latency": done - triggered_at if triggered_at is not None else None,
+        }
+        with self._lock:
+            self.predictions[sample_id] = prediction
+            while len(self.predictions) > self.history:
+                self.predictions.popitem(last=False)
+            if prediction["latency"] is not None:
+                self.latencies.append(prediction["latency"])
+            if prediction["trigger_latency"] is not None:
+                self.trigger_latencies.append(prediction["trigger_latency"])
+        logger.info(f"Prediction {sample_id}: {prediction['tags']} in {prediction['latency'] or 0:.3f} s")
+        try:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(prediction) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not log prediction: {e}")
@@ -1,14 +1,21 @@
+import base64
+import hashlib
 import os.path
-import os.path
-import pickle
-import shutil
 import subprocess
 import threading
+import time
 
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Blueprint, Flask, Response, g, render_template, request, jsonify
+from flask_socketio import SocketIO
 from loguru import logger
 
-from sampler import AudioClassifierApp
+import events
+import metrics
+import similarity
+import render
+import thumbnails
+from archive import sample_name
+from storage import INPUT, SAMPLES, UNCLASSIFIED, ArchiveStorage, FileStorage, transaction
 
 INPUT_DIR = os.path.join("data", "input")
 UNCLASSIFIED_DIR = os.path.join("data", "unclassified")
@@ -16,163 +23,337 @@ SAMPLES_DIR = os.path.join("data", "samples")
 API_PREFIX="/api" # when testing, this should be just "" since dont have a rewrite rule yet
 # API_PREFIX="" # when testing, this should be just "" since dont have a rewrite rule yet
 LATEST_X_FILES=8
+# Sample IDs are content hashes, a file name always refers to the same bytes
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MAX_THUMBNAILS = 64  # Most thumbnails in one batch request
+MAX_BULK_ITEMS = 500  # Most captures filtered or classified in one bulk request
+FILTER_STATUSES = ["accept", "reject"]
+SAMPLER_PROCESS = False  # Run the sampler in its own process instead of a thread, see sampler_process.py
+STORAGE_BACKEND = "files"  # "files" for png/wav/npy triplets or "archive" for packed records, see sampler.py
+DEVICES = [None]  # Input devices captured concurrently, None for the sounddevice default
+CHANNELS = 1  # Channels per device, each with its own calibration, trigger and capture queue
+
+# The routes, served by the app create_app() builds. There is no module-level Flask app, so
+# `flask --app labeler run` finds the create_app factory rather than an app with no sampler
+routes = Blueprint("labeler", __name__)
+
+# Bulk requests are validated and applied as a whole, one at a time
+bulk_lock = threading.Lock()
+
+REQUEST_DURATION = metrics.histogram("http_request_duration_seconds", "Labeler request latency by endpoint", ["endpoint"])
+REQUESTS = metrics.counter("http_requests_total", "Labeler requests by endpoint and status code", ["endpoint", "code"])
+
+
+@routes.before_app_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@routes.after_app_request
+def record_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        # The view name without the blueprint's
+        endpoint = (request.endpoint or "unknown").rpartition(".")[2]
+        REQUEST_DURATION.labels(endpoint=endpoint).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint=endpoint, code=response.status_code).inc()
+    return response
+
+
+# Set up by create_app(), importing this module only defines the routes
+app = None
+socketio = None
+sampler = None
+sampler_thread = None
+storage = None
+label_store = None
+similarity_index = None
+thumbnail_cache = None
 
-DEFAULT_TAGS = [
-    # Object Types
-    "coin",
-    "ring",
-    "jewelry",
-    "ringpull",
-    "nail",
-    "foil",
-    "bottlecap",
-    "key",
-
-    # Metals / Materials
-    "gold",
-    "silver",
-    "aluminium",
-    "copper",
-    "iron",
-    "hotrock",
-    "utensil",
-    "noise",
-]
-
-AVAILABLE_TAGS = DEFAULT_TAGS
-TAGS_FILE = "tags.pkl"
-
-try:
-    with open(TAGS_FILE, 'rb') as f:
-        AVAILABLE_TAGS = pickle.load(f)
-except Exception as e:
-    with open(TAGS_FILE, 'wb') as f:
-        pickle.dump(AVAILABLE_TAGS, f)
-
-app = Flask(__name__)
-
-sampler = AudioClassifierApp()
 
 def run_sampler():
     """Runs the sampler in a separate thread."""
     sampler.run()
 
-# Start sampler in a separate thread when the script starts
-sampler_thread = threading.Thread(target=run_sampler, daemon=True)
-sampler_thread.start()
 
-@app.route(f"{API_PREFIX}/sampler/toggle", methods=["POST"])
+def create_app(sampler_process=SAMPLER_PROCESS, start_sampler=True, storage_backend=STORAGE_BACKEND, devices=DEVICES,
+               channels=CHANNELS):
+    """
+    Build the sampler, the stores the routes read and the websocket, then start capturing.
+
+    Nothing heavy happens on import: the sampler modules, the data directories and the
+    audio device are only touched here, and sounddevice is imported when the first
+    stream opens. ``start_sampler=False`` serves the UI without opening the audio device,
+    and without spawning the sampler process even when ``sampler_process`` is set: the
+    in-process sampler then only supplies the stores and is never run.
+    """
+    global app, socketio, sampler, sampler_thread, storage, label_store, similarity_index, thumbnail_cache
+    if app is not None:
+        return app
+
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(routes)
+
+    # Push channel for the UI, replaces polling of the queue endpoints
+    socketio = SocketIO(flask_app, cors_allowed_origins="*", async_mode="threading")
+    events.init(socketio)
+
+    if sampler_process and start_sampler:
+        from sampler_process import SamplerProcess
+
+        sampler = SamplerProcess(storage_backend=storage_backend, devices=devices, channels=channels)
+    else:
+        from sampler import AudioClassifierApp
+
+        sampler = AudioClassifierApp(storage_backend=storage_backend, devices=devices, channels=channels)
+
+    # Where captures live, the packed archive when the sampler writes one, otherwise the data/ directories
+    if sampler.archive is not None:
+        storage = ArchiveStorage(sampler.archive)
+    else:
+        storage = FileStorage({INPUT: INPUT_DIR, UNCLASSIFIED: UNCLASSIFIED_DIR, SAMPLES: SAMPLES_DIR},
+                              sample_rate=sampler.SAMPLE_RATE)
+
+    # Status, tags and timestamps of every sample, also holds the tag list offered for classification
+    label_store = sampler.labels
+
+    # Nearest labelled samples of a capture, searched among the classified samples
+    similarity_index = sampler.similarity
+    similarity.sync_labels(similarity_index, label_store)
+
+    # Downscaled spectrograms for the grids, rendered on demand
+    thumbnail_cache = thumbnails.ThumbnailCache()
+
+    # Start sampler in a separate thread
+    if start_sampler:
+        sampler_thread = threading.Thread(target=run_sampler, daemon=True)
+        sampler_thread.start()
+    app = flask_app
+    return app
+
+
+@routes.route(f"{API_PREFIX}/sampler/toggle", methods=["POST"])
 def toggle_sampling():
-    """Toggle audio sampling without stopping the app."""
+    """Toggle audio sampling without stopping the app, on every channel or only the given one."""
     data = request.json
     state = data.get("active")
+    channel = data.get("channel")
 
     if state is None or not isinstance(state, bool):
         return jsonify({"status": "error", "message": "Invalid request"}), 400
-
-    sampler.sampling_active = state
-    logger.info(f"Sampling {'activated' if state else 'paused'}.")
+    if channel is not None and not (isinstance(channel, int) and 0 <= channel < sampler.channel_count):
+        return jsonify({"status": "error", "message": "Unknown channel"}), 400
+
+    sampler.set_sampling(state, channel)
+    logger.info(f"Sampling {'activated' if state else 'paused'}{'' if channel is None else f' on channel {channel}'}.")
+    status = sampler.status()
+    events.publish(events.SAMPLER_STATUS, {
+        "sampling_active": status["sampling_active"],
+        "channels": [c["sampling_active"] for c in status["channels"]],
+    })
 
     return jsonify({"status": "ok", "message": f"Sampling {'activated' if state else 'paused'}"})
 
 
-@app.route(f"{API_PREFIX}/recalibrate", methods=["POST"])
+@routes.route(f"{API_PREFIX}/recalibrate", methods=["POST"])
 def recalibrate():
-    """recalibrate"""
+    """recalibrate, every channel or only the one given as ?channel="""
     global sampler
-    sampler.calibrated = False
-    sampler.calibrating = False
-    sampler.calibration_start_time = None
-    sampler.calibration_data = []
-    logger.info(f"Recalibrating")
+    channel = request.args.get("channel", type=int)
+    if channel is not None and not 0 <= channel < sampler.channel_count:
+        return jsonify({"status": "error", "message": "Unknown channel"}), 400
+    sampler.recalibrate(channel)
+    logger.info(f"Recalibrating{'' if channel is None else f' channel {channel}'}")
     return jsonify({"status": "ok"})
 
 
-@app.route(f"{API_PREFIX}/calibration", methods=["GET"])
-def recalibrate():
-    """recalibrate"""
+@routes.route(f"{API_PREFIX}/calibration", methods=["GET"])
+def calibration():
+    """Return the current calibration thresholds"""
     global sampler
     logger.info(f"Returning calibration data")
-    return jsonify({"status": "ok", "noise_threshold": sampler.calibrated_noise_threshold, "silence_threshold": sampler.calibrated_silence_threshold})
+    return jsonify({"status": "ok", **sampler.calibration()})
+
+
+@routes.route(f"{API_PREFIX}/calibration/continuous", methods=["POST"])
+def continuous_calibration():
+    """Toggle background re-calibration, thresholds follow the ground without stopping capture."""
+    data = request.json
+    state = data.get("active")
+
+    if state is None or not isinstance(state, bool):
+        return jsonify({"status": "error", "message": "Invalid request"}), 400
 
+    sampler.set_continuous_calibration(state)
+    logger.info(f"Continuous calibration {'enabled' if state else 'disabled'}.")
 
+    return jsonify({"status": "ok", "continuous": state})
 
 
-@app.route(f"{API_PREFIX}/sampler/status", methods=["GET"])
+
+
+@routes.route(f"{API_PREFIX}/sampler/status", methods=["GET"])
 def sampler_status():
     global sampler_thread
     """Check if sampler is running and if sampling is active."""
     return jsonify({
         "status": "running" if sampler_thread and sampler_thread.is_alive() else "stopped",
-        "sampling_active": sampler.sampling_active
+        **sampler.status(),
     })
 
 
-@app.route(f"{API_PREFIX}/tags", methods=["GET"])
+@routes.route(f"{API_PREFIX}/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Capture pipeline and labeler metrics in the Prometheus text format."""
+    # Only a SamplerProcess keeps metrics apart from the labeler's
+    if not hasattr(sampler, "metrics"):
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+    # Capture metrics come from the sampler process, the labeler's copies of them stay unused
+    remote = sampler.metrics()
+    return Response(metrics.render(exclude=metrics.names(remote)) + remote, mimetype="text/plain; version=0.0.4")
+
+
+@routes.route(f"{API_PREFIX}/profiler", methods=["GET", "POST"])
+def profiler():
+    """GET the collected profile as collapsed stacks, POST {"active": bool, "interval": seconds} to toggle it."""
+    if request.method == "GET":
+        if request.args.get("format") == "collapsed":
+            return Response(metrics.profiler.collapsed(), mimetype="text/plain")
+        return jsonify({"status": "ok", **metrics.profiler.status()})
+
+    data = request.json
+    state = data.get("active")
+    if state is None or not isinstance(state, bool):
+        return jsonify({"status": "error", "message": "Invalid request"}), 400
+
+    if state:
+        metrics.profiler.start(interval=data.get("interval"))
+    else:
+        metrics.profiler.stop()
+    return jsonify({"status": "ok", **metrics.profiler.status()})
+
+
+@routes.route(f"{API_PREFIX}/inference", methods=["GET"])
+def inference_status():
+    """Live inference latency and batching counters."""
+    if not sampler.inference:
+        return jsonify({"status": "disabled"})
+    return jsonify({"status": "ok", **sampler.inference.stats()})
+
+
+@routes.route(f"{API_PREFIX}/tags", methods=["GET"])
 def get_tags():
-    return jsonify({"status": "ok", "tags": AVAILABLE_TAGS})
+    return jsonify({"status": "ok", "tags": label_store.tags()})
 
-@app.route(f"{API_PREFIX}/tags/add/<tag>", methods=["POST"])
+@routes.route(f"{API_PREFIX}/tags/add/<tag>", methods=["POST"])
 def add_tag(tag):
-    if tag in AVAILABLE_TAGS:
-        AVAILABLE_TAGS.remove(tag)
-    AVAILABLE_TAGS.append(tag)
-    with open(TAGS_FILE, 'wb') as f:
-        pickle.dump(AVAILABLE_TAGS, f)
-    return jsonify({"status": "ok", "tags": AVAILABLE_TAGS})
-
-@app.route(f"{API_PREFIX}/tags/del/<tag>", methods=["POST"])
+    return jsonify({"status": "ok", "tags": label_store.add_tag(tag)})
+
+@routes.route(f"{API_PREFIX}/tags/del/<tag>", methods=["POST"])
 def del_tag(tag):
-    if tag in AVAILABLE_TAGS:
-        AVAILABLE_TAGS.remove(tag)
-        with open("tags.pkl", 'wb') as f:
-            pickle.dump(AVAILABLE_TAGS, f)
-    return jsonify({"status": "ok", "tags": AVAILABLE_TAGS})
+    return jsonify({"status": "ok", "tags": label_store.remove_tag(tag)})
+
+
+@routes.route(f"{API_PREFIX}/labels", methods=["GET"])
+def query_labels():
+    """Samples matching ?stage=&status=&tags=a,b&since=&until=&limit=, dates as epoch seconds or ISO"""
+    tags = request.args.get("tags")
+    try:
+        results = label_store.query(
+            stage=request.args.get("stage"),
+            status=request.args.get("status"),
+            tags=tags.split(",") if tags else (),
+            since=request.args.get("since"),
+            until=request.args.get("until"),
+            limit=request.args.get("limit", type=int),
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "ok", "count": len(results), "samples": results})
+
+
+@routes.route(f"{API_PREFIX}/similar/<sample_id>", methods=["GET"])
+def similar_samples(sample_id):
+    """Nearest classified samples to a capture and the tags most of them share, ?k= neighbours"""
+    vector = similarity_index.vector(sample_id)
+    if vector is None:
+        return jsonify({"status": "error", "message": f"No embedding for {sample_id}"}), 404
+
+    # search() caps k at the size of the index, anything below one neighbour is a bad request
+    k = request.args.get("k", 8, type=int)
+    if k < 1:
+        return jsonify({"status": "error", "message": "k must be at least 1"}), 400
+    matches = similarity_index.search(vector, k=k, exclude=[sample_id])
+    known = {sample["id"]: sample for sample in label_store.query(sample_ids=[match_id for match_id, _ in matches])}
+
+    neighbours = []
+    for match_id, score in matches:
+        sample = known.get(match_id)
+        if sample is None:
+            continue
+        name = sample_name(match_id, sample)
+        neighbours.append({
+            "id": match_id,
+            "score": round(score, 4),
+            "status": sample["status"],
+            "tags": sample["tags"],
+            "filename": f"{name}.png",
+            "spectrogram": f"/api/files/samples/{name}.png",
+        })
+
+    suggested = similarity.suggest_tags([(n["tags"], n["score"]) for n in neighbours])
+    return jsonify({
+        "status": "ok",
+        "neighbours": neighbours,
+        "suggested_tags": [tag for tag, _ in suggested],
+        "tag_scores": dict(suggested),
+    })
 
 
+def filter_item(filename):
+    base, _ = os.path.splitext(filename)
+    return {
+        "spectrogram": f"/api/files/input/{base}.png",
+        "audio": f"/api/files/input/{base}.wav",
+        "filename": filename,
+        "prediction": sampler.inference.get(base) if sampler.inference else None,
+    }
 
-@app.route(f"{API_PREFIX}/next_filter_file")
+
+def classify_item(filename):
+    base, _ = os.path.splitext(filename)
+    return {
+        "spectrogram": f"/api/files/classify/{filename}",
+        "audio": f"/api/files/classify/{base}.wav",
+        "filename": filename,
+    }
+
+
+@routes.route(f"{API_PREFIX}/next_filter_file")
 def next_filter_file():
     """Return the next file available for filtering."""
-    files = sorted(f for f in os.listdir(INPUT_DIR) if f.endswith(".png"))
-    if not files:
+    first = storage.first(INPUT)
+    if not first:
         return jsonify({"status": "no_files"})
 
-    base, _ = os.path.splitext(files[0])
-    return jsonify({
-        "status": "ok",
-        "spectrogram": f"/api/files/input/{base}.png",
-        "audio": f"/api/files/input/{base}.wav",
-        "filename": files[0]
-    })
+    return jsonify({"status": "ok", **filter_item(first)})
 
 
-@app.route(f"{API_PREFIX}/next_classify_file")
+@routes.route(f"{API_PREFIX}/next_classify_file")
 def next_classify_file():
     """Return the next file available for classification."""
-    files = sorted(f for f in os.listdir(UNCLASSIFIED_DIR) if f.endswith(".png"))
-    if not files:
+    first = storage.first(UNCLASSIFIED)
+    if not first:
         return jsonify({"status": "no_files"})
 
-    base, _ = os.path.splitext(files[0])
-    return jsonify({
-        "status": "ok",
-        "spectrogram": f"/api/files/classify/{files[0]}",
-        "audio": f"/api/files/classify/{base}.wav",
-        "filename": files[0],
-        "tags": AVAILABLE_TAGS
-    })
+    return jsonify({"status": "ok", **classify_item(first), "tags": label_store.tags()})
 
 
-@app.route(f"{API_PREFIX}/samples")
+@routes.route(f"{API_PREFIX}/samples")
 def samples():
     """Return all the sample files."""
-    # List all .png files and sort them by modified time (latest first)
-    files = sorted(
-        (f for f in os.listdir(SAMPLES_DIR) if f.endswith(".png")),
-        key=lambda f: os.path.getmtime(os.path.join(SAMPLES_DIR, f)),
-        reverse=True  # Latest files first
-    )[:LATEST_X_FILES]  # Get only the latest X files
+    # Latest X .png files by modified time, latest first
+    files = storage.latest(SAMPLES, LATEST_X_FILES)
 
     if not files:
         return jsonify({"status": "no_files"})
@@ -183,30 +364,76 @@ def samples():
     })
 
 
-@app.route(f"{API_PREFIX}/files/input/<filename>")
+def immutable(response, etag):
+    """Mark a response as cacheable for good under its ETag"""
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    response.cache_control.no_cache = None
+    return response
+
+
+def send_sample_file(stage, filename):
+    """Serve a capture file with immutable caching, revalidations are answered before the file is touched"""
+    etag = hashlib.sha1(filename.encode()).hexdigest()
+    if etag in request.if_none_match:
+        return immutable(Response(status=304), etag)
+    response = storage.send(stage, filename, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+    if isinstance(response, tuple):
+        return response
+    response.cache_control.immutable = True
+    return response
+
+
+@routes.route(f"{API_PREFIX}/files/input/<filename>")
 def serve_input_file(filename):
-    # Validate / sanitize 'filename' to prevent security issues
-    file_path = os.path.join(INPUT_DIR, filename)
-    logger.info(f"accessing file: {file_path}")
-    return send_file(file_path)
+    return send_sample_file(INPUT, filename)
 
 
-@app.route(f"{API_PREFIX}/files/classify/<filename>")
+@routes.route(f"{API_PREFIX}/files/classify/<filename>")
 def serve_classify_file(filename):
-    # Validate / sanitize 'filename' to prevent security issues
-    file_path = os.path.join(UNCLASSIFIED_DIR, filename)
-    logger.info(f"accessing file: {file_path}")
-    return send_file(file_path)
+    return send_sample_file(UNCLASSIFIED, filename)
 
-@app.route(f"{API_PREFIX}/files/samples/<filename>")
+@routes.route(f"{API_PREFIX}/files/samples/<filename>")
 def serve_samples_file(filename):
-    # Validate / sanitize 'filename' to prevent security issues
-    file_path = os.path.join(SAMPLES_DIR, filename)
-    logger.info(f"accessing file: {file_path}")
-    return send_file(file_path)
+    return send_sample_file(SAMPLES, filename)
+
+
+@routes.route(f"{API_PREFIX}/thumbnails", methods=["GET"])
+def batch_thumbnails():
+    """
+    Several spectrogram thumbnails in one response, as PNG data URIs keyed by file name.
+
+    ?stage=samples&files=a.png&files=b.png&width=160, stage is input, unclassified or samples.
+    """
+    stage = request.args.get("stage", SAMPLES)
+    filenames = request.args.getlist("files")
+    width = request.args.get("width", thumbnails.DEFAULT_WIDTH, type=int)
+    if stage not in (INPUT, UNCLASSIFIED, SAMPLES) or not filenames or len(filenames) > MAX_THUMBNAILS \
+            or not 0 < width <= thumbnails.MAX_WIDTH:
+        return jsonify({"status": "error", "message": "Invalid request"}), 400
 
+    etag = hashlib.sha1("\n".join([stage, str(width), *filenames]).encode()).hexdigest()
+    if etag in request.if_none_match:
+        return immutable(Response(status=304), etag)
 
-@app.route(f"{API_PREFIX}/shutdown", methods=["POST"])
+    result, missing = {}, []
+    for filename in filenames:
+        base, _ = os.path.splitext(filename)
+        sample_id = storage.sample_id(stage, base)
+        if sample_id is None:
+            missing.append(filename)
+            continue
+        data = thumbnail_cache.get(sample_id, width, lambda: render.thumbnail_png(storage.mel(stage, base), width))
+        result[filename] = "data:image/png;base64," + base64.b64encode(data).decode("ascii")
+
+    response = jsonify({"status": "ok", "width": width, "thumbnails": result, "missing": missing})
+    # A name that is missing now may show up later, only complete batches are cached for good
+    return immutable(response, etag) if not missing else response
+
+
+@routes.route(f"{API_PREFIX}/shutdown", methods=["POST"])
 def shutdown():
     try:
         subprocess.Popen(["sudo", "/sbin/shutdown", "-h", "now"])
@@ -215,12 +442,12 @@ def shutdown():
         return f"Error: {str(e)}", 500
 
 
-@app.route("/", methods=["GET"])
+@routes.route("/", methods=["GET"])
 def index():
     return render_template("index.html")
 
 
-@app.route(f"{API_PREFIX}/filter", methods=["POST"])
+@routes.route(f"{API_PREFIX}/filter", methods=["POST"])
 def do_filter():
     """Process accepted/rejected files from filtering view."""
     data = request.json
@@ -231,18 +458,21 @@ def do_filter():
         return jsonify({"status": "error", "message": "Invalid input"}), 400
 
     base, _ = os.path.splitext(filename)
-    for ext in ["png", "npy", "wav"]:
-        file_path = os.path.join(INPUT_DIR, f"{base}.{ext}")
-        if os.path.exists(file_path):
-            if status == "accept":
-                shutil.move(file_path, os.path.join(UNCLASSIFIED_DIR, f"{base}.{ext}"))
-            else:
-                os.remove(file_path)
+    if status == "accept":
+        storage.move(INPUT, base, UNCLASSIFIED, base)
+        label_store.set_stage(base, UNCLASSIFIED)
+    else:
+        storage.delete(INPUT, base)
+        label_store.delete(base)
+        similarity_index.remove(base)
+        thumbnail_cache.discard(base)
+        sampler.forget_capture(base)
+    events.publish(events.FILTERED, {"id": base, "status": status})
 
     return jsonify({"status": "ok", "message": "File filtered", "nextFileUrl": "/next_capture_file"})
 
 
-@app.route(f"{API_PREFIX}/classify", methods=["POST"])
+@routes.route(f"{API_PREFIX}/classify", methods=["POST"])
 def do_classify():
     """Process classification results and move file to training data."""
     logger.info("doing classify")
@@ -259,16 +489,139 @@ def do_classify():
     tag_prefix = "_".join(tags)
     new_filename = f"{status}_{tag_prefix}_{base}"
 
-    for ext in ["png", "npy", "wav"]:
-        old_path = os.path.join(UNCLASSIFIED_DIR, f"{base}.{ext}")
-        new_path = os.path.join(SAMPLES_DIR, f"{new_filename}.{ext}")
-        if os.path.exists(old_path):
-            shutil.move(old_path, new_path)
+    storage.move(UNCLASSIFIED, base, SAMPLES, new_filename, status=status, tags=tags)
+    label_store.classify(base, status, tags)
+    similarity_index.set_labelled(base)
+    events.publish(events.CLASSIFIED, {"id": base, "status": status, "tags": tags, "filename": f"{new_filename}.png"})
 
     return jsonify({"status": "ok", "message": "File classified", "nextFileUrl": "/next_classify_file"})
 
 
-@app.route(f"{API_PREFIX}/samples/delete/<filename>", methods=["POST"])
+def bulk_items(data):
+    """
+    The items of a bulk request, either {"items": [{"filename", "status", "tags"}, ...]}
+    or {"ids": [...], "status": ..., "tags": [...]} with one label for every ID.
+    Returns None when the request is malformed.
+    """
+    if not isinstance(data, dict):
+        return None
+    items = data.get("items")
+    if items is None and isinstance(data.get("ids"), list):
+        items = [{"filename": sample_id, "status": data.get("status"), "tags": data.get("tags", [])}
+                 for sample_id in data["ids"]]
+    if not isinstance(items, list) or not items or len(items) > MAX_BULK_ITEMS \
+            or not all(isinstance(item, dict) and isinstance(item.get("filename"), str) for item in items):
+        return None
+    return items
+
+
+def invalid_items(items, stage, valid):
+    """Items that are not pending in a stage, are listed twice or fail ``valid(item)``"""
+    seen, invalid = set(), []
+    for item in items:
+        base, _ = os.path.splitext(item["filename"])
+        if base in seen or not storage.exists(stage, base) or not valid(item):
+            invalid.append(item["filename"])
+        seen.add(base)
+    return invalid
+
+
+@routes.route(f"{API_PREFIX}/filter/bulk", methods=["POST"])
+def do_filter_bulk():
+    """
+    Accept or reject several captures in one request.
+
+    All items are applied in one transaction, a failure part way rolls back the ones
+    done so far. The response carries the next ``next`` captures waiting to be filtered.
+    """
+    data = request.json
+    items = bulk_items(data)
+    count = data.get("next", LATEST_X_FILES) if isinstance(data, dict) else LATEST_X_FILES
+    if items is None or not isinstance(count, int):
+        return jsonify({"status": "error", "message": "Invalid input"}), 400
+
+    with bulk_lock:
+        invalid = invalid_items(items, INPUT, lambda item: item.get("status") in FILTER_STATUSES)
+        if invalid:
+            return jsonify({"status": "error", "message": "Invalid items, nothing applied", "invalid": invalid}), 400
+
+        decisions = [(os.path.splitext(item["filename"])[0], item["status"]) for item in items]
+        try:
+            with transaction(storage) as batch:
+                changes = []
+                for base, status in decisions:
+                    if status == "accept":
+                        batch.move(INPUT, base, UNCLASSIFIED, base)
+                        changes.append(("set_stage", base, UNCLASSIFIED))
+                    else:
+                        batch.delete(INPUT, base)
+                        changes.append(("delete", base))
+                label_store.apply(changes)
+        except Exception as e:
+            logger.error(f"Bulk filter of {len(decisions)} captures rolled back: {e}")
+            return jsonify({"status": "error", "message": f"Rolled back: {e}"}), 500
+
+    for base, status in decisions:
+        if status != "accept":
+            similarity_index.remove(base)
+            thumbnail_cache.discard(base)
+            sampler.forget_capture(base)
+    events.publish(events.FILTERED, {"ids": [base for base, _ in decisions], "count": len(decisions)})
+
+    return jsonify({
+        "status": "ok",
+        "applied": len(decisions),
+        "next": [filter_item(filename) for filename in storage.pending(INPUT, count)],
+    })
+
+
+@routes.route(f"{API_PREFIX}/classify/bulk", methods=["POST"])
+def do_classify_bulk():
+    """
+    Label several captures in one request, each item with a status and a non-empty tag list.
+
+    All items are applied in one transaction, a failure part way rolls back the ones
+    done so far. The response carries the next ``next`` captures waiting to be classified.
+    """
+    data = request.json
+    items = bulk_items(data)
+    count = data.get("next", LATEST_X_FILES) if isinstance(data, dict) else LATEST_X_FILES
+    if items is None or not isinstance(count, int):
+        return jsonify({"status": "error", "message": "Invalid input"}), 400
+
+    def valid(item):
+        tags = item.get("tags")
+        return isinstance(item.get("status"), str) and item["status"] and isinstance(tags, list) and tags \
+            and all(isinstance(tag, str) for tag in tags)
+
+    with bulk_lock:
+        invalid = invalid_items(items, UNCLASSIFIED, valid)
+        if invalid:
+            return jsonify({"status": "error", "message": "Invalid items, nothing applied", "invalid": invalid}), 400
+
+        labels = [(os.path.splitext(item["filename"])[0], item["status"], item["tags"]) for item in items]
+        try:
+            with transaction(storage) as batch:
+                for base, status, tags in labels:
+                    batch.move(UNCLASSIFIED, base, SAMPLES, f"{status}_{'_'.join(tags)}_{base}", status=status, tags=tags)
+                label_store.apply([("classify", base, status, tags) for base, status, tags in labels])
+        except Exception as e:
+            logger.error(f"Bulk classification of {len(labels)} captures rolled back: {e}")
+            return jsonify({"status": "error", "message": f"Rolled back: {e}"}), 500
+
+    for base, _, _ in labels:
+        similarity_index.set_labelled(base)
+    events.publish(events.CLASSIFIED, {"ids": [base for base, _, _ in labels], "count": len(labels)})
+
+    return jsonify({
+        "status": "ok",
+        "applied": len(labels),
+        "next": [classify_item(filename) for filename in storage.pending(UNCLASSIFIED, count)],
+        "tags": label_store.tags(),
+    })
+
+
+@routes.route(f"{API_PREFIX}/samples/delete/<filename>", methods=["POST"])
 def delete_sample(filename):
     """delete sample."""
     logger.info(f"deleting sample: {filename}")
@@ -277,14 +630,20 @@ def delete_sample(filename):
         return jsonify({"status": "error", "message": "Invalid input"}), 400
 
     base, _ = os.path.splitext(filename)
-    for ext in ["png", "npy", "wav"]:
-        os.remove(os.path.join(SAMPLES_DIR, f"{base}.{ext}"))
+    sample_id = storage.sample_id(SAMPLES, base)
+    storage.delete(SAMPLES, base)
+    if sample_id is not None:
+        label_store.delete(sample_id)
+        similarity_index.remove(sample_id)
+        thumbnail_cache.discard(sample_id)
+        sampler.forget_capture(sample_id)
+    events.publish(events.SAMPLES_CHANGED, {"deleted": filename})
 
     return jsonify({"status": "ok", "message": f"File deleted: {filename}"})
 
 
 
-@app.route(f"{API_PREFIX}/samples/reclassify/<filename>", methods=["POST"])
+@routes.route(f"{API_PREFIX}/samples/reclassify/<filename>", methods=["POST"])
 def reclassify_sample(filename):
     """Move a classified sample back to the unclassified directory for reclassification."""
     logger.info(f"Reclassifying sample: {filename}")
@@ -294,21 +653,19 @@ def reclassify_sample(filename):
 
     base, _ = os.path.splitext(filename)
 
-    # Extract the original file ID (everything after the last underscore)
-    parts = base.split("_")
-    if len(parts) < 2:
-        return jsonify({"status": "error", "message": "Invalid filename format"}), 400
-
-    new_filename = parts[-1]  # The last part is the original unique file ID
+    # Unclassified captures are named by their sample ID alone
+    new_filename = storage.sample_id(SAMPLES, base)
+    if new_filename is None:
+        return jsonify({"status": "error", "message": f"Unknown sample: {filename}"}), 404
 
-    for ext in ["png", "npy", "wav"]:
-        old_path = os.path.join(SAMPLES_DIR, f"{base}.{ext}")
-        new_path = os.path.join(UNCLASSIFIED_DIR, f"{new_filename}.{ext}")
-        if os.path.exists(old_path):
-            shutil.move(old_path, new_path)
+    storage.move(SAMPLES, base, UNCLASSIFIED, new_filename)
+    label_store.unclassify(new_filename)
+    similarity_index.set_labelled(new_filename, False)
+    events.publish(events.SAMPLES_CHANGED, {"reclassified": filename, "id": new_filename})
 
     return jsonify({"status": "ok", "message": f"File moved back for reclassification: {new_filename}"})
 
 
 if __name__ == '__main__':
-    app.run(debug=True, use_reloader=False, port=8080, host='0.0.0.0')
+    create_app()
+    socketio.run(app, debug=True, use_reloader=False, port=8080, host='0.0.0.0', allow_unsafe_werkzeug=True)
@@ -0,0 +1,377 @@
+"""
+Label metadata for every capture: stage, status, tags, timestamps and the calibration
+thresholds in effect when it was captured.
+
+Kept in an SQLite database so training and the labeler can ask "all accept + silver
+since a date" or export a multi-hot label matrix without parsing file names. The
+tag list the labeler offers lives in the same database, replacing tags.pkl.
+
+    python labels.py query --status accept --tags silver --since 2025-03-01
+    python labels.py export --out data/labels.npz
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+
+from archive import INPUT, SAMPLES, UNCLASSIFIED, parse_name
+
+LABELS_DB = os.path.join("data", "labels.db")
+TAGS_FILE = "tags.pkl"  # Tag list of older versions, imported once
+
+STATUSES = ["accept", "reject"]  # Statuses of file-named samples, the labeler UI sends good/bad
+
+DEFAULT_TAGS = [
+    # Object Types
+    "coin",
+    "ring",
+    "jewelry",
+    "ringpull",
+    "nail",
+    "foil",
+    "bottlecap",
+    "key",
+
+    # Metals / Materials
+    "gold",
+    "silver",
+    "aluminium",
+    "copper",
+    "iron",
+    "hotrock",
+    "utensil",
+    "noise",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    status TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    noise_threshold REAL,
+    silence_threshold REAL
+);
+CREATE INDEX IF NOT EXISTS samples_stage_created ON samples (stage, created);
+CREATE INDEX IF NOT EXISTS samples_status_created ON samples (status, created);
+CREATE TABLE IF NOT EXISTS sample_tags (
+    sample_id TEXT NOT NULL REFERENCES samples (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (sample_id, tag)
+);
+CREATE INDEX IF NOT EXISTS sample_tags_tag ON sample_tags (tag, sample_id);
+CREATE TABLE IF NOT EXISTS tags (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+);
+"""
+
+
+def parse_time(value):
+    """Seconds since the epoch from a number or an ISO date such as 2025-03-01 or 2025-03-01T12:00"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def file_entries(stage_dirs):
+    """(id, stage, status, tags, created) for the .npy captures under {stage: directory}"""
+    for stage, directory in stage_dirs.items():
+        for path in glob.glob(os.path.join(directory, "*.npy")):
+            base, _ = os.path.splitext(os.path.basename(path))
+            status, tags, sample_id = parse_name(base) if stage == SAMPLES else (None, [], base)
+            yield sample_id, stage, status, tags, os.path.getmtime(path)
+
+
+def archive_entries(archive):
+    """(id, stage, status, tags, created) for the samples of a SampleArchive"""
+    for sample_id, meta in list(archive.meta.items()):
+        yield sample_id, meta["stage"], meta.get("status"), meta.get("tags", []), meta["created"]
+
+
+class LabelStore:
+    """
+    Sample labels in SQLite, indexed by stage, status, tag and capture time.
+
+    One connection is shared by the sampler writer threads and the Flask request
+    threads, statements are serialized by a lock and every change is a single
+    transaction. A new database is seeded from ``seed`` (see ``file_entries()``)
+    and from the tags.pkl of older versions.
+    """
+
+    def __init__(self, path=LABELS_DB, default_tags=DEFAULT_TAGS, seed=()):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        new = not os.path.exists(path)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+        if new:
+            self._seed_tags(default_tags)
+            count = self.import_entries(seed)
+            logger.info(f"Created label store {path} with {count} samples")
+
+    def _seed_tags(self, default_tags):
+        tags = list(default_tags)
+        if os.path.exists(TAGS_FILE):
+            try:
+                with open(TAGS_FILE, "rb") as f:
+                    tags = pickle.load(f)
+            except Exception as e:
+                logger.warning(f"Could not read {TAGS_FILE}: {e}")
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO tags (name, position) VALUES (?, ?)",
+                                 [(tag, i) for i, tag in enumerate(tags)])
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+    def __contains__(self, sample_id):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM samples WHERE id = ?", (sample_id,)).fetchone() is not None
+
+    # Tags offered by the labeler
+
+    def tags(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT name FROM tags ORDER BY position")]
+
+    def statuses(self):
+        """Statuses used by the stored samples, the known ones first"""
+        with self._lock:
+            used = {row[0] for row in self._db.execute("SELECT DISTINCT status FROM samples WHERE status IS NOT NULL")}
+        return [status for status in STATUSES if status in used] + sorted(used - set(STATUSES))
+
+    def add_tag(self, tag):
+        """Add a tag, or move an existing one to the end of the list"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tags (name, position) VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM tags))",
+                (tag,),
+            )
+        return self.tags()
+
+    def remove_tag(self, tag):
+        """Stop offering a tag, samples already labelled with it keep it"""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM tags WHERE name = ?", (tag,))
+        return self.tags()
+
+    # Samples
+
+    def import_entries(self, entries):
+        """Insert (id, stage, status, tags, created) tuples, samples already stored are left alone"""
+        count = 0
+        with self._lock, self._db:
+            for sample_id, stage, status, tags, created in entries:
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO samples (id, stage, status, created, updated) VALUES (?, ?, ?, ?, ?)",
+                    (sample_id, stage, status, created, created),
+                )
+                if cursor.rowcount:
+                    self._db.executemany("INSERT OR IGNORE INTO sample_tags (sample_id, tag) VALUES (?, ?)",
+                                         [(sample_id, tag) for tag in tags])
+                    count += 1
+        return count
+
+    def add_capture(self, sample_id, created=None, noise_threshold=None, silence_threshold=None, stage=INPUT):
+        """Record a new capture with the thresholds that triggered it"""
+        created = created or time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO samples (id, stage, created, updated, noise_threshold, silence_threshold) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (sample_id, stage, created, created, noise_threshold, silence_threshold),
+            )
+
+    def _upsert(self, sample_id, stage, status):
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO samples (id, stage, status, created, updated) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET stage = excluded.stage, status = excluded.status, updated = excluded.updated",
+            (sample_id, stage, status, now, now),
+        )
+
+    def _set_stage(self, sample_id, stage):
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO samples (id, stage, created, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET stage = excluded.stage, updated = excluded.updated",
+            (sample_id, stage, now, now),
+        )
+
+    def _classify(self, sample_id, status, tags):
+        self._upsert(sample_id, SAMPLES, status)
+        self._db.execute("DELETE FROM sample_tags WHERE sample_id = ?", (sample_id,))
+        self._db.executemany("INSERT OR IGNORE INTO sample_tags (sample_id, tag) VALUES (?, ?)",
+                             [(sample_id, tag) for tag in tags])
+
+    def _unclassify(self, sample_id):
+        self._upsert(sample_id, UNCLASSIFIED, None)
+        self._db.execute("DELETE FROM sample_tags WHERE sample_id = ?", (sample_id,))
+
+    def _delete(self, sample_id):
+        self._db.execute("DELETE FROM samples WHERE id = ?", (sample_id,))
+
+    def set_stage(self, sample_id, stage):
+        """Move a sample to another stage, keeping its status and tags"""
+        self.apply([("set_stage", sample_id, stage)])
+
+    def classify(self, sample_id, status, tags):
+        """Label a sample and move it to the training samples"""
+        self.apply([("classify", sample_id, status, tags)])
+
+    def unclassify(self, sample_id):
+        """Clear the labels of a sample and send it back for classification"""
+        self.apply([("unclassify", sample_id)])
+
+    def delete(self, sample_id):
+        self.apply([("delete", sample_id)])
+
+    def apply(self, changes):
+        """
+        Apply ``(change, sample_id, *args)`` tuples in one transaction, all or none of them.
+
+        ``change`` is one of set_stage, classify, unclassify or delete, taking the
+        arguments of the method with that name.
+        """
+        with self._lock, self._db:
+            for change, *args in changes:
+                if change not in ("set_stage", "classify", "unclassify", "delete"):
+                    raise ValueError(f"Unknown label change: {change}")
+                getattr(self, f"_{change}")(*args)
+
+    def get(self, sample_id):
+        """Labels of one sample as a dict, or None"""
+        rows = self.query(sample_ids=[sample_id])
+        return rows[0] if rows else None
+
+    # Queries
+
+    def _where(self, stage=None, status=None, tags=(), since=None, until=None, sample_ids=None):
+        clauses, params = [], []
+        if stage is not None:
+            clauses.append("s.stage = ?")
+            params.append(stage)
+        if status is not None:
+            clauses.append("s.status = ?")
+            params.append(status)
+        if since is not None:
+            clauses.append("s.created >= ?")
+            params.append(parse_time(since))
+        if until is not None:
+            clauses.append("s.created < ?")
+            params.append(parse_time(until))
+        if tags:
+            # Samples carrying every one of the tags
+            clauses.append(
+                f"s.id IN (SELECT sample_id FROM sample_tags WHERE tag IN ({', '.join('?' * len(tags))}) "
+                "GROUP BY sample_id HAVING COUNT(*) = ?)"
+            )
+            params.extend([*tags, len(tags)])
+        if sample_ids is not None:
+            clauses.append(f"s.id IN ({', '.join('?' * len(sample_ids))})")
+            params.extend(sample_ids)
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def query(self, stage=None, status=None, tags=(), since=None, until=None, sample_ids=None, limit=None):
+        """
+        Samples matching every given filter, oldest first.
+
+        ``tags`` matches samples that carry all of them, ``since`` and ``until`` take
+        epoch seconds or ISO dates and bound the capture time.
+        """
+        where, params = self._where(stage, status, tags, since, until, sample_ids)
+        limit_clause = f"LIMIT {int(limit)}" if limit else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT s.*, GROUP_CONCAT(t.tag, ',') AS tag_list FROM samples s "
+                f"LEFT JOIN sample_tags t ON t.sample_id = s.id {where} "
+                f"GROUP BY s.id ORDER BY s.created, s.id {limit_clause}",
+                params,
+            ).fetchall()
+        results = []
+        for row in rows:
+            sample = dict(row)
+            tag_list = sample.pop("tag_list")
+            sample["tags"] = sorted(tag_list.split(",")) if tag_list else []
+            results.append(sample)
+        return results
+
+    def label_matrix(self, columns=None, stage=SAMPLES, **filters):
+        """
+        Multi-hot labels for training: (sample IDs, uint8 matrix of shape (samples, columns)).
+
+        A column is set when it is the status of the sample or one of its tags, the
+        default columns are the statuses in use followed by the tag list.
+        """
+        columns = list(columns) if columns is not None else [*self.statuses(), *self.tags()]
+        column_index = {name: i for i, name in enumerate(columns)}
+        where, params = self._where(stage=stage, **filters)
+        with self._lock:
+            samples = self._db.execute(f"SELECT s.id, s.status FROM samples s {where} ORDER BY s.created, s.id",
+                                       params).fetchall()
+            pairs = self._db.execute(f"SELECT t.sample_id, t.tag FROM sample_tags t JOIN samples s ON s.id = t.sample_id {where}",
+                                     params).fetchall()
+
+        sample_ids = [row[0] for row in samples]
+        row_index = {sample_id: i for i, sample_id in enumerate(sample_ids)}
+        matrix = np.zeros((len(sample_ids), len(columns)), dtype=np.uint8)
+        hits = [(row_index[sample_id], column_index[name])
+                for sample_id, name in [*samples, *pairs] if name in column_index]
+        if hits:
+            rows, cols = zip(*hits)
+            matrix[list(rows), list(cols)] = 1
+        return sample_ids, matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=LABELS_DB)
+    commands = parser.add_subparsers(dest="command", required=True)
+    query_parser = commands.add_parser("query", help="list matching samples as JSON lines")
+    export_parser = commands.add_parser("export", help="write sample IDs and a multi-hot label matrix to .npz")
+    export_parser.add_argument("--out", default=os.path.join("data", "labels.npz"))
+    for command in (query_parser, export_parser):
+        command.add_argument("--stage", default=SAMPLES)
+        command.add_argument("--status")
+        command.add_argument("--tags", type=lambda s: s.split(","), default=[], help="comma separated, all must match")
+        command.add_argument("--since", help="epoch seconds or ISO date")
+        command.add_argument("--until", help="epoch seconds or ISO date")
+    args = parser.parse_args()
+
+    store = LabelStore(args.db)
+    filters = dict(stage=args.stage, status=args.status, tags=args.tags, since=args.since, until=args.until)
+    if args.command == "query":
+        for sample in store.query(**filters):
+            print(json.dumps(sample))
+    else:
+        columns = [*store.statuses(), *store.tags()]
+        sample_ids, matrix = store.label_matrix(columns, **filters)
+        np.savez(args.out, ids=np.array(sample_ids), labels=matrix, columns=np.array(columns))
+        logger.info(f"Exported {len(sample_ids)} samples x {len(columns)} labels to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
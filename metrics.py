@@ -0,0 +1,315 @@
+"""
+Counters, gauges and histograms for the capture pipeline, rendered in the Prometheus
+text exposition format by ``render()``.
+
+Updates are a lock and a few additions, cheap enough for the audio callback. Metrics
+are registered once at import time in the module that updates them:
+
+    CALLBACK_DURATION = metrics.histogram("callback_duration_seconds", "Audio callback run time")
+    CALLBACK_DURATION.observe(elapsed)
+"""
+import bisect
+import collections
+import math
+import sys
+import threading
+import time
+
+from loguru import logger
+
+PREFIX = "detectonist_"
+
+# Histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DURATION_BUCKETS = (0.25, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0)
+
+_registry = collections.OrderedDict()
+_registry_lock = threading.Lock()
+
+
+def _label_text(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function  # Read at scrape time instead of being updated, see samples()
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """The child metric for one combination of label values"""
+        key = tuple(str(kwargs[name]) for name in self.labelnames) if kwargs else tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def samples(self):
+        """(suffix, label text, value) tuples of the current state"""
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as e:
+                logger.warning(f"Could not read metric {self.name}: {e}")
+                return []
+            if not self.labelnames:
+                return [("", "", value)]
+            # Labelled metrics read from a function return {label values: value}
+            return [("", _label_text(self.labelnames, key if isinstance(key, tuple) else (key,)), v)
+                    for key, v in value.items()]
+        result = []
+        for key, child in list(self._children.items()):
+            result.extend(self._child_samples(key, child))
+        return result
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_number(value)}" for suffix, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonic count, by convention named ..._total"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1.0):
+        self._children[()].inc(amount)
+
+    def _child_samples(self, key, child):
+        return [("", _label_text(self.labelnames, key), child.value)]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._children[()].set(value)
+
+    def inc(self, amount=1.0):
+        self._children[()].inc(amount)
+
+    def _child_samples(self, key, child):
+        return [("", _label_text(self.labelnames, key), child.value)]
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    """Context manager observing the elapsed time of its block"""
+
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def _child_samples(self, key, child):
+        with child._lock:
+            counts, total = list(child.counts), child.sum
+        result, cumulative = [], 0
+        for bound, count in zip([*self.buckets, math.inf], counts):
+            cumulative += count
+            le = "+Inf" if math.isinf(bound) else repr(float(bound))
+            result.append(("_bucket", _label_text(self.labelnames, key, [("le", le)]), cumulative))
+        labels = _label_text(self.labelnames, key)
+        result.append(("_sum", labels, total))
+        result.append(("_count", labels, cumulative))
+        return result
+
+
+def _register(metric):
+    with _registry_lock:
+        if metric.name in _registry:
+            return _registry[metric.name]
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name, documentation, labelnames=(), function=None):
+    return _register(Counter(name, documentation, labelnames, function))
+
+
+def gauge(name, documentation, labelnames=(), function=None):
+    return _register(Gauge(name, documentation, labelnames, function))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render(exclude=()):
+    """Every registered metric in the Prometheus text format, except the ones named in ``exclude``"""
+    with _registry_lock:
+        metrics = [metric for name, metric in _registry.items() if name not in exclude]
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def names(text):
+    """Names of the metrics in a rendered exposition, e.g. one received from another process"""
+    return {line.split()[2] for line in text.splitlines() if line.startswith("# TYPE ")}
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for a running process.
+
+    A background thread snapshots the stack of every other thread each ``interval``
+    seconds and counts them as collapsed stacks (``frame;frame;frame count``), the input
+    format of flamegraph.pl and speedscope. Nothing is traced between samples, so the
+    overhead is one stack walk per thread per interval.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        """Start sampling from an empty profile"""
+        if self._thread is not None:
+            return
+        if interval:
+            self.interval = interval
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"Sampling profiler started, every {self.interval * 1000:.1f} ms")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logger.info(f"Sampling profiler stopped after {self.samples} samples")
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.max_depth:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """The profile as collapsed stacks, most frequent first"""
+        with self._lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def status(self):
+        return {
+            "active": self.active,
+            "interval": self.interval,
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "started": self.started,
+        }
+
+
+profiler = SamplingProfiler()
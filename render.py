@@ -0,0 +1,122 @@
+import struct
+import zlib
+
+import numpy as np
+
+FAST = "fast"  # colormap lookup straight to PNG, no figure or axes
+PRETTY = "pretty"  # matplotlib specshow figure, as the sampler originally rendered
+
+# Magma sampled at 17 evenly spaced points, the colormap librosa's specshow picks for dB data
+MAGMA_ANCHORS = (
+    (0, 0, 4),
+    (10, 8, 34),
+    (29, 17, 71),
+    (54, 16, 107),
+    (81, 18, 124),
+    (106, 28, 129),
+    (131, 38, 129),
+    (156, 46, 127),
+    (183, 55, 121),
+    (208, 65, 111),
+    (231, 82, 99),
+    (245, 107, 92),
+    (252, 137, 97),
+    (254, 167, 114),
+    (254, 196, 136),
+    (253, 226, 163),
+    (252, 253, 191),
+)
+
+
+def colormap_lut(anchors=MAGMA_ANCHORS, size=256):
+    """Interpolate colormap anchor points into a (size, 3) uint8 lookup table"""
+    anchors = np.asarray(anchors, dtype=np.float32)
+    xp = np.linspace(0.0, 1.0, len(anchors))
+    x = np.linspace(0.0, 1.0, size)
+    lut = np.stack([np.interp(x, xp, anchors[:, c]) for c in range(3)], axis=1)
+    return np.round(lut).astype(np.uint8)
+
+
+_MAGMA_LUT = colormap_lut()
+
+
+def spectrogram_to_rgb(S_db, top_db=80.0, lut=None, row_scale=4, col_scale=1):
+    """
+    Map a dB spectrogram (n_mels, frames) to an RGB image array.
+
+    Values are scaled from [max - top_db, max] onto the lookup table, the frequency
+    axis is flipped so low bands sit at the bottom like specshow, and rows/columns
+    are repeated by the given integer factors to make the image readable.
+    """
+    lut = _MAGMA_LUT if lut is None else lut
+    S_db = np.asarray(S_db, dtype=np.float32)
+    peak = float(S_db.max()) if S_db.size else 0.0
+    scaled = (S_db - (peak - top_db)) * ((len(lut) - 1) / top_db)
+    index = np.clip(scaled, 0, len(lut) - 1).astype(np.uint8)[::-1]
+    if row_scale > 1:
+        index = np.repeat(index, row_scale, axis=0)
+    if col_scale > 1:
+        index = np.repeat(index, col_scale, axis=1)
+    return lut[index]
+
+
+def encode_png(rgb, compress_level=1):
+    """Encode an (height, width, 3) uint8 array as PNG bytes"""
+    rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+    height, width, _ = rgb.shape
+    # Every scanline is prefixed with filter type 0 (none)
+    raw = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 0] = 0
+    raw[:, 1:] = rgb.reshape(height, width * 3)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", header),
+        chunk(b"IDAT", zlib.compress(raw.tobytes(), compress_level)),
+        chunk(b"IEND", b""),
+    ])
+
+
+def thumbnail_png(S_db, width, top_db=80.0, lut=None):
+    """PNG of the spectrogram with its time axis mean-pooled down to at most ``width`` columns, one row per band"""
+    S_db = np.asarray(S_db, dtype=np.float32)
+    frames = S_db.shape[1]
+    if frames > width:
+        starts = (np.arange(width) * frames) // width
+        counts = np.diff(np.append(starts, frames))
+        # Pooling lowers the peak, keep the floor of the full image so the colours match it
+        floor = S_db.max() - top_db
+        S_db = np.add.reduceat(S_db, starts, axis=1) / counts
+        top_db = max(float(S_db.max()) - floor, 1e-3)
+    return encode_png(spectrogram_to_rgb(S_db, top_db=top_db, lut=lut, row_scale=1))
+
+
+def save_fast(S_db, path, top_db=80.0, lut=None):
+    """Write the spectrogram PNG directly from the array"""
+    with open(path, "wb") as f:
+        f.write(encode_png(spectrogram_to_rgb(S_db, top_db=top_db, lut=lut)))
+
+
+def save_pretty(S_db, path, sr):
+    """Write the spectrogram PNG through a matplotlib figure, importing matplotlib on first use"""
+    import librosa.display
+    from matplotlib.figure import Figure
+
+    # Figure without pyplot, so several writer threads can render at once
+    fig = Figure(figsize=(10, 4))
+    ax = fig.add_subplot()
+    librosa.display.specshow(S_db, sr=sr, ax=ax)
+    fig.savefig(path)
+
+
+def save_spectrogram(S_db, path, sr, mode=FAST):
+    if mode == PRETTY:
+        save_pretty(S_db, path, sr)
+    elif mode == FAST:
+        save_fast(S_db, path)
+    else:
+        raise ValueError(f"Unknown spectrogram render mode: {mode}")
@@ -0,0 +1,119 @@
+"""
+Replay recorded audio through the TriggerDetector faster than real time.
+
+Used to benchmark segmentation and to regression-test it offline:
+
+    python replay.py data/input/*.npy --blocksize 1024 --json segments.json
+    python replay.py data/input/*.npy --expect segments.json
+
+Thresholds come from --noise-threshold/--silence-threshold, or from calibrating on
+the first --calibration-seconds of each recording, by default as long as the sampler
+calibrates.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from loguru import logger
+
+import detector
+import sampler
+from calibration import OnlineCalibrator
+
+SAMPLE_RATE = 48000
+
+
+def load_audio(path):
+    """Load a recording as float32 mono, .npy files are memory-mapped"""
+    if path.endswith(".npy"):
+        audio = np.load(path, mmap_mode="r")
+    else:
+        import soundfile as sf
+        audio, _ = sf.read(path, dtype="float32", always_2d=True)
+        audio = audio[:, 0]
+    return audio
+
+
+def calibrate(audio, seconds, sample_rate=SAMPLE_RATE):
+    """Thresholds from the start of a recording, the same way the sampler calibrates"""
+    calibrator = OnlineCalibrator()
+    calibrator.update(np.asarray(audio[:int(seconds * sample_rate)], dtype=np.float32))
+    return calibrator.noise_threshold(), calibrator.silence_threshold()
+
+
+def replay(audio, trigger_detector, blocksize=1024):
+    """Feed a recording through the detector block by block, returns [(start, stop, reason), ...] in samples"""
+    segments = []
+    start = None
+    for block_start in range(0, len(audio), blocksize):
+        block = np.asarray(audio[block_start:block_start + blocksize], dtype=np.float32)
+        for event in trigger_detector.process(block):
+            if event[0] == detector.START:
+                start = block_start + event[1]
+            else:
+                segments.append((start, block_start + event[1], event[2]))
+                start = None
+    return segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help=".npy or .wav recordings")
+    parser.add_argument("--blocksize", type=int, default=1024)
+    parser.add_argument("--sample-rate", type=int, default=SAMPLE_RATE)
+    parser.add_argument("--noise-threshold", type=float)
+    parser.add_argument("--silence-threshold", type=float)
+    parser.add_argument("--calibration-seconds", type=float, default=sampler.CALIBRATION_TIME / 1000)
+    parser.add_argument("--max-duration", type=float, default=2.0)
+    parser.add_argument("--json", help="write the segments to this file")
+    parser.add_argument("--expect", help="compare the segments with a file written by --json")
+    args = parser.parse_args()
+
+    results = {}
+    total_samples = 0
+    total_time = 0.0
+    for path in args.files:
+        audio = load_audio(path)
+        noise, silence = calibrate(audio, args.calibration_seconds, args.sample_rate)
+        noise = args.noise_threshold if args.noise_threshold is not None else noise
+        silence = args.silence_threshold if args.silence_threshold is not None else silence
+
+        trigger_detector = detector.TriggerDetector(
+            args.sample_rate, noise, silence, max_duration=args.max_duration
+        )
+        started = time.perf_counter()
+        segments = replay(audio, trigger_detector, args.blocksize)
+        elapsed = time.perf_counter() - started
+
+        total_samples += len(audio)
+        total_time += elapsed
+        results[os.path.basename(path)] = [list(segment) for segment in segments]
+        logger.info(
+            f"{os.path.basename(path)}: {len(segments)} segments, "
+            f"{len(audio) / args.sample_rate / elapsed:.0f}x real time"
+        )
+
+    if total_time:
+        logger.info(f"Replayed {total_samples / args.sample_rate:.1f} s of audio at "
+                    f"{total_samples / args.sample_rate / total_time:.0f}x real time")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.expect:
+        with open(args.expect) as f:
+            expected = json.load(f)
+        mismatched = [name for name in results if results[name] != expected.get(name)]
+        for name in mismatched:
+            logger.error(f"{name}: expected {expected.get(name)}, got {results[name]}")
+        if mismatched:
+            sys.exit(1)
+        logger.info(f"Segments match {args.expect}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import bisect
+import os
+import threading
+
+from loguru import logger
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+
+class SortedIndex:
+    """
+    In-memory set of names kept sorted by name and by (mtime, name).
+
+    The first name and the latest k by modification time are answered without
+    touching the disk.
+    """
+
+    def __init__(self, entries=None):
+        self._lock = threading.Lock()
+        self.reset(entries or {})
+
+    def reset(self, entries):
+        """Replace the contents with a {name: mtime} mapping"""
+        with self._lock:
+            self._mtimes = dict(entries)
+            self._by_name = sorted(self._mtimes)
+            self._by_mtime = sorted((mtime, name) for name, mtime in self._mtimes.items())
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def __contains__(self, name):
+        return name in self._mtimes
+
+    def add(self, name, mtime):
+        with self._lock:
+            if name in self._mtimes:
+                self._by_mtime.remove((self._mtimes[name], name))
+            else:
+                bisect.insort(self._by_name, name)
+            self._mtimes[name] = mtime
+            bisect.insort(self._by_mtime, (mtime, name))
+
+    def remove(self, name):
+        with self._lock:
+            mtime = self._mtimes.pop(name, None)
+            if mtime is None:
+                return
+            del self._by_name[bisect.bisect_left(self._by_name, name)]
+            del self._by_mtime[bisect.bisect_left(self._by_mtime, (mtime, name))]
+
+    def first(self):
+        """First name in sort order, or None when empty"""
+        with self._lock:
+            return self._by_name[0] if self._by_name else None
+
+    def head(self, k):
+        """The first k names in sort order"""
+        with self._lock:
+            return self._by_name[:k] if k > 0 else []
+
+    def latest(self, k):
+        """The k most recently modified names, latest first"""
+        with self._lock:
+            return [name for _, name in reversed(self._by_mtime[-k:])] if k > 0 else []
+
+
+class DirectoryIndex(SortedIndex):
+    """
+    SortedIndex of the files with one extension in a directory.
+
+    The index is kept current by the labeler handlers that move files and by
+    a watchdog observer for files written by the sampler.
+    """
+
+    def __init__(self, directory, ext=".png"):
+        self.directory = directory
+        self.ext = ext
+        super().__init__()
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild the index from a full directory listing"""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(self.ext):
+                try:
+                    entries[name] = os.path.getmtime(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+        self.reset(entries)
+
+    def add(self, name, mtime=None):
+        if not name.endswith(self.ext):
+            return
+        if mtime is None:
+            try:
+                mtime = os.path.getmtime(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                return
+        super().add(name, mtime)
+
+
+class _IndexEventHandler(FileSystemEventHandler):
+    def __init__(self, indexes):
+        self.indexes = {os.path.abspath(index.directory): index for index in indexes}
+
+    def _index_for(self, path):
+        return self.indexes.get(os.path.dirname(os.path.abspath(path)))
+
+    def _added(self, path):
+        index = self._index_for(path)
+        if index is not None:
+            index.add(os.path.basename(path))
+
+    def _removed(self, path):
+        index = self._index_for(path)
+        if index is not None:
+            index.remove(os.path.basename(path))
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._added(event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self._removed(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._removed(event.src_path)
+            self._added(event.dest_path)
+
+
+def watch(indexes):
+    """Start a watchdog observer keeping the given indexes current, returns the observer"""
+    observer = Observer()
+    handler = _IndexEventHandler(indexes)
+    for index in indexes:
+        observer.schedule(handler, index.directory, recursive=False)
+    observer.daemon = True
+    observer.start()
+    logger.info(f"Watching {', '.join(index.directory for index in indexes)}")
+    return observer
@@ -1,98 +1,364 @@
-import collections
-import hashlib
+import argparse
+import contextlib
+import functools
 import os.path
 import signal
 import sys
 import time
 
 import soundfile as sf
-import librosa
-import matplotlib.pyplot as plt
 import numpy as np
-import sounddevice as sd
 from loguru import logger
 
+import archive
+import dedup
+import detector
+import events
+import features
+import inference
+import labels
+import metrics
+import render
+import similarity
+import writer
+from buffers import CaptureBuffer, RingBuffer
+from calibration import OnlineCalibrator
+
 INPUT_DIR = os.path.join("data", "input")
+# Every stage a capture can be in, used to seed the dedup index the first time
+SAMPLE_DIRS = [INPUT_DIR, os.path.join("data", "unclassified"), os.path.join("data", "samples")]
+STAGE_DIRS = dict(zip([labels.INPUT, labels.UNCLASSIFIED, labels.SAMPLES], SAMPLE_DIRS))
+# Detection defaults, shared with the offline tools (replay.py, batch.py) so they segment like live capture
 MAX_RECORDING_TIME = 2
+CALIBRATION_TIME = 3000  # Milliseconds of audio a channel calibrates on
+BUFFER_DURATION = 2  # Seconds of pre-trigger audio
+SILENCE_DURATION = 1  # Seconds required to declare silence
+MIN_RECORDING_TIME = 1  # Seconds before silence may end a capture
+ROLLING_WINDOW = 20  # Envelope frames for silence detection up from 10
+ENVELOPE_HOP = 256  # Samples per envelope frame
+SILENCE_HYSTERESIS = 1.25  # Level over the silence threshold that cancels a silence
+# "files" for png/wav/npy triplets, "archive" for packed records written by the CaptureRegistry
+STORAGE_BACKENDS = ("files", "archive")
+
+
+@functools.lru_cache(maxsize=None)
+def sounddevice():
+    """The sounddevice module, imported and configured when the first stream opens rather than on import"""
+    import sounddevice as sd
+
+    sd.default.device = 1
+    sd.default.latency = 'high'
+    sd.default.dtype = 'float32'
+    sd.default.samplerate = 48000
+
+    logger.info(sd.query_devices())
+    return sd
+
+
+# Capture pipeline metrics, served by the labeler at /api/metrics
+CALLBACK_DURATION = metrics.histogram("callback_duration_seconds", "Audio callback run time per block")
+CALLBACK_BLOCK = metrics.histogram("callback_block_seconds", "Audio per callback block",
+                                   buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+INPUT_OVERFLOWS = metrics.counter("input_overflows_total", "Blocks where the input stream overflowed")
+INPUT_UNDERFLOWS = metrics.counter("input_underflows_total", "Blocks where the input stream underflowed")
+CAPTURE_LENGTH = metrics.histogram("capture_length_seconds", "Length of finished captures",
+                                   buckets=metrics.DURATION_BUCKETS)
+CAPTURES = metrics.counter("captures_total", "Finished captures by channel and outcome", ["channel", "outcome"])
+PROCESS_DURATION = metrics.histogram("process_duration_seconds", "Time to persist a capture by stage", ["stage"])
+
+
+class GroupFlag:
+    """A Channel flag stored in its InputGroup's per-slot array, so a block tests every channel at once"""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, channel, owner=None):
+        if channel is None:
+            return self
+        return bool(channel.group.flags[self.name][channel.slot])
+
+    def __set__(self, channel, value):
+        channel.group.flags[self.name][channel.slot] = value
+
+
+class Channel:
+    """Thresholds, calibration flags and the capture in progress of one input channel"""
+
+    sampling_active = GroupFlag()
+    recording = GroupFlag()
+    calibrated = GroupFlag()
+    calibrating = GroupFlag()
+
+    def __init__(self, index, group, slot, capture_size, noise_threshold, silence_threshold):
+        self.index = index  # Across all devices
+        self.group = group
+        self.slot = slot  # Column in the blocks of its device
+        self.sampling_active = False
+        self.recording = False
+        self.triggered_at = None
+        self.calibrated = False
+        self.calibrating = False
+        self.noise_threshold = noise_threshold
+        self.silence_threshold = silence_threshold
+        self.capture_buffer = CaptureBuffer(capture_size)
+        self.writer = None
+
+    def status(self):
+        return {
+            "channel": self.index,
+            "device": self.group.device,
+            "device_channel": self.slot,
+            "sampling_active": self.sampling_active,
+            "calibrated": self.calibrated,
+            "recording": self.recording,
+            "noise_threshold": self.noise_threshold,
+            "silence_threshold": self.silence_threshold,
+            "writer": self.writer.stats(),
+        }
+
+
+class InputGroup:
+    """
+    The channels of one input device.
+
+    They share a stream, so every block is processed as one (samples, channels) array:
+    one ring buffer write, one calibrator update and one detector pass for all of them.
+    """
+
+    def __init__(self, device, ring_size, detector, calibrator, background_calibrator):
+        self.device = device
+        self.ring_buffer = RingBuffer(ring_size, channels=detector.channels)
+        self.detector = detector
+        self.calibrator = calibrator
+        self.background_calibrator = background_calibrator
+        self.samples_since_recalibration = 0
+        self.channels = []
+        # The GroupFlags of the channels, one element per slot
+        self.flags = {name: np.zeros(detector.channels, dtype=bool)
+                      for name in ("sampling_active", "recording", "calibrated", "calibrating")}
+
+
+class CaptureRegistry:
+    """
+    What happens to a capture once it is rendered: the packed archive, the label store,
+    the similarity index, live inference and the UI event.
+
+    Owned by the process serving the labeler: the sampler's own when it runs in a
+    thread, the labeler's when the sampler runs in a process of its own (see
+    sampler_process.py).
+    """
+
+    def __init__(self, sample_rate, storage_backend="files", model_path=inference.MODEL_PATH, inference_batch=8):
+        if storage_backend not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown storage backend {storage_backend!r}, expected one of {STORAGE_BACKENDS}")
+        self.sample_rate = sample_rate
+        self.storage_backend = storage_backend
+
+        # Packed single-record storage, None when captures are written as file triplets
+        self.archive = archive.SampleArchive() if storage_backend == "archive" else None
+
+        # Status, tags and capture thresholds of every sample, seeded from existing captures the first time
+        seed = labels.archive_entries(self.archive) if self.archive is not None else labels.file_entries(STAGE_DIRS)
+        self.labels = labels.LabelStore(seed=seed)
+
+        # Embeddings of every capture for "find similar" in the labeler
+        self.similarity = similarity.SimilarityIndex()
+
+        # Classifier run on every saved capture, None when there is no exported model
+        self.inference = inference.InferenceStage.load(model_path, max_batch=inference_batch)
+        if self.inference:
+            metrics.gauge("inference_queue_depth", "Captures waiting for the classifier",
+                          function=self.inference._queue.qsize)
+
+    def register(self, sample_id, audio_sample, S_db, channel=0, noise_threshold=None, silence_threshold=None,
+                 triggered_at=None, captured_at=None):
+        if self.archive is not None:
+            with PROCESS_DURATION.labels(stage="save").time():
+                self.archive.put(sample_id, audio_sample, S_db, self.sample_rate)
+        self.labels.add_capture(sample_id, noise_threshold=noise_threshold, silence_threshold=silence_threshold)
+        self.similarity.add(sample_id, similarity.embed(S_db))
+        events.publish(events.NEW_CAPTURE, {"id": sample_id, "samples": len(audio_sample), "channel": channel})
+        if self.inference:
+            # Classify from the same mel matrix the spectrogram was rendered from
+            self.inference.submit(sample_id, S_db, triggered_at=triggered_at, captured_at=captured_at)
 
-sd.default.device = 1
-sd.default.latency = 'high'
-sd.default.dtype = 'float32'
-sd.default.samplerate = 48000
 
-logger.info(sd.query_devices())
+class AudioClassifierApp:
+    def __init__(self, register=True, storage_backend="files", devices=(None,), channels=1):
+        """
+        Initialize audio parameters and recording variables.
 
+        ``devices`` are captured concurrently, None for the sounddevice default, each with
+        ``channels`` channels that get their own calibration, trigger and capture queue.
+
+        With ``register=False`` the archive, label store, similarity index and inference
+        are left to another process, rendered captures are passed to ``self.handoff``.
+        ``storage_backend`` is one of STORAGE_BACKENDS and must match that process's.
+        """
+        if storage_backend not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown storage backend {storage_backend!r}, expected one of {STORAGE_BACKENDS}")
+        self._storage_backend = storage_backend
 
-class AudioClassifierApp:
-    def __init__(self):
-        """Initialize audio parameters and recording variables"""
         # Configuration
         self.SAMPLE_RATE = 48000  # Hz
-        self.BUFFER_DURATION = 2  # Seconds
+        self.BUFFER_DURATION = BUFFER_DURATION  # Seconds
         self.NOISE_THRESHOLD = 0.1  # Initial noise threshold
         self.SILENCE_THRESHOLD = 0.02  # Silence level
-        self.SILENCE_DURATION = 1  # Seconds required to declare silence
-        self.CALIBRATION_TIME = 3000  # Calibration time in milliseconds
-        self.CHANNELS = 1
-        self.ROLLING_WINDOW = 20  # Frames for silence detection up from 10
+        self.SILENCE_DURATION = SILENCE_DURATION  # Seconds required to declare silence
+        self.CALIBRATION_TIME = CALIBRATION_TIME  # Calibration time in milliseconds
+        self.ROLLING_WINDOW = ROLLING_WINDOW  # Envelope frames for silence detection
+        self.ENVELOPE_HOP = ENVELOPE_HOP  # Samples per envelope frame
+        self.SILENCE_HYSTERESIS = SILENCE_HYSTERESIS  # Level over the silence threshold that cancels a silence
+        self.MIN_RECORDING_TIME = MIN_RECORDING_TIME  # Seconds before silence may end a capture
+        self.WRITER_QUEUE_SIZE = 16  # Captures waiting to be saved
+        self.WRITER_WORKERS = 2  # Threads rendering and saving captures
+        self.WRITER_POLICY = writer.DROP_OLDEST  # What to do when the queue is full
+        self.SPECTROGRAM_MODE = render.FAST  # render.PRETTY for the matplotlib figure
+        self.CONTINUOUS_CALIBRATION = False  # Keep re-calibrating in the background while capturing
+        self.RECALIBRATION_WINDOW = 30  # Seconds, decay window of the background calibration
+        self.RECALIBRATION_INTERVAL = 1  # Seconds between background threshold updates
+        self.MODEL_PATH = inference.MODEL_PATH  # Exported classifier, live inference is off without one
+        self.INFERENCE_BATCH = 8  # Most captures scored in one model call
+        self.INPUT_STREAM = None  # None for the sound card, or a stand-in with the sd.InputStream signature
 
         # Compute buffer size
         self.BUFFER_SIZE = int(self.SAMPLE_RATE * self.BUFFER_DURATION)
-
-        # Audio Buffers
-        self.ring_buffer = collections.deque(maxlen=self.BUFFER_SIZE)
-        self.rolling_silence_buffer = collections.deque(maxlen=self.ROLLING_WINDOW)
-
-        # Flags & Variables
-        self.recording = False
-        self.captured_audio = []
-        self.silence_start_time = None
-        self.calibrated = False
-        self.calibrating = False
-        self.calibration_start_time = None
-        self.calibrated_noise_threshold = self.NOISE_THRESHOLD
-        self.calibrated_silence_threshold = self.SILENCE_THRESHOLD
-        self.calibration_data = []
-        self.recording_start_time = None
-
-        self.sampling_active = False
+        # Pre-trigger audio plus the longest capture, with a second of slack for block overshoot
+        self.CAPTURE_SIZE = self.BUFFER_SIZE + self.SAMPLE_RATE * (MAX_RECORDING_TIME + 1)
+
+        # Channels of every device, each device processed as one vectorized block per callback
+        self.groups = []
+        self.channels = []
+        for device in devices:
+            group = InputGroup(
+                device,
+                self.BUFFER_SIZE,
+                # Capture boundaries, counted in samples rather than wall-clock time
+                detector.MultiChannelDetector(
+                    self.SAMPLE_RATE,
+                    channels,
+                    self.NOISE_THRESHOLD,
+                    self.SILENCE_THRESHOLD,
+                    min_duration=self.MIN_RECORDING_TIME,
+                    max_duration=MAX_RECORDING_TIME,
+                    silence_duration=self.SILENCE_DURATION,
+                    rolling_window=self.ROLLING_WINDOW,
+                    hop=self.ENVELOPE_HOP,
+                    hysteresis=self.SILENCE_HYSTERESIS,
+                ),
+                # Streaming calibration, constant memory and per-block cost
+                OnlineCalibrator(channels=channels),
+                OnlineCalibrator(decay_window=self.SAMPLE_RATE * self.RECALIBRATION_WINDOW, channels=channels),
+            )
+            for slot in range(channels):
+                channel = Channel(len(self.channels), group, slot, self.CAPTURE_SIZE,
+                                  self.NOISE_THRESHOLD, self.SILENCE_THRESHOLD)
+                group.channels.append(channel)
+                self.channels.append(channel)
+            self.groups.append(group)
+
+        # Archive, labels, similarity and inference of saved captures
+        self.registry = CaptureRegistry(
+            self.SAMPLE_RATE,
+            storage_backend=storage_backend,
+            model_path=self.MODEL_PATH,
+            inference_batch=self.INFERENCE_BATCH,
+        ) if register else None
+        self.archive = self.registry.archive if register else None
+        self.labels = self.registry.labels if register else None
+        self.similarity = self.registry.similarity if register else None
+        self.inference = self.registry.inference if register else None
+        self.handoff = self.registry.register if register else None
+
+        # Sample IDs already stored, so identical captures are saved once
+        if self.storage_backend == "archive":
+            # Records are keyed by their sample ID, nothing to re-hash. Without a registry the
+            # archive belongs to the labeler process, it is only read here to seed a new index
+            packed = self.archive if register else None
+            self.dedup_index = dedup.DedupIndex(seed_ids=lambda: list((packed or archive.SampleArchive()).meta))
+        else:
+            self.dedup_index = dedup.DedupIndex(seed_dirs=SAMPLE_DIRS)
+
+        # Persistence runs off the audio thread, every channel has its own queue
+        for channel in self.channels:
+            channel.writer = writer.SampleWriter(
+                self.process_audio,
+                maxsize=self.WRITER_QUEUE_SIZE,
+                workers=self.WRITER_WORKERS,
+                policy=self.WRITER_POLICY,
+            )
+
+        def per_channel(read):
+            return {channel.index: read(channel) for channel in self.channels}
+
+        metrics.gauge("writer_queue_depth", "Captures waiting to be saved", ["channel"],
+                      function=lambda: per_channel(lambda c: c.writer.depth()))
+        metrics.gauge("writer_queue_max_depth", "Deepest the writer queue has been", ["channel"],
+                      function=lambda: per_channel(lambda c: c.writer.max_depth))
+        metrics.counter("writer_dropped_total", "Captures dropped by the writer backpressure policy", ["channel"],
+                        function=lambda: per_channel(lambda c: c.writer.dropped))
+        metrics.gauge("noise_threshold", "Calibrated trigger level", ["channel"],
+                      function=lambda: per_channel(lambda c: c.noise_threshold))
+        metrics.gauge("silence_threshold", "Calibrated silence level", ["channel"],
+                      function=lambda: per_channel(lambda c: c.silence_threshold))
 
         # Register signal handler for clean exit
         signal.signal(signal.SIGINT, self.exit_handler)
 
-    def process_audio(self, audio_sample):
+    def process_audio(self, audio_sample, triggered_at=None, captured_at=None, channel=0):
         """Handle the recorded sample (e.g., save or analyze)"""
+        source = self.channels[channel]
+        filename = None
         try:
-            logger.info(f"Captured {len(audio_sample)} samples.")
-            filename = hashlib.sha1(f"{audio_sample}".encode(encoding="UTF-8")).digest().hex()
-            self.save_image(audio_sample, filename=filename)
+            started = time.perf_counter()
+            logger.info(f"Captured {len(audio_sample)} samples on channel {channel}.")
+            # Claimed before saving so a concurrent identical capture is skipped, given back if the save fails
+            claimed = dedup.content_id(audio_sample)
+            if not self.dedup_index.add(claimed):
+                logger.info(f"Duplicate capture {claimed}, skipping")
+                CAPTURES.labels(channel=channel, outcome="duplicate").inc()
+                return
+            filename = claimed
+            if self.storage_backend == "archive":
+                # Stored as one record by the registry
+                with PROCESS_DURATION.labels(stage="render").time():
+                    S_db = features.mel_db(audio_sample, sr=self.SAMPLE_RATE)
+            else:
+                S_db = self.save_image(audio_sample, filename=filename)
+            self.handoff(
+                filename, audio_sample, S_db,
+                channel=channel,
+                noise_threshold=source.noise_threshold,
+                silence_threshold=source.silence_threshold,
+                triggered_at=triggered_at,
+                captured_at=captured_at,
+            )
+            PROCESS_DURATION.labels(stage="total").observe(time.perf_counter() - started)
+            CAPTURES.labels(channel=channel, outcome="saved").inc()
         except Exception as e:
             logger.warning(f"error: {e}")
-            pass
+            CAPTURES.labels(channel=channel, outcome="failed").inc()
+            if filename is not None:
+                self.dedup_index.discard(filename)
+
+    def forget_capture(self, sample_id):
+        """Called when a capture is deleted, so the same audio is saved again if it recurs"""
+        self.dedup_index.discard(sample_id)
 
     def save_mel_spectrogram(self, audio_sample, filename=None):
-        audio_sample = np.array(audio_sample, dtype=np.float32)
         #audio_sample = np.array(audio_sample, dtype=np.float32) / np.iinfo(np.int16).max
-        S = librosa.feature.melspectrogram(
-            y=np.array(audio_sample),
-            sr=self.SAMPLE_RATE,
-            n_fft=1024,  # Smaller FFT window for better time resolution
-            hop_length=256,  # More frequent updates for transient signals
-            n_mels=64,  # Enough resolution for material identification
-            fmax=12000  # Higher max frequency to capture harmonics of metals
-        )
-        S_db = librosa.power_to_db(S, ref=np.max)
-        plt.figure(figsize=(10, 4))
-        librosa.display.specshow(S_db, sr=self.SAMPLE_RATE)
-        plt.savefig(f"{INPUT_DIR}/{filename}.png")
-        plt.close()
+        with PROCESS_DURATION.labels(stage="render").time():
+            S_db = features.mel_db(audio_sample, sr=self.SAMPLE_RATE)
+            render.save_spectrogram(S_db, f"{INPUT_DIR}/{filename}.png", sr=self.SAMPLE_RATE, mode=self.SPECTROGRAM_MODE)
+        return S_db
 
 
     def save_wav(self, audio_sample, filename=None):
         """
         Save the audio sample as a WAV file at self.SAMPLE_RATE.
         """
-        audio_array = np.array(audio_sample, dtype=np.float32)  # Ensure float32 for typical WAV usage
+        audio_array = np.asarray(audio_sample, dtype=np.float32)  # Ensure float32 for typical WAV usage
         wav_path = f"{INPUT_DIR}/{filename}.wav"
 
         # Write the file
@@ -105,7 +371,7 @@ class AudioClassifierApp:
         Save the audio sample as a .npy (NumPy) file.
         """
         # Convert to a NumPy array if it's still a list
-        audio_array = np.array(audio_sample, dtype=np.float32)
+        audio_array = np.asarray(audio_sample, dtype=np.float32)
         npy_path = f"{INPUT_DIR}/{filename}.npy"
 
         np.save(npy_path, audio_array)
@@ -115,132 +381,228 @@ class AudioClassifierApp:
     def save_image(self, audio_sample, filename=None):
         """Convert audio sample to spectrogram and save as image"""
         # if image_type is ImageType.MEL_SPECTROGRAM:
-        self.save_mel_spectrogram(audio_sample, filename=filename)
-        self.save_wav(audio_sample, filename=filename)
-        self.save_npy(audio_sample, filename=filename)
-
-    def audio_callback(self, indata, frames, time_info, status):
-        """Audio stream callback for continuous audio capture"""
+        S_db = self.save_mel_spectrogram(audio_sample, filename=filename)
+        with PROCESS_DURATION.labels(stage="save").time():
+            self.save_wav(audio_sample, filename=filename)
+            self.save_npy(audio_sample, filename=filename)
+        return S_db
+
+    def audio_callback(self, indata, frames, time_info, status, group=None):
+        """Audio stream callback for continuous audio capture, one stream per input group"""
+        started = time.perf_counter()
         if status:
             logger.warning(f"Audio callback error: {status}")
-
-        # Convert to numpy array and flatten (in case of stereo)
-        audio_data = indata[:, 0]
-
-        # Perform calibration
-        if not self.calibrated and not self.calibration_start_time and not self.calibrating:
-            self.calibration_start_time = round(time.time() * 1000)
-            self.calibrating = True
-            self.calibration_data = []
-            self.recording_start_time = time.time()
-            logger.info("Starting calibration")
-
-        if not self.calibrated and self.calibrating:
-            self.calibration_data.extend(audio_data)
-            if (round(time.time() * 1000) - self.calibration_start_time) > self.CALIBRATION_TIME:
-                self.calibrated_noise_threshold = np.percentile(np.abs(self.calibration_data), 95) * 1.2
-                self.calibrated_silence_threshold = np.mean(np.abs(self.calibration_data)) + \
-                                                    np.std(np.abs(self.calibration_data)) * 0.5
-                logger.info(
-                    f"Calibration complete: noise_threshold: {self.calibrated_noise_threshold}, "
-                    f"silence_threshold: {self.calibrated_silence_threshold}"
-                )
-                self.calibrated = True
-                self.calibrating = False
-            else:
-                return  # Continue calibration
-
-        if not self.sampling_active:
+            if getattr(status, "input_overflow", False):
+                INPUT_OVERFLOWS.inc()
+            if getattr(status, "input_underflow", False):
+                INPUT_UNDERFLOWS.inc()
+        try:
+            # Every channel of the device at once, shape (frames, channels)
+            self.process_block(group or self.groups[0], indata)
+        finally:
+            CALLBACK_DURATION.observe(time.perf_counter() - started)
+            CALLBACK_BLOCK.observe(frames / self.SAMPLE_RATE)
+
+    def process_block(self, group, audio_data):
+        """Calibration, trigger detection and capture for one (samples, channels) block of a device"""
+        audio_data = np.asarray(audio_data).reshape(len(audio_data), len(group.channels))
+
+        # Channel state as per-slot arrays, the loops below only visit channels with something to do
+        flags = group.flags
+
+        # Perform calibration, its length is counted in samples on every channel separately
+        starting = ~(flags["calibrated"] | flags["calibrating"])
+        if starting.any():
+            flags["calibrating"] |= starting
+            group.calibrator.reset(np.flatnonzero(starting))
+            indexes = [group.channels[slot].index for slot in np.flatnonzero(starting)]
+            logger.info(f"Starting calibration of channel(s) {', '.join(map(str, indexes))}")
+        calibrating = flags["calibrating"].copy()
+        if calibrating.any():
+            group.calibrator.update(audio_data, calibrating)
+            done = calibrating & (group.calibrator.count >= self.SAMPLE_RATE * self.CALIBRATION_TIME / 1000)
+            if done.any():
+                noise, silence = group.calibrator.noise_threshold(), group.calibrator.silence_threshold()
+                group.detector.noise_threshold[done] = noise[done]
+                group.detector.silence_threshold[done] = silence[done]
+                flags["calibrated"] |= done
+                flags["calibrating"] &= ~done
+                for slot in np.flatnonzero(done):
+                    channel = group.channels[slot]
+                    channel.noise_threshold, channel.silence_threshold = float(noise[slot]), float(silence[slot])
+                    logger.info(
+                        f"Calibration of channel {channel.index} complete: noise_threshold: "
+                        f"{channel.noise_threshold}, silence_threshold: {channel.silence_threshold}"
+                    )
+                    events.publish(events.CALIBRATION_COMPLETE, {
+                        "channel": channel.index,
+                        "noise_threshold": channel.noise_threshold,
+                        "silence_threshold": channel.silence_threshold,
+                    })
+
+        calibrated = flags["calibrated"].copy()
+        if not calibrated.any():
+            return  # Continue calibration
+
+        # Follow slow changes in the noise floor, ignoring channels in the middle of a capture
+        if self.CONTINUOUS_CALIBRATION:
+            self.update_background_calibration(group, audio_data, calibrated & ~flags["recording"])
+
+        active = calibrated & flags["sampling_active"]
+        # A channel switched off mid-capture drops it, rather than resuming later with a gap in the audio
+        dropped = group.detector.recording & ~active
+        if dropped.any():
+            flags["recording"] &= ~dropped
+            for slot in np.flatnonzero(dropped):
+                group.detector.reset(slot)
+                group.channels[slot].capture_buffer.start()
+        if not active.any():
             return
 
         # Append to ring buffer
-        self.ring_buffer.extend(audio_data)
-
-        # Check if audio exceeds threshold (detect noise peak)
-        if not self.recording and np.max(np.abs(audio_data)) > self.calibrated_noise_threshold:
-            self.recording = True
-            self.captured_audio = list(self.ring_buffer)  # Store pre-trigger buffer
-            logger.info(f"Noise detected: {np.max(np.abs(audio_data))}, starting capture...")
-            self.rolling_silence_buffer.clear()  # Reset buffer on new recording
-
-
-        # Continue recording if active
-        if self.recording:
-            self.captured_audio.extend(audio_data)
-
-            if self.recording_start_time is None:
-                self.recording_start_time = time.time()  # Ensure it's always initialized
-
-            elapsed_time = time.time() - self.recording_start_time
-
-            # Ensure minimum recording time (1 second)
-            if elapsed_time < 1.0:
-                return  # Keep recording, do not stop yet
-
-            if elapsed_time >= MAX_RECORDING_TIME:
-                logger.info("Max recording time reached, stopping capture...")
-                self.stop_recording()
-                return
-
-            frame_amplitude = np.mean(np.abs(audio_data))
-            self.rolling_silence_buffer.append(frame_amplitude)
-
-            # Check if audio returns to silence (but only after min duration)
-            if elapsed_time >= 1.0 and np.mean(self.rolling_silence_buffer) < self.calibrated_silence_threshold:
-                if self.silence_start_time is None:
-                    self.silence_start_time = time.time()
-                    logger.info(f"Silence start detected at {self.silence_start_time:.3f}")
-                elif time.time() - self.silence_start_time >= self.SILENCE_DURATION:
-                    logger.info("Silence detected, stopping capture...")
-                    self.stop_recording()
+        group.ring_buffer.write(audio_data)
+
+        # Capture boundaries come from the detector as sample offsets within this block, per channel
+        offsets = np.zeros(len(group.channels), dtype=np.int64)
+        for slot, kind, at, detail in group.detector.process(audio_data, active):
+            channel = group.channels[slot]
+            if kind == detector.START:
+                channel.recording = True
+                channel.triggered_at = time.monotonic()
+                # Pre-trigger buffer, up to the triggering frame
+                pre_trigger = group.ring_buffer.view()[:, slot]
+                channel.capture_buffer.start(pre_trigger[:len(pre_trigger) - (len(audio_data) - at)])
+                logger.info(f"Noise detected on channel {channel.index}: {detail}, starting capture...")
             else:
-                # Reset silence detection if noise continues
-                if len(self.rolling_silence_buffer) == self.ROLLING_WINDOW and np.mean(
-                        self.rolling_silence_buffer) > self.calibrated_silence_threshold:
-                    logger.debug("Resetting silence start time due to sustained noise")
-                    self.silence_start_time = None
-
-        # Continue recording if active
-        # if self.recording:
-        #     self.captured_audio.extend(audio_data)
-        #
-        #     if self.recording_start_time and time.time() - self.recording_start_time >= MAX_RECORDING_TIME:
-        #         logger.info("Max recording time reached, stopping capture...")
-        #         self.recording = False
-        #         self.process_audio(self.captured_audio)
-        #         self.captured_audio = []
-        #         self.silence_start_time = None
-        #         self.recording_start_time = None
-        #         return
-        #
-        #     frame_amplitude = np.mean(np.abs(audio_data))
-        #     self.rolling_silence_buffer.append(frame_amplitude)
-        #
-        #     # Update rolling silence buffer
-        #     # self.rolling_silence_buffer.append(np.mean(audio_data))  # Use rolling mean to avoid spikes
-        #
-        #     # Check if audio returns to silence
-        #     if np.mean(self.rolling_silence_buffer) < self.calibrated_silence_threshold:
-        #         if self.silence_start_time is None:
-        #             self.silence_start_time = time.time()
-        #             logger.info(f"Silence start detected at {self.silence_start_time:.3f}")
-        #         elif time.time() - self.silence_start_time >= self.SILENCE_DURATION:
-        #             logger.info("Silence detected, stopping capture...")
-        #             self.recording = False
-        #             self.process_audio(self.captured_audio)
-        #             self.captured_audio = []
-        #             self.silence_start_time = None
-        #     else:
-        #         # **Only reset if consistently above threshold for multiple frames**
-        #         if len(self.rolling_silence_buffer) == self.ROLLING_WINDOW and np.mean(
-        #                 self.rolling_silence_buffer) > self.calibrated_silence_threshold:
-        #             logger.debug("Resetting silence start time due to sustained noise")
-        #             self.silence_start_time = None  # Reset silence timer
+                channel.capture_buffer.write(audio_data[offsets[slot]:at, slot])
+                if detail == detector.MAX_DURATION:
+                    logger.info(f"Max recording time reached on channel {channel.index}, stopping capture...")
+                else:
+                    logger.info(f"Silence detected on channel {channel.index}, stopping capture...")
+                self.stop_recording(channel.index)
+            offsets[slot] = at
+
+        # Continue recording if active, each capture buffer takes one contiguous copy of its column
+        for slot in np.flatnonzero(flags["recording"]):
+            group.channels[slot].capture_buffer.write(audio_data[offsets[slot]:, slot])
+
+    def update_background_calibration(self, group, audio_data, mask):
+        """Feed the decaying calibrator and periodically move the thresholds to its estimate"""
+        group.background_calibrator.update(audio_data, mask)
+        group.samples_since_recalibration += len(audio_data)
+        if group.samples_since_recalibration < self.SAMPLE_RATE * self.RECALIBRATION_INTERVAL:
+            return
+        group.samples_since_recalibration = 0
+        # Wait until the window holds at least as much audio as an initial calibration
+        ready = group.background_calibrator.count >= self.SAMPLE_RATE * self.CALIBRATION_TIME / 1000
+        noise, silence = group.background_calibrator.noise_threshold(), group.background_calibrator.silence_threshold()
+        for slot in np.flatnonzero(ready & group.flags["calibrated"]):
+            channel = group.channels[slot]
+            self.set_thresholds(float(noise[slot]), float(silence[slot]), channel.index)
+            logger.debug(
+                f"Background calibration of channel {channel.index}: noise_threshold: "
+                f"{channel.noise_threshold}, silence_threshold: {channel.silence_threshold}"
+            )
+
+    def set_thresholds(self, noise_threshold, silence_threshold, channel=None):
+        """Trigger and silence levels of one channel, or of all of them"""
+        for target in self.channels if channel is None else [self.channels[channel]]:
+            target.noise_threshold = noise_threshold
+            target.silence_threshold = silence_threshold
+            target.group.detector.noise_threshold[target.slot] = noise_threshold
+            target.group.detector.silence_threshold[target.slot] = silence_threshold
+
+    def recalibrate(self, channel=None):
+        """Drop any capture in progress and calibrate again from the next block, on one channel or all"""
+        for target in self.channels if channel is None else [self.channels[channel]]:
+            target.group.detector.reset(target.slot)
+            target.capture_buffer.start()
+            target.recording = False
+            target.calibrated = False
+            target.calibrating = False
+            target.group.calibrator.reset(target.slot)
+
+    def set_continuous_calibration(self, active):
+        """Turn background re-calibration on or off, starting from an empty window"""
+        for group in self.groups:
+            group.background_calibrator.reset()
+            group.samples_since_recalibration = 0
+        self.CONTINUOUS_CALIBRATION = active
+
+    def set_sampling(self, active, channel=None):
+        """Start or stop capturing on one channel, or on all of them"""
+        for target in self.channels if channel is None else [self.channels[channel]]:
+            target.sampling_active = active
+
+    @property
+    def sampling_active(self):
+        """True while any channel is capturing"""
+        return any(channel.sampling_active for channel in self.channels)
+
+    @sampling_active.setter
+    def sampling_active(self, active):
+        self.set_sampling(active)
+
+    @property
+    def channel_count(self):
+        return len(self.channels)
+
+    @property
+    def storage_backend(self):
+        """How captures are stored, fixed at construction and always the registry's when there is one"""
+        return self.registry.storage_backend if self.registry is not None else self._storage_backend
+
+    def config(self):
+        """The configuration attributes with plain values, numbers and strings, as sent between processes"""
+        return {name: value for name, value in vars(self).items()
+                if name.isupper() and isinstance(value, (bool, int, float, str))}
+
+    def status(self):
+        return {
+            "sampling_active": self.sampling_active,
+            "channels": [channel.status() for channel in self.channels],
+        }
+
+    def calibration(self):
+        return {
+            "noise_threshold": self.calibrated_noise_threshold,
+            "silence_threshold": self.calibrated_silence_threshold,
+            "continuous": self.CONTINUOUS_CALIBRATION,
+            "channels": [
+                {
+                    "channel": channel.index,
+                    "calibrated": channel.calibrated,
+                    "noise_threshold": channel.noise_threshold,
+                    "silence_threshold": channel.silence_threshold,
+                }
+                for channel in self.channels
+            ],
+        }
+
+    @property
+    def calibrated_noise_threshold(self):
+        return self.channels[0].noise_threshold
+
+    @property
+    def calibrated_silence_threshold(self):
+        return self.channels[0].silence_threshold
 
     def run(self):
-        """Start the audio stream and continuously listen"""
-        logger.info("Listening for noise peaks...")
-        with sd.InputStream(samplerate=self.SAMPLE_RATE, channels=self.CHANNELS, callback=self.audio_callback):
+        """Start one audio stream per input device and continuously listen"""
+        logger.info(f"Listening for noise peaks on {len(self.channels)} channel(s)...")
+        # Build the mel filterbank now rather than in the first capture's latency
+        features.extractor(self.SAMPLE_RATE)
+        for channel in self.channels:
+            channel.writer.start()
+        input_stream = self.INPUT_STREAM or sounddevice().InputStream
+        with contextlib.ExitStack() as streams:
+            for group in self.groups:
+                streams.enter_context(input_stream(
+                    samplerate=self.SAMPLE_RATE,
+                    device=group.device,
+                    channels=len(group.channels),
+                    callback=functools.partial(self.audio_callback, group=group),
+                ))
             while True:
                 time.sleep(0.1)
 
@@ -249,18 +611,54 @@ class AudioClassifierApp:
         logger.info("Exiting application...")
         sys.exit(0)
 
-    def stop_recording(self):
-        """Stops the recording and processes the captured audio"""
-        self.recording = False
-        if len(self.captured_audio) >= self.SAMPLE_RATE:  # Ensure at least 1 sec of audio
-            self.process_audio(self.captured_audio)
+    def stop_recording(self, channel=0):
+        """Stops the recording and processes the captured audio of a channel"""
+        source = self.channels[channel]
+        source.recording = False
+        CAPTURE_LENGTH.observe(len(source.capture_buffer) / self.SAMPLE_RATE)
+        if len(source.capture_buffer) >= self.SAMPLE_RATE:  # Ensure at least 1 sec of audio
+            # Copied into the writer queue, saving happens on the writer threads
+            source.writer.submit(source.capture_buffer.view(), source.triggered_at, time.monotonic(), channel)
         else:
             logger.warning("Discarding short sample (less than 1 second)")
-        self.captured_audio = []
-        self.silence_start_time = None
-        self.recording_start_time = None
+            CAPTURES.labels(channel=channel, outcome="too_short").inc()
+        source.capture_buffer.start()
+
+def device_arg(value):
+    """An input device given on the command line: an index, a name, or "default" for the sounddevice default"""
+    if value == "default":
+        return None
+    return int(value) if value.isdigit() else value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture detector audio into data/input")
+    parser.add_argument("--device", dest="devices", action="append", type=device_arg,
+                        help="input device to capture, repeat for several devices at once")
+    parser.add_argument("--channels", type=int, default=1, help="channels captured per device")
+    parser.add_argument("--synthetic", action="store_true", help="generated detector audio instead of the sound card")
+    parser.add_argument("--target-rate", type=float, default=0.3, help="synthetic targets per second and channel")
+    parser.add_argument("--burst-rate", type=float, default=0.0, help="synthetic interference bursts per second")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--storage-backend", choices=STORAGE_BACKENDS, default="files",
+                        help="png/wav/npy files per capture or packed archive records")
+    args = parser.parse_args()
+
+    devices = args.devices or [None]
+    app = AudioClassifierApp(storage_backend=args.storage_backend, devices=devices, channels=args.channels)
+    if args.synthetic:
+        import synthetic
+
+        def synthetic_stream(device=None, channels=1, **kwargs):
+            # A signal of its own for every device, seeded by its position in --device
+            source = synthetic.SyntheticSignal(app.SAMPLE_RATE, channels, seed=args.seed + devices.index(device),
+                                               target_rate=args.target_rate, burst_rate=args.burst_rate)
+            return synthetic.InputStream(device=device, channels=channels, signal=source, **kwargs)
+
+        app.INPUT_STREAM = synthetic_stream
+        app.set_sampling(True)
+    app.run()
 
 
 if __name__ == "__main__":
-    app = AudioClassifierApp()
-    app.run()
+    main()
@@ -0,0 +1,311 @@
+"""
+The sampler in a process of its own, so the audio callbacks, detection and rendering
+do not share a GIL with the labeler's request handling.
+
+SamplerProcess starts ``python sampler_process.py <address>`` and stands in for the
+AudioClassifierApp in the labeler. Two connections on a local socket link them:
+
+- control: request/response calls for toggling, calibration, status and metrics
+- messages: UI events and finished captures, from the sampler to the labeler
+
+Captures are not re-read from disk: the sampler writes the audio and mel matrix of each
+one into a slot of a SharedCaptureRing and only the slot number and shapes cross the
+socket. The labeler registers the capture (labels, similarity, inference, the archive
+record) straight from shared memory and hands the slot back.
+"""
+import argparse
+import atexit
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import connection, resource_tracker, shared_memory
+
+import numpy as np
+from loguru import logger
+
+import events
+import features
+import metrics
+from sampler import STORAGE_BACKENDS, AudioClassifierApp, CaptureRegistry, device_arg
+
+AUTHKEY_ENV = "DETECTONIST_SAMPLER_KEY"
+SLOTS = 8  # Captures in flight between the processes
+SLOT_TIMEOUT = 5  # Seconds a writer thread waits for a free slot before the capture fails
+STARTUP_TIMEOUT = 60  # Seconds for the sampler process to start and connect
+
+
+class SharedCaptureRing:
+    """
+    Fixed slots holding the float32 audio and mel matrix of one capture each, in one
+    shared memory block. The creating process owns the block and unlinks it on close,
+    the other one attaches with the ``spec()`` of the owner.
+    """
+
+    def __init__(self, slots, audio_size, mel_size, name=None):
+        self.slots = slots
+        self.audio_size = audio_size
+        self.mel_size = mel_size
+        self.owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self.owner, size=slots * (audio_size + mel_size) * 4)
+        if not self.owner:
+            # Attaching registers the block too, only the owner's tracker may unlink it
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        self._array = np.ndarray((slots, audio_size + mel_size), dtype=np.float32, buffer=self._shm.buf)
+
+    def spec(self):
+        return {"slots": self.slots, "audio_size": self.audio_size, "mel_size": self.mel_size, "name": self._shm.name}
+
+    def write(self, slot, audio, S_db):
+        """Copy a capture into a slot, returns (samples, mel shape) to read it back"""
+        if len(audio) > self.audio_size or S_db.size > self.mel_size:
+            raise ValueError(f"Capture of {len(audio)} samples does not fit a slot")
+        self._array[slot, :len(audio)] = audio
+        self._array[slot, self.audio_size:self.audio_size + S_db.size] = S_db.ravel()
+        return len(audio), S_db.shape
+
+    def read(self, slot, samples, mel_shape):
+        """Zero-copy (audio, mel) views of a slot, valid until the slot is written again"""
+        mel = self._array[slot, self.audio_size:self.audio_size + int(np.prod(mel_shape))].reshape(mel_shape)
+        return self._array[slot, :samples], mel
+
+    def close(self):
+        self._array = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+
+class Handoff:
+    """The sampler's ``handoff``: passes rendered captures to the labeler through the ring"""
+
+    def __init__(self, ring, send):
+        self.ring = ring
+        self.send = send
+        self._free = list(range(ring.slots))
+        self._available = threading.Condition()
+
+    def __call__(self, sample_id, audio_sample, S_db, **meta):
+        # Runs on the writer threads, waiting here backs up the writer queue and its drop policy
+        with self._available:
+            if not self._available.wait_for(lambda: self._free, timeout=SLOT_TIMEOUT):
+                raise RuntimeError("no free shared memory slot, the labeler is not keeping up")
+            slot = self._free.pop()
+        try:
+            samples, mel_shape = self.ring.write(slot, audio_sample, S_db)
+            self.send(("capture", slot, sample_id, samples, mel_shape, meta))
+        except Exception:
+            self.release(slot)
+            raise
+
+    def release(self, slot):
+        with self._available:
+            self._free.append(slot)
+            self._available.notify()
+
+
+def serve(address, storage_backend="files", devices=(None,), channels=1):
+    """Sampler process: run the AudioClassifierApp, answering the labeler's calls"""
+    authkey = bytes.fromhex(os.environ[AUTHKEY_ENV])
+    control = connection.Client(address, authkey=authkey)
+    messages = connection.Client(address, authkey=authkey)
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            messages.send(message)
+
+    events.forward(lambda event, payload: send(("event", event, payload)))
+
+    app = AudioClassifierApp(register=False, storage_backend=storage_backend, devices=devices, channels=channels)
+    control.send(("hello", app.config()))
+    ring = SharedCaptureRing(**control.recv())
+    app.handoff = Handoff(ring, send)
+
+    calls = {
+        "set_sampling": app.set_sampling,
+        "recalibrate": app.recalibrate,
+        "set_continuous_calibration": app.set_continuous_calibration,
+        "status": app.status,
+        "calibration": app.calibration,
+        "metrics": metrics.render,
+        "forget_capture": app.forget_capture,
+        "release": app.handoff.release,
+    }
+
+    def answer():
+        while True:
+            try:
+                method, args, kwargs = control.recv()
+            except (EOFError, OSError):
+                logger.info("Labeler disconnected, stopping sampler process")
+                os._exit(0)
+            try:
+                control.send(("ok", calls[method](*args, **kwargs)))
+            except Exception as e:
+                control.send(("error", f"{type(e).__name__}: {e}"))
+
+    threading.Thread(target=answer, name="sampler-control", daemon=True).start()
+    app.run()
+
+
+def _accept(listener, process):
+    """Accept a connection from the sampler process, failing if it exits or times out first"""
+    accepted = []
+    thread = threading.Thread(target=lambda: accepted.append(listener.accept()), daemon=True)
+    thread.start()
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while thread.is_alive() and process.poll() is None and time.monotonic() < deadline:
+        thread.join(0.1)
+    if not accepted:
+        process.kill()
+        raise RuntimeError(f"Sampler process did not connect (exit code {process.poll()})")
+    return accepted[0]
+
+
+def _receive(control, process):
+    """The next message of the sampler process while it starts, failing if it exits or times out first"""
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while process.poll() is None and time.monotonic() < deadline:
+        if control.poll(0.1):
+            try:
+                return control.recv()
+            except EOFError:
+                break
+    process.kill()
+    raise RuntimeError(f"Sampler process did not start (exit code {process.wait()})")
+
+
+class SamplerProcess:
+    """
+    Labeler-side stand-in for an AudioClassifierApp running in a child process.
+
+    Calls are forwarded over the control connection. The CaptureRegistry lives here,
+    so the label store, similarity index and inference keep a single owner and the
+    labeler reads them without crossing processes.
+    """
+
+    def __init__(self, storage_backend="files", devices=(None,), channels=1):
+        authkey = secrets.token_bytes(32)
+        listener = connection.Listener(family="AF_UNIX", authkey=authkey)
+        self.channel_count = len(devices) * channels
+        # The settings are passed down, so the capture files and the registry here always agree
+        arguments = ["--storage-backend", storage_backend, "--channels", str(channels)]
+        for device in devices:
+            arguments += ["--device", "default" if device is None else str(device)]
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), listener.address, *arguments],
+            env={**os.environ, AUTHKEY_ENV: authkey.hex()},
+        )
+        self.ring = None
+        atexit.register(self.close)
+        try:
+            self._control = _accept(listener, self.process)
+            self._messages = _accept(listener, self.process)
+        finally:
+            listener.close()
+        self._lock = threading.Lock()
+
+        _, self.config = _receive(self._control, self.process)
+        self.SAMPLE_RATE = self.config["SAMPLE_RATE"]
+        mel_frames = 1 + self.config["CAPTURE_SIZE"] // features.MEL_PARAMS["hop_length"]
+        self.ring = SharedCaptureRing(SLOTS, self.config["CAPTURE_SIZE"], features.MEL_PARAMS["n_mels"] * mel_frames)
+        self._control.send(self.ring.spec())
+
+        self.registry = CaptureRegistry(
+            self.SAMPLE_RATE,
+            storage_backend=storage_backend,
+            model_path=self.config["MODEL_PATH"],
+            inference_batch=self.config["INFERENCE_BATCH"],
+        )
+        self.archive = self.registry.archive
+        self.labels = self.registry.labels
+        self.similarity = self.registry.similarity
+        self.inference = self.registry.inference
+        logger.info(f"Sampler running in process {self.process.pid}")
+
+    def _call(self, method, *args, **kwargs):
+        with self._lock:
+            self._control.send((method, args, kwargs))
+            outcome, result = self._control.recv()
+        if outcome == "error":
+            raise RuntimeError(f"Sampler process: {result}")
+        return result
+
+    def set_sampling(self, active, channel=None):
+        self._call("set_sampling", active, channel)
+
+    def recalibrate(self, channel=None):
+        self._call("recalibrate", channel)
+
+    def set_continuous_calibration(self, active):
+        self._call("set_continuous_calibration", active)
+
+    def forget_capture(self, sample_id):
+        self._call("forget_capture", sample_id)
+
+    def status(self):
+        return self._call("status")
+
+    def calibration(self):
+        return self._call("calibration")
+
+    def metrics(self):
+        """The sampler process's metrics in the Prometheus text format"""
+        return self._call("metrics")
+
+    @property
+    def sampling_active(self):
+        return self.status()["sampling_active"]
+
+    @sampling_active.setter
+    def sampling_active(self, active):
+        self.set_sampling(active)
+
+    def run(self):
+        """Register captures and republish events from the sampler process until it exits"""
+        while True:
+            try:
+                message = self._messages.recv()
+            except (EOFError, OSError):
+                logger.error(f"Sampler process exited with code {self.process.wait()}")
+                return
+            if message[0] == "event":
+                events.publish(message[1], message[2])
+                continue
+            _, slot, sample_id, samples, mel_shape, meta = message
+            try:
+                audio, S_db = self.ring.read(slot, samples, mel_shape)
+                # The inference queue keeps the mel matrix beyond the life of the slot
+                self.registry.register(sample_id, audio, np.array(S_db), **meta)
+            except Exception as e:
+                logger.warning(f"Could not register capture {sample_id}: {e}")
+            finally:
+                self._call("release", slot)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sampler process, started by the labeler")
+    parser.add_argument("address", help="socket the labeler listens on")
+    parser.add_argument("--storage-backend", choices=STORAGE_BACKENDS, default="files")
+    parser.add_argument("--device", dest="devices", action="append", type=device_arg)
+    parser.add_argument("--channels", type=int, default=1)
+    args = parser.parse_args()
+    serve(args.address, args.storage_backend, args.devices or [None], args.channels)
+
+
+if __name__ == "__main__":
+    main()
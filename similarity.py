@@ -0,0 +1,233 @@
+"""
+Nearest-neighbour search over captured samples, used to show already-labelled samples
+that sound like the current capture and to suggest their tags.
+
+Each sample is reduced to a fixed-length embedding of its mel spectrogram: the mean and
+spread of every mel band over time, centred and L2-normalized so a dot product is the
+cosine similarity. Embeddings are kept in one contiguous float32 matrix and searched
+exhaustively, at 100k samples that is a single 100k x 128 matrix-vector product.
+
+The index is persisted as an append-only vector file and an ID log. Embed samples
+captured before the index existed with:
+
+    python similarity.py build
+"""
+import argparse
+import glob
+import os
+import threading
+
+import numpy as np
+from loguru import logger
+
+import features
+from archive import SAMPLES, STAGES
+
+INDEX_DIR = os.path.join("data", "cache", "similarity")
+DIMENSIONS = 2 * features.MEL_PARAMS["n_mels"]
+
+
+def embed(S_db):
+    """Fixed-length unit vector of a (n_mels, frames) dB mel matrix, independent of the capture length"""
+    S_db = np.asarray(S_db, dtype=np.float32)
+    vector = np.concatenate([S_db.mean(axis=1), S_db.std(axis=1)])
+    half = len(vector) // 2
+    vector[:half] -= vector[:half].mean()  # Loudness offset
+    vector[half:] -= vector[half:].mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def suggest_tags(neighbours, min_share=0.5):
+    """
+    Tags carried by most of the neighbours, weighted by similarity.
+
+    ``neighbours`` is a list of (tags, score), returns [(tag, share)] with the share of
+    the total weight that carries the tag, highest first.
+    """
+    weights = {}
+    total = 0.0
+    for tags, score in neighbours:
+        weight = max(float(score), 0.0)
+        total += weight
+        for tag in tags:
+            weights[tag] = weights.get(tag, 0.0) + weight
+    if total == 0:
+        return []
+    shares = sorted(((tag, weight / total) for tag, weight in weights.items()), key=lambda item: -item[1])
+    return [(tag, round(share, 3)) for tag, share in shares if share >= min_share]
+
+
+class SimilarityIndex:
+    """
+    Incrementally updated embedding matrix with exhaustive cosine search.
+
+    Rows are kept packed: adds go to the end of a preallocated matrix that doubles when
+    full, a removal moves the last row into the hole. Each row also carries a labelled
+    flag so searches can be restricted to classified samples.
+    """
+
+    def __init__(self, root=INDEX_DIR, dims=DIMENSIONS, capacity=1024):
+        self.root = root
+        self.dims = dims
+        self.vectors_path = os.path.join(root, "vectors.f32")
+        self.ids_path = os.path.join(root, "ids.log")
+        self._lock = threading.Lock()
+
+        self._vectors = np.zeros((capacity, dims), dtype=np.float32)
+        self._labelled = np.zeros(capacity, dtype=bool)
+        self._ids = []
+        self._rows = {}  # sample ID -> row
+        self._file_rows = 0  # Vectors in the file, the ID log refers to them in order
+
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, sample_id):
+        return sample_id in self._rows
+
+    def _load(self):
+        if not os.path.exists(self.ids_path):
+            return
+        stored = np.fromfile(self.vectors_path, dtype=np.float32) if os.path.exists(self.vectors_path) else np.empty(0)
+        if len(stored) % self.dims:
+            logger.warning(f"Similarity index {self.root} has a different dimension, starting empty")
+            os.remove(self.vectors_path)
+            os.remove(self.ids_path)
+            return
+        stored = stored.reshape(-1, self.dims)
+
+        live = {}
+        with open(self.ids_path) as f:
+            for line in f:
+                op, sample_id = line[:1], line[1:].strip()
+                if op == "+" and self._file_rows < len(stored):
+                    live[sample_id] = self._file_rows
+                    self._file_rows += 1
+                elif op == "-":
+                    live.pop(sample_id, None)
+        for sample_id, file_row in live.items():
+            self._append(sample_id, stored[file_row])
+        logger.info(f"Similarity index {self.root}: {len(self)} samples")
+
+    def _append(self, sample_id, vector):
+        row = len(self._ids)
+        if row == len(self._vectors):
+            self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+            self._labelled = np.concatenate([self._labelled, np.zeros_like(self._labelled)])
+        self._vectors[row] = vector
+        self._labelled[row] = False
+        self._ids.append(sample_id)
+        self._rows[sample_id] = row
+
+    def add(self, sample_id, vector, labelled=False):
+        """Add or replace the embedding of a sample"""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if sample_id in self._rows:
+                self._vectors[self._rows[sample_id]] = vector
+            else:
+                self._append(sample_id, vector)
+            self._labelled[self._rows[sample_id]] = labelled
+            with open(self.vectors_path, "ab") as f:
+                f.write(vector.tobytes())
+            with open(self.ids_path, "a") as f:
+                f.write(f"+{sample_id}\n")
+            self._file_rows += 1
+
+    def remove(self, sample_id):
+        with self._lock:
+            row = self._rows.pop(sample_id, None)
+            if row is None:
+                return
+            last = len(self._ids) - 1
+            if row != last:
+                self._vectors[row] = self._vectors[last]
+                self._labelled[row] = self._labelled[last]
+                self._ids[row] = self._ids[last]
+                self._rows[self._ids[row]] = row
+            self._ids.pop()
+            with open(self.ids_path, "a") as f:
+                f.write(f"-{sample_id}\n")
+
+    def set_labelled(self, sample_id, labelled=True):
+        """Mark a sample as classified, only labelled samples are returned by default"""
+        with self._lock:
+            row = self._rows.get(sample_id)
+            if row is not None:
+                self._labelled[row] = labelled
+
+    def vector(self, sample_id):
+        with self._lock:
+            row = self._rows.get(sample_id)
+            return None if row is None else self._vectors[row].copy()
+
+    def search(self, vector, k=8, labelled_only=True, exclude=()):
+        """The k most similar samples as [(sample ID, cosine similarity)], most similar first"""
+        with self._lock:
+            n = len(self._ids)
+            if n == 0:
+                return []
+            scores = self._vectors[:n] @ np.asarray(vector, dtype=np.float32)
+            if labelled_only:
+                scores[~self._labelled[:n]] = -np.inf
+            for sample_id in exclude:
+                row = self._rows.get(sample_id)
+                if row is not None:
+                    scores[row] = -np.inf
+            k = min(k, n)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[row], float(scores[row])) for row in top if np.isfinite(scores[row])]
+
+
+def sync_labels(index, label_store):
+    """Flag the classified samples of the label store as labelled"""
+    for sample in label_store.query(stage=SAMPLES):
+        index.set_labelled(sample["id"])
+
+
+def build(index, label_store, data_dirs=(), archive=None, workers=None):
+    """Embed the samples of the label store that are not indexed yet"""
+    missing = {sample["id"] for sample in label_store.query() if sample["id"] not in index}
+    if archive is not None:
+        for sample_id in missing & set(archive.meta):
+            index.add(sample_id, embed(archive.read_mel(sample_id)))
+    elif missing:
+        import feature_cache
+
+        paths = [path for directory in data_dirs for path in glob.glob(os.path.join(directory, "*.npy"))
+                 if feature_cache.sample_id_from_filename(path) in missing]
+        cache = feature_cache.FeatureCache()
+        cache.build(paths, workers=workers)
+        for path in paths:
+            sample_id = feature_cache.sample_id_from_filename(path)
+            index.add(sample_id, embed(cache.get(sample_id)))
+    sync_labels(index, label_store)
+    logger.info(f"Similarity index ready: {len(index)} samples, {len(missing)} embedded")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="embed samples that are not indexed yet")
+    build_parser.add_argument("data_dirs", nargs="*", default=[os.path.join("data", stage) for stage in STAGES])
+    build_parser.add_argument("--archive", help="archive directory, when the sampler writes packed records")
+    build_parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    import labels
+
+    sample_archive = None
+    if args.archive:
+        import archive
+
+        sample_archive = archive.SampleArchive(args.archive)
+    build(SimilarityIndex(), labels.LabelStore(), args.data_dirs, sample_archive, args.workers)
+
+
+if __name__ == "__main__":
+    main()
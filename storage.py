@@ -0,0 +1,236 @@
+import contextlib
+import functools
+import io
+import os
+import shutil
+
+import numpy as np
+import soundfile as sf
+from flask import send_file
+from loguru import logger
+
+import features
+import render
+import sample_index
+from archive import INPUT, SAMPLES, UNCLASSIFIED, parse_name
+
+RENDER_CACHE = 16  # Archive files kept encoded, so range requests while scrubbing do not re-encode the WAV
+TRASH_DIR = ".trash"  # Per stage directory deleted files wait in until their batch commits
+
+
+class Batch:
+    """
+    Storage changes that are undone together if any of them fails.
+
+    Moves happen right away and are reversed on rollback. Deletions are staged so
+    they can be restored too, and only become final once the batch commits.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._undo = []
+        self._purge = []
+
+    def move(self, stage, base, to_stage, new_base, status=None, tags=None):
+        self._undo.append(self.storage.move(stage, base, to_stage, new_base, status=status, tags=tags))
+
+    def delete(self, stage, base):
+        restore, purge = self.storage.stash(stage, base)
+        self._undo.append(restore)
+        self._purge.append(purge)
+
+    def rollback(self):
+        for undo in reversed(self._undo):
+            try:
+                undo()
+            except Exception as e:
+                logger.error(f"Could not undo a storage change: {e}")
+        self._undo, self._purge = [], []
+
+    def commit(self):
+        for purge in self._purge:
+            try:
+                purge()
+            except Exception as e:
+                logger.warning(f"Could not remove a deleted sample: {e}")
+        self._undo, self._purge = [], []
+
+
+@contextlib.contextmanager
+def transaction(storage):
+    """
+    Group storage changes, everything done through the yielded Batch is rolled back
+    if the block raises:
+
+        with transaction(files) as batch:
+            batch.move(INPUT, base, UNCLASSIFIED, base)
+            label_store.apply(...)
+    """
+    batch = Batch(storage)
+    try:
+        yield batch
+    except BaseException:
+        batch.rollback()
+        raise
+    batch.commit()
+
+
+class FileStorage:
+    """Captures as png/wav/npy triplets, one directory per stage, moved between directories by the labeler"""
+
+    EXTENSIONS = ["png", "npy", "wav"]
+
+    def __init__(self, dirs, sample_rate=48000):
+        self.dirs = dirs
+        self.sample_rate = sample_rate
+        # In-memory views of the queues, so the polling endpoints never list directories
+        self.indexes = {stage: sample_index.DirectoryIndex(directory) for stage, directory in dirs.items()}
+        self.observer = sample_index.watch(list(self.indexes.values()))
+
+    def first(self, stage):
+        return self.indexes[stage].first()
+
+    def pending(self, stage, k):
+        """The first k captures of a stage, in the order first() hands them out"""
+        return self.indexes[stage].head(k)
+
+    def latest(self, stage, k):
+        return self.indexes[stage].latest(k)
+
+    def exists(self, stage, base):
+        return f"{base}.png" in self.indexes[stage]
+
+    def sample_id(self, stage, base):
+        """Sample ID of a capture, classified names end in the ID"""
+        if not self.exists(stage, base):
+            return None
+        return parse_name(base)[2] if stage == SAMPLES else base
+
+    def move(self, stage, base, to_stage, new_base, status=None, tags=None):
+        """Move a capture to another stage, returns a function that moves it back"""
+        for ext in self.EXTENSIONS:
+            old_path = os.path.join(self.dirs[stage], f"{base}.{ext}")
+            if os.path.exists(old_path):
+                shutil.move(old_path, os.path.join(self.dirs[to_stage], f"{new_base}.{ext}"))
+        self.indexes[stage].remove(f"{base}.png")
+        self.indexes[to_stage].add(f"{new_base}.png")
+        return lambda: self.move(to_stage, new_base, stage, base)
+
+    def stash(self, stage, base):
+        """Delete reversibly, returns (restore, purge) functions"""
+        trash = os.path.join(self.dirs[stage], TRASH_DIR)
+        os.makedirs(trash, exist_ok=True)
+        moved = []
+        for ext in self.EXTENSIONS:
+            path = os.path.join(self.dirs[stage], f"{base}.{ext}")
+            if os.path.exists(path):
+                os.replace(path, os.path.join(trash, f"{base}.{ext}"))
+                moved.append(ext)
+        self.indexes[stage].remove(f"{base}.png")
+
+        def restore():
+            for ext in moved:
+                os.replace(os.path.join(trash, f"{base}.{ext}"), os.path.join(self.dirs[stage], f"{base}.{ext}"))
+            self.indexes[stage].add(f"{base}.png")
+
+        def purge():
+            for ext in moved:
+                os.remove(os.path.join(trash, f"{base}.{ext}"))
+
+        return restore, purge
+
+    def delete(self, stage, base):
+        for ext in self.EXTENSIONS:
+            file_path = os.path.join(self.dirs[stage], f"{base}.{ext}")
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        self.indexes[stage].remove(f"{base}.png")
+
+    def mel(self, stage, base):
+        """Mel dB matrix of a capture, computed from its audio"""
+        audio = np.load(os.path.join(self.dirs[stage], f"{base}.npy"))
+        return features.mel_db(audio, sr=self.sample_rate)
+
+    def send(self, stage, filename, etag=None, max_age=None):
+        """The file as a response, ranges and If-None-Match are answered by send_file"""
+        path = os.path.abspath(os.path.join(self.dirs[stage], filename))
+        if not os.path.exists(path):
+            return "Not found", 404
+        return send_file(path, etag=etag or True, max_age=max_age)
+
+
+class ArchiveStorage:
+    """
+    Captures as single records in a SampleArchive.
+
+    Stage transitions are metadata updates; PNG and WAV are produced on request from
+    the stored mel matrix and audio.
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        # Sample IDs are content hashes, so an encoded file never goes stale
+        self._encoded = functools.lru_cache(maxsize=RENDER_CACHE)(self._encode)
+
+    def first(self, stage):
+        name = self.archive.stages[stage].first()
+        return f"{name}.png" if name else None
+
+    def pending(self, stage, k):
+        return [f"{name}.png" for name in self.archive.stages[stage].head(k)]
+
+    def latest(self, stage, k):
+        return [f"{name}.png" for name in self.archive.stages[stage].latest(k)]
+
+    def exists(self, stage, base):
+        return self.archive.find(stage, base) is not None
+
+    def sample_id(self, stage, base):
+        return self.archive.find(stage, base)
+
+    def move(self, stage, base, to_stage, new_base, status=None, tags=None):
+        sample_id = self.archive.find(stage, base)
+        if sample_id is None:
+            return lambda: None
+        previous = dict(self.archive.meta[sample_id])
+        changes = {"stage": to_stage}
+        if to_stage == SAMPLES:
+            changes.update(status=status, tags=tags or [])
+        self.archive.update(sample_id, **changes)
+        return lambda: self.archive.update(sample_id, **previous)
+
+    def delete(self, stage, base):
+        sample_id = self.archive.find(stage, base)
+        if sample_id is not None:
+            self.archive.delete(sample_id)
+
+    def stash(self, stage, base):
+        """Records stay in their segment until compaction, so a deletion is undone by restoring the metadata"""
+        sample_id = self.archive.find(stage, base)
+        if sample_id is None:
+            return (lambda: None), (lambda: None)
+        meta = dict(self.archive.meta[sample_id])
+        self.archive.delete(sample_id)
+        return (lambda: self.archive.restore(sample_id, meta)), (lambda: None)
+
+    def mel(self, stage, base):
+        return self.archive.read_mel(self.archive.find(stage, base))
+
+    def _encode(self, sample_id, ext):
+        if ext == ".png":
+            return render.encode_png(render.spectrogram_to_rgb(self.archive.read_mel(sample_id)))
+        audio, sr = self.archive.read_audio(sample_id)
+        buffer = io.BytesIO()
+        sf.write(buffer, audio, sr, format="WAV", subtype="FLOAT")
+        return buffer.getvalue()
+
+    def send(self, stage, filename, etag=None, max_age=None):
+        base, ext = os.path.splitext(filename)
+        sample_id = self.archive.find(stage, base)
+        if sample_id is None or ext not in (".png", ".wav"):
+            return "Not found", 404
+        mimetype = "image/png" if ext == ".png" else "audio/wav"
+        # BytesIO has a known length, so send_file answers range requests from it
+        return send_file(io.BytesIO(self._encoded(sample_id, ext)), mimetype=mimetype, download_name=filename,
+                         etag=etag or False, max_age=max_age)
+
@@ -0,0 +1,263 @@
+"""
+Deterministic synthetic detector audio, a stand-in for the detector and sound card.
+
+SyntheticSignal generates ground noise with a slow drift, multi-tone target responses
+and short interference bursts at chosen rates. A seed gives the same samples whatever
+the block size, and every target and burst is kept in ``events`` as ground truth.
+
+InputStream plays a signal to a callback with the signature and pacing of
+``sd.InputStream``, so the sampler consumes it unchanged:
+
+    app = AudioClassifierApp()
+    app.INPUT_STREAM = functools.partial(synthetic.InputStream, signal=SyntheticSignal(target_rate=0.5))
+    app.run()
+
+or ``python sampler.py --synthetic``.
+"""
+import collections
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+
+SAMPLE_RATE = 48000
+
+# Tones of the detector's target ID, lowest (ferrous) to highest (conductive), in Hz
+TARGETS = {
+    "iron": (120, 240),
+    "foil": (420,),
+    "ringpull": (520, 1040),
+    "gold": (330, 660, 990),
+    "coin": (640, 1280, 1920),
+    "silver": (820, 1640, 2460),
+}
+
+TARGET = "target"
+BURST = "burst"
+
+
+class SyntheticSignal:
+    """
+    (frames, channels) float32 blocks of detector audio.
+
+    Targets arrive at ``target_rate`` per second and channel (Poisson, no overlap, at
+    least ``min_gap`` seconds apart so the sampler can tell them apart) and swell and
+    fade like a coil sweep. Bursts are broadband clicks at ``burst_rate`` per second,
+    interference that trips the trigger without a target. Nothing happens in the first
+    ``quiet`` seconds, which leaves the sampler's calibration to the ground noise.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, channels=1, seed=0, duration=None, quiet=4.0,
+                 noise_level=0.01, drift=0.05, drift_period=20.0,
+                 targets=tuple(TARGETS), target_rate=0.3, target_level=(0.2, 0.6), target_duration=(0.25, 0.6),
+                 min_gap=1.5, burst_rate=0.0, burst_level=0.3, burst_duration=(0.003, 0.02)):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.length = int(duration * sample_rate) if duration is not None else None
+        self.noise_level = noise_level
+        self.drift = drift
+        self.drift_period = drift_period
+        self.targets = list(targets)
+        self.target_level = target_level
+        self.target_duration = target_duration
+        self.min_gap = min_gap
+        self.burst_level = burst_level
+        self.burst_duration = burst_duration
+        self.position = 0
+
+        self._noise = np.random.default_rng([seed, 0])
+        # Event timing per channel and kind from streams of their own, independent of the block size
+        self._schedules = [
+            _Schedule(np.random.default_rng([seed, 1, channel, i]), rate, quiet, sample_rate)
+            for channel in range(channels)
+            for i, rate in enumerate((target_rate, burst_rate))
+        ]
+        self._pending = []  # Events overlapping the samples not generated yet
+        self.events = []  # Ground truth, one dict per target or burst
+
+    @property
+    def exhausted(self):
+        return self.length is not None and self.position >= self.length
+
+    def read(self, frames):
+        """The next block, shorter than ``frames`` (or empty) at the end of the signal"""
+        if self.length is not None:
+            frames = max(0, min(frames, self.length - self.position))
+        start, stop = self.position, self.position + frames
+        t = np.arange(start, stop) / self.sample_rate
+        # Ground noise, its level drifting slowly as with changing mineralization. White but
+        # bounded, so as with a clean threshold hiss only targets and bursts cross the
+        # calibrated trigger level; a larger drift needs CONTINUOUS_CALIBRATION to keep up
+        level = self.noise_level * (1.0 + self.drift * np.sin(2 * np.pi * t / self.drift_period))
+        block = self._noise.random((frames, self.channels), dtype=np.float32) * 2 - 1
+        block *= level[:, None].astype(np.float32)
+
+        self._schedule(stop)
+        for event in self._pending:
+            lo, hi = max(start, event["start"]), min(stop, event["stop"])
+            if lo < hi:
+                block[lo - start:hi - start, event["channel"]] += self._render(event, lo, hi)
+        self._pending = [event for event in self._pending if event["stop"] > stop]
+        self.position = stop
+        return block
+
+    def _schedule(self, until):
+        """Create the events starting before sample ``until``"""
+        for i, schedule in enumerate(self._schedules):
+            channel, kind = divmod(i, 2)
+            while schedule.rate and schedule.next_start < until:
+                rng = schedule.rng
+                start = schedule.next_start
+                if kind == 0:
+                    seconds = rng.uniform(*self.target_duration)
+                    event = {"kind": TARGET, "target": self.targets[rng.integers(len(self.targets))],
+                             "level": rng.uniform(*self.target_level), "phase": rng.uniform(0, 2 * np.pi)}
+                    gap = self.min_gap
+                else:
+                    seconds = rng.uniform(*self.burst_duration)
+                    event = {"kind": BURST, "level": self.burst_level, "seed": int(rng.integers(2 ** 32))}
+                    gap = 0.0
+                event.update(channel=channel, start=start, stop=start + max(1, int(seconds * self.sample_rate)))
+                self._pending.append(event)
+                self.events.append(event)
+                wait = gap + rng.exponential(1.0 / schedule.rate)
+                schedule.next_start = event["stop"] + int(wait * self.sample_rate)
+
+    def _render(self, event, lo, hi):
+        """Samples lo:hi of an event, in absolute sample numbers"""
+        n = np.arange(lo - event["start"], hi - event["start"])
+        length = event["stop"] - event["start"]
+        if event["kind"] == TARGET:
+            t = n / self.sample_rate
+            # Rises and falls as the coil passes over the target, overtones weaker
+            envelope = event["level"] * np.sin(np.pi * n / length) ** 2
+            tones = TARGETS[event["target"]]
+            wave = sum(np.sin(2 * np.pi * f * t + event["phase"] * k) / k for k, f in enumerate(tones, 1))
+            return (envelope * wave / sum(1 / k for k in range(1, len(tones) + 1))).astype(np.float32)
+        # Bursts are drawn whole so any part of one is the same whatever block it falls in
+        click = np.random.default_rng(event["seed"]).standard_normal(length).astype(np.float32)
+        return click[n] * (event["level"] * np.exp(-4.0 * n / length)).astype(np.float32)
+
+    def count(self, kind=TARGET, until=None):
+        """Events of a kind that ended by sample ``until``, the current position by default"""
+        until = self.position if until is None else until
+        return sum(1 for event in self.events if event["kind"] == kind and event["stop"] <= until)
+
+
+class _Schedule:
+    __slots__ = ("rng", "rate", "next_start")
+
+    def __init__(self, rng, rate, quiet, sample_rate):
+        self.rng = rng
+        self.rate = rate
+        self.next_start = int((quiet + (rng.exponential(1.0 / rate) if rate else 0.0)) * sample_rate)
+
+
+class CallbackFlags:
+    """The ``status`` argument of the callback, as sounddevice's"""
+
+    def __init__(self, input_overflow=False):
+        self.input_overflow = input_overflow
+        self.input_underflow = False
+
+    def __bool__(self):
+        return self.input_overflow
+
+    def __str__(self):
+        return "input overflow" if self.input_overflow else ""
+
+
+class InputStream:
+    """
+    Plays a SyntheticSignal to ``callback`` in blocks, paced like a sound card.
+
+    Blocks are due every ``blocksize / samplerate / speed`` seconds, ``speed=None``
+    plays as fast as the callback allows. When the callback falls more than
+    ``latency`` blocks behind, the missed blocks are dropped and the next callback
+    is flagged ``input_overflow``, as PortAudio does. The stream ends when the signal
+    does.
+    """
+
+    def __init__(self, samplerate=SAMPLE_RATE, device=None, channels=1, callback=None, blocksize=1024,
+                 signal=None, speed=1.0, latency=4, **kwargs):
+        self.samplerate = samplerate
+        self.device = device
+        self.channels = channels
+        self.callback = callback
+        self.blocksize = blocksize or 1024
+        self.signal = signal if signal is not None else SyntheticSignal(samplerate, channels)
+        if self.signal.channels != channels:
+            raise ValueError(f"Signal has {self.signal.channels} channels, the stream {channels}")
+        self.speed = speed
+        self.latency = latency
+        self.blocks = 0
+        self.overflows = 0
+        self.callback_durations = collections.deque(maxlen=100000)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def active(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="synthetic-input", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    close = stop
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        period = self.blocksize / self.samplerate / self.speed if self.speed else 0.0
+        due = time.perf_counter()
+        overflow = False
+        while not self._stop.is_set() and not self.signal.exhausted:
+            if period:
+                behind = time.perf_counter() - due
+                if behind < 0:
+                    time.sleep(-behind)
+                elif behind > self.latency * period:
+                    # The host buffer would have overrun, the audio in it is lost
+                    missed = int(behind / period)
+                    for _ in range(missed):
+                        self.signal.read(self.blocksize)
+                    due += missed * period
+                    overflow = True
+                    self.overflows += 1
+            block = self.signal.read(self.blocksize)
+            if not len(block):
+                break
+            started = time.perf_counter()
+            try:
+                self.callback(block, len(block), None, CallbackFlags(overflow))
+            except Exception as e:
+                logger.error(f"Synthetic input callback failed: {e}")
+                break
+            self.callback_durations.append(time.perf_counter() - started)
+            self.blocks += 1
+            overflow = False
+            due += period
+
+    def stats(self):
+        durations = np.array(self.callback_durations or [0.0])
+        return {
+            "blocks": self.blocks,
+            "overflows": self.overflows,
+            "callback_mean": float(durations.mean()),
+            "callback_p99": float(np.percentile(durations, 99)),
+            "callback_max": float(durations.max()),
+            "block_seconds": self.blocksize / self.samplerate,
+        }
@@ -0,0 +1,110 @@
+"""
+Downscaled spectrogram thumbnails for the labeler grids, rendered on first request and
+kept on disk with least-recently-used eviction.
+
+Thumbnails are keyed by sample ID and width, so they stay valid when a capture moves
+between stages or is renamed on classification. Recency survives restarts through the
+file modification time, which is bumped on every hit.
+"""
+import collections
+import os
+import threading
+
+from loguru import logger
+
+THUMBNAIL_DIR = os.path.join("data", "cache", "thumbnails")
+MAX_BYTES = 32 * 2 ** 20  # Cache size on disk before the least recently used thumbnails go
+DEFAULT_WIDTH = 160  # Columns, the mel bands are kept as rows
+MAX_WIDTH = 1024
+
+
+class ThumbnailCache:
+    def __init__(self, root=THUMBNAIL_DIR, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # file name -> size, least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(root, exist_ok=True)
+        found = []
+        for entry in os.scandir(root):
+            if entry.name.endswith(".png"):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+            elif entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self.size += size
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(sample_id, width):
+        return f"{sample_id}-{width}.png"
+
+    def get(self, sample_id, width, render):
+        """PNG bytes of a thumbnail, ``render()`` produces them when they are not cached"""
+        name = self.key(sample_id, width)
+        path = os.path.join(self.root, name)
+        with self._lock:
+            cached = name in self._entries
+            if cached:
+                self._entries.move_to_end(name)
+        if cached:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)
+                self.hits += 1
+                return data
+            except FileNotFoundError:
+                # Evicted by another thread between the lookup and the read
+                pass
+
+        self.misses += 1
+        data = render()
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.size += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._evict()
+        return data
+
+    def discard(self, sample_id):
+        """Drop every width of a sample, e.g. when it is deleted"""
+        prefix = f"{sample_id}-"
+        with self._lock:
+            for name in [name for name in self._entries if name.startswith(prefix)]:
+                self.size -= self._entries.pop(name)
+                self._remove(name)
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self.size -= size
+            self._remove(name)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.root, name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove thumbnail {name}: {e}")
+
+    def stats(self):
+        return {
+            "thumbnails": len(self),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,212 @@
+"""
+Train the tag classifier on the labelled samples and export it for the sampler.
+
+The dataset is the notebook's AudioDataset: mel features from the shared feature cache,
+with multi-hot labels (status and tags) read from the label store. The model is exported
+twice next to one metadata file:
+
+- <output>.npz: the portable format, scored by inference.PortableModel with numpy only
+- <output>.pt: TorchScript, for comparison and for tools that do have torch
+
+    python train.py data/samples --epochs 30 --output models/classifier --int8
+
+torch is only needed here, not on the capture device.
+"""
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from loguru import logger
+from torch.utils.data import DataLoader, Dataset, random_split
+
+import feature_cache
+import features
+import inference
+import labels
+
+CHANNELS = (16, 32, 64)  # Output channels of the conv blocks
+DB_SCALE = 40.0  # Mel dB in [-80, 0] is mapped to [-1, 1] by the first layer
+
+
+class AudioDataset(Dataset):
+    """Classified samples as ((1, n_mels, frames) tensor, multi-hot label vector) pairs"""
+
+    def __init__(self, data_dirs, label_store, tags, frames=None, sample_rate=feature_cache.SAMPLE_RATE,
+                 cache_dir=feature_cache.CACHE_DIR, **filters):
+        sample_ids, matrix = label_store.label_matrix(tags, **filters)
+        labels_by_id = dict(zip(sample_ids, matrix))
+
+        paths = sorted(path for data_dir in data_dirs for path in glob.glob(os.path.join(data_dir, "*.npy")))
+        self.audio_files = [path for path in paths if feature_cache.sample_id_from_filename(path) in labels_by_id]
+        self.cache = feature_cache.FeatureCache(cache_dir, sr=sample_rate)
+        self.cache.build(self.audio_files)
+
+        self.sample_ids = [feature_cache.sample_id_from_filename(path) for path in self.audio_files]
+        self.labels = np.array([labels_by_id[sample_id] for sample_id in self.sample_ids], dtype=np.float32)
+        self.frames = frames or max((self.cache.get(sample_id).shape[1] for sample_id in self.sample_ids), default=1)
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    def __getitem__(self, idx):
+        # Cropped or padded to a common width, as the sampler's InferenceStage does
+        mel = inference.pad_batch([self.cache.get(self.sample_ids[idx])], self.frames)[0]
+        return torch.from_numpy(mel), torch.from_numpy(self.labels[idx])
+
+
+class Affine(nn.Module):
+    def __init__(self, scale, offset):
+        super().__init__()
+        self.scale = scale
+        self.offset = offset
+
+    def forward(self, x):
+        return x * self.scale + self.offset
+
+
+class TagCNN(nn.Module):
+    """Conv blocks over the mel matrix, global average pooling and one logit per tag"""
+
+    def __init__(self, n_tags, channels=CHANNELS):
+        super().__init__()
+        layers = [Affine(1.0 / DB_SCALE, 1.0)]
+        in_channels = 1
+        for i, out_channels in enumerate(channels):
+            layers += [nn.Conv2d(in_channels, out_channels, 3, padding=1), nn.BatchNorm2d(out_channels), nn.ReLU()]
+            if i < len(channels) - 1:
+                layers.append(nn.MaxPool2d(2))
+            in_channels = out_channels
+        layers += [nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(in_channels, n_tags)]
+        self.layers = nn.Sequential(*layers)
+
+    def forward(self, x):
+        return self.layers(x)
+
+
+def portable_graph(model):
+    """
+    (graph, weights) of a TagCNN for inference.save_portable. Batch norms are folded
+    into the convolution before them, so inference is conv, relu and pooling only.
+    """
+    graph, weights = [], {}
+    modules = list(model.layers)
+    for i, module in enumerate(modules):
+        name = f"layers.{i}"
+        if isinstance(module, Affine):
+            graph.append({"op": "affine", "scale": module.scale, "offset": module.offset})
+        elif isinstance(module, nn.Conv2d):
+            weight, bias = module.weight.detach(), module.bias.detach()
+            following = modules[i + 1] if i + 1 < len(modules) else None
+            if isinstance(following, nn.BatchNorm2d):
+                scale = following.weight.detach() / torch.sqrt(following.running_var + following.eps)
+                weight = weight * scale[:, None, None, None]
+                bias = (bias - following.running_mean) * scale + following.bias.detach()
+            graph.append({"op": "conv2d", "name": name, "padding": module.padding[0]})
+            weights[f"{name}.weight"], weights[f"{name}.bias"] = weight.numpy(), bias.numpy()
+        elif isinstance(module, nn.BatchNorm2d):
+            continue
+        elif isinstance(module, nn.ReLU):
+            graph.append({"op": "relu"})
+        elif isinstance(module, nn.MaxPool2d):
+            graph.append({"op": "maxpool2d", "kernel": module.kernel_size})
+        elif isinstance(module, nn.AdaptiveAvgPool2d):
+            graph.append({"op": "global_avg_pool"})
+        elif isinstance(module, nn.Flatten):
+            continue
+        elif isinstance(module, nn.Linear):
+            graph.append({"op": "linear", "name": name})
+            weights[f"{name}.weight"] = module.weight.detach().numpy()
+            weights[f"{name}.bias"] = module.bias.detach().numpy()
+        else:
+            raise ValueError(f"No portable form of {type(module).__name__}")
+    return graph, weights
+
+
+def export(model, output, tags, frames, threshold=0.5, int8=False):
+    """Write <output>.npz, <output>.pt and their shared <output>.json"""
+    model.eval()
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    graph, weights = portable_graph(model)
+    metadata = {"tags": tags, "n_mels": features.MEL_PARAMS["n_mels"], "frames": frames, "threshold": threshold}
+    inference.save_portable(f"{output}.npz", graph, weights, metadata, int8=int8)
+    torch.jit.script(model).save(f"{output}.pt")
+    logger.info(f"Exported {output}.npz ({os.path.getsize(f'{output}.npz') / 1024:.0f} KiB"
+                f"{', int8' if int8 else ''}) and {output}.pt")
+
+
+def evaluate(model, loader, loss_fn):
+    model.eval()
+    total, correct, count = 0.0, 0, 0
+    with torch.inference_mode():
+        for x, y in loader:
+            logits = model(x)
+            total += loss_fn(logits, y).item() * len(x)
+            correct += ((logits > 0) == (y > 0.5)).sum().item()
+            count += y.numel()
+    return total / max(len(loader.dataset), 1), correct / max(count, 1)
+
+
+def train(dataset, n_tags, epochs=30, batch_size=32, lr=1e-3, validation=0.2):
+    n_validation = int(len(dataset) * validation)
+    train_set, validation_set = random_split(dataset, [len(dataset) - n_validation, n_validation])
+    train_loader = DataLoader(train_set, batch_size=batch_size, shuffle=True)
+    validation_loader = DataLoader(validation_set, batch_size=batch_size)
+
+    model = TagCNN(n_tags)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    loss_fn = nn.BCEWithLogitsLoss()
+    for epoch in range(1, epochs + 1):
+        model.train()
+        started, total = time.perf_counter(), 0.0
+        for x, y in train_loader:
+            optimizer.zero_grad()
+            loss = loss_fn(model(x), y)
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(x)
+        message = f"Epoch {epoch}: loss {total / max(len(train_set), 1):.4f}"
+        if n_validation:
+            validation_loss, accuracy = evaluate(model, validation_loader, loss_fn)
+            message += f", validation loss {validation_loss:.4f}, tag accuracy {accuracy:.3f}"
+        logger.info(f"{message} in {time.perf_counter() - started:.1f} s")
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dirs", nargs="*", default=[os.path.join("data", "samples")],
+                        help="directories of classified .npy samples")
+    parser.add_argument("--output", default=os.path.splitext(inference.MODEL_PATH)[0],
+                        help="exported model path without extension")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--validation", type=float, default=0.2, help="share of samples held out")
+    parser.add_argument("--frames", type=int, help="input width, the longest sample by default")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--since", help="only samples captured since, e.g. 2025-03-01")
+    parser.add_argument("--int8", action="store_true", help="store the portable weights quantized to int8")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
+    label_store = labels.LabelStore()
+    tags = [*label_store.statuses(), *label_store.tags()]
+    dataset = AudioDataset(args.data_dirs, label_store, tags, frames=args.frames, since=args.since)
+    if not len(dataset):
+        parser.error("no classified samples found")
+    logger.info(f"Training on {len(dataset)} samples, {len(tags)} tags, {dataset.frames} frames")
+
+    model = train(dataset, len(tags), epochs=args.epochs, batch_size=args.batch_size, lr=args.lr,
+                  validation=args.validation)
+    export(model, args.output, tags, dataset.frames, threshold=args.threshold, int8=args.int8)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import queue
+import threading
+
+import numpy as np
+from loguru import logger
+
+# Backpressure policies applied when the queue is full
+DROP_OLDEST = "drop_oldest"  # discard the longest-waiting capture to make room
+DROP_NEWEST = "drop_newest"  # discard the capture being submitted
+BLOCK = "block"  # wait up to block_timeout for room, then drop the new capture
+
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class SampleWriter:
+    """
+    Bounded producer/consumer stage between the audio callback and sample persistence.
+
+    The callback only calls ``submit()``, which copies the capture and enqueues it.
+    Worker threads take captures off the queue and hand them to ``handler``, which
+    does the slow rendering and file writes.
+    """
+
+    def __init__(self, handler, maxsize=16, workers=2, policy=DROP_OLDEST, block_timeout=0.5):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+
+        # Counters
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def start(self):
+        """Start the worker threads, safe to call more than once"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"sample-writer-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Sample writer started: {self.workers} workers, queue {self.maxsize}, policy {self.policy}")
+
+    def stop(self, timeout=None):
+        """Drain the queue and stop the worker threads"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, audio_sample, *args):
+        """Copy a capture into the queue, returns False if it was dropped. Extra args are passed to the handler"""
+        item = (np.array(audio_sample, dtype=np.float32), args)
+        with self._lock:
+            self.submitted += 1
+
+        if self.policy == BLOCK:
+            try:
+                self._queue.put(item, timeout=self.block_timeout)
+            except queue.Full:
+                return self._drop("queue full after blocking")
+        elif self.policy == DROP_NEWEST:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                return self._drop("queue full, dropping newest capture")
+        else:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self._queue.task_done()
+                        self._drop("queue full, dropping oldest capture")
+                    except queue.Empty:
+                        pass
+
+        with self._lock:
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self.depth(),
+                "queue_max_depth": self.max_depth,
+                "queue_size": self.maxsize,
+                "policy": self.policy,
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+            }
+
+    def join(self):
+        """Block until every queued capture has been handled"""
+        self._queue.join()
+
+    def _drop(self, reason):
+        with self._lock:
+            self.dropped += 1
+        logger.warning(f"Dropped capture: {reason}")
+        return False
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self.handler(item[0], *item[1])
+                with self._lock:
+                    self.processed += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.warning(f"Sample writer error: {e}")
+            finally:
+                self._queue.task_done()